@@ -1,64 +1,114 @@
 #dependencies
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify
+import contextlib
+import hashlib
+import mmap
 import os
-import pandas as pd
-from azure.ai.formrecognizer import DocumentAnalysisClient
-from azure.core.credentials import AzureKeyCredential
 from dotenv import load_dotenv
-import io
-
-app = Flask(__name__)
+import sys
+import tempfile
+from result_store import get_result_store
+
+# Modules shared with the Level-1 Streamlit apps
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analysis import begin_analyze_document, get_document_analysis_client
+import shared_modules  # Level-2 modules shared with Level-1
+from invoice_items import normalize_items, select_fields
+from preflight import preflight, rejection
+from invoice_split import analyze_parts, open_document, split_invoices
 
 # Load environment variables
 load_dotenv('.env')
-FR_ENDPOINT = os.getenv('AZURE_ENDPOINT')
-FR_KEY = os.getenv('AZURE_KEY')
-
-# Initialize the Document Analysis Client
-document_analysis_client = DocumentAnalysisClient(
-    endpoint=FR_ENDPOINT, credential=AzureKeyCredential(FR_KEY)
-)
-
-def extract_invoice_line_items(document, file_name, selected_fields):
-    # Start analysis using the prebuilt invoice model
-    poller = document_analysis_client.begin_analyze_document(
-        "prebuilt-invoice", document=document
-    )
-    prebuilt_result = poller.result()
-
-    # Extract line items into a list
-    items = []
-    for document in prebuilt_result.documents:
-        if "Items" in document.fields:
-            for item in document.fields["Items"].value:
-                item_dict = {"file_name": file_name}
-                for key, field in item.value.items():
-                    if field and field.value:
-                        # Check if the field is a CurrencyValue
-                        if isinstance(field.value, dict) and "amount" in field.value:
-                            item_dict[key] = field.value["amount"]  # Get only the numeric value
-                        else:
-                            item_dict[key] = field.value  # Keep the value as it is
-
 
-                items.append(item_dict)
+# Upload limits. The limit that matters is the one per file: larger files
+# are rejected on their own and the rest of the batch is analyzed. Uploads
+# are spooled to disk, so the request cap only bounds the disk one request
+# may fill; by default it covers a batch of UPLOAD_MAX_FILES files at the
+# file limit (20 x 50 MB), and larger requests get a 413.
+UPLOAD_MAX_FILE_MB = float(os.getenv('UPLOAD_MAX_FILE_MB', '50'))
+UPLOAD_MAX_FILES = int(os.getenv('UPLOAD_MAX_FILES', '20'))
+UPLOAD_MAX_REQUEST_MB = float(os.getenv('UPLOAD_MAX_REQUEST_MB') or UPLOAD_MAX_FILE_MB * UPLOAD_MAX_FILES)
+
+# Uploads above this size are spooled to temporary files instead of memory
+UPLOAD_SPOOL_KB = int(os.getenv('UPLOAD_SPOOL_KB', '512'))
+
+# Spooled uploads and the invoices split from them go here; the system temp directory by default
+UPLOAD_SPOOL_DIR = os.getenv('UPLOAD_SPOOL_DIR') or None
+
+class SpoolingRequest(Request):
+    # Werkzeug writes each uploaded file to the stream returned here while
+    # parsing the form. Named files can be memory mapped and reopened by
+    # PyMuPDF and the Azure client, so a request never holds its uploads in
+    # memory; the files are deleted when the request closes them.
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is None or total_content_length > UPLOAD_SPOOL_KB * 1024:
+            return tempfile.NamedTemporaryFile("wb+", dir=UPLOAD_SPOOL_DIR)
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
 
-    df = pd.DataFrame(items)
-    df = df.rename(columns={"Description": "item_name", "Amount": "item_amount"})
-
-    # Ensure "item_name" and "item_amount" are always included in the selected fields
-    selected_fields = ["item_name", "item_amount"] + selected_fields
-
-    # Ensure all selected columns are in the dataframe, and fill missing columns with NaN
-    for field in selected_fields:
-        if field not in df.columns:
-            df[field] = pd.NA  # Use pd.NA for missing fields
+app = Flask(__name__)
+app.request_class = SpoolingRequest
+app.config['MAX_CONTENT_LENGTH'] = int(UPLOAD_MAX_REQUEST_MB * 1024 * 1024)
 
-    # Return the dataframe with selected columns
-    selected_columns = ["file_name"] + selected_fields
-    df = df[selected_columns]
+def analyze_invoice(document):
+    # Start analysis using the prebuilt invoice model, through the shared rate limiter
+    poller = begin_analyze_document("prebuilt-invoice", document)
+    return poller.result()
 
-    return df
+# Invoice-level fields stored alongside the line items
+def invoice_summary(prebuilt_result):
+    summary = {}
+    for document in prebuilt_result.documents:
+        for key, name in (("vendor", "VendorName"), ("invoice_date", "InvoiceDate"), ("invoice_total", "InvoiceTotal")):
+            field = document.fields.get(name)
+            if key not in summary and field and field.value:
+                summary[key] = field.value
+    return summary
+
+def extract_invoice_line_items(document, file_name, selected_fields, prebuilt_result=None, invoice_index=1):
+    if prebuilt_result is None:
+        prebuilt_result = analyze_invoice(document)
+
+    # Typed line item columns; CurrencyValue amounts are split into amount and currency
+    df = normalize_items(prebuilt_result, file_name, invoice_index)
+
+    # Return the dataframe with the base columns and the selected fields
+    return select_fields(df, selected_fields)
+
+# An uploaded file as the path of its spooled file, or its bytes when it was
+# small enough to be kept in memory
+def upload_source(uploaded_file):
+    stream = uploaded_file.stream
+    if isinstance(getattr(stream, 'name', None), str):
+        stream.flush()
+        return stream.name
+    stream.seek(0)
+    return stream.read()
+
+def source_size(source):
+    return os.path.getsize(source) if isinstance(source, str) else len(source)
+
+# The document's bytes, memory mapped for files on disk so only the pages
+# read are loaded
+@contextlib.contextmanager
+def mapped(source):
+    if not isinstance(source, str):
+        yield source
+        return
+    if source_size(source) == 0:
+        # An empty file cannot be mapped
+        yield b""
+        return
+    with open(source, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        yield data
+
+def document_hash(source):
+    with mapped(source) as data:
+        return hashlib.sha256(data).hexdigest()
+
+# The file is streamed to Azure from disk rather than loaded first
+def analyze_source(source):
+    with open_document(source) as document:
+        return analyze_invoice(document)
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -70,6 +120,7 @@ def upload_file():
     selected_fields = request.form.getlist('selected_fields')
 
     all_invoices_data = []
+    rejected = []
 
     # Process each uploaded file
     for uploaded_file in files:
@@ -77,14 +128,75 @@ def upload_file():
             return jsonify({"error": "No selected file"}), 400
 
         # Process the file (PDF or Image)
-        document = io.BytesIO(uploaded_file.read())
-        df = extract_invoice_line_items(document, uploaded_file.filename, selected_fields)
-        all_invoices_data.append(df.to_dict(orient='records'))
+        source = upload_source(uploaded_file)
+        size_mb = source_size(source) / (1024 * 1024)
+        if size_mb > UPLOAD_MAX_FILE_MB:
+            reasons = [rejection("too_large", f"The file is {size_mb:.1f} MB; the limit is {UPLOAD_MAX_FILE_MB:g} MB.")]
+        else:
+            # Encrypted, truncated or oversize files are rejected before any remote call
+            with mapped(source) as data:
+                reasons = preflight(data, source if isinstance(source, str) else None)
+        if reasons:
+            rejected.append({"file_name": uploaded_file.filename, "reasons": reasons})
+            continue
+
+        with tempfile.TemporaryDirectory(dir=UPLOAD_SPOOL_DIR) as directory:
+            # A PDF holding several invoices is split and its invoices analyzed concurrently
+            parts = split_invoices(source, get_document_analysis_client(), directory if isinstance(source, str) else None)
+            prebuilt_results = analyze_parts(parts, lambda part, index: analyze_source(part))
+            for index, ((_, part), prebuilt_result) in enumerate(zip(parts, prebuilt_results), start=1):
+                df = extract_invoice_line_items(
+                    None, uploaded_file.filename, selected_fields, prebuilt_result=prebuilt_result, invoice_index=index
+                )
+                records = df.to_dict(orient='records')
+                all_invoices_data.append(records)
+
+                # Persist each invoice so it can be looked up later without re-analyzing
+                get_result_store().save(
+                    document_hash(part), uploaded_file.filename, invoice_summary(prebuilt_result), records
+                )
+        # Done with this upload; its spooled file need not wait for the end of the request
+        uploaded_file.close()
 
     # Combine all the data into a single list of records
     combined_data = [item for sublist in all_invoices_data for item in sublist]
 
-    return jsonify({"data": str(combined_data)}), 200
+    return jsonify({"data": str(combined_data), "rejected": rejected}), 200
+
+@app.errorhandler(413)
+def request_too_large(error):
+    return jsonify({"error": f"The upload exceeds the {UPLOAD_MAX_REQUEST_MB:g} MB request limit; "
+                             f"send at most {UPLOAD_MAX_FILES} files of up to {UPLOAD_MAX_FILE_MB:g} MB each"}), 413
+
+# Filters shared by the query endpoints
+def query_filters():
+    return {
+        "document_hash": request.args.get('document_hash'),
+        "file_name": request.args.get('file_name'),
+        "vendor": request.args.get('vendor'),
+        "date_from": request.args.get('date_from'),
+        "date_to": request.args.get('date_to'),
+        "page": request.args.get('page', 1, type=int),
+        "page_size": request.args.get('page_size', type=int),
+    }
+
+# Stored invoices, filtered by document_hash, file_name, vendor (prefix),
+# date_from/date_to (YYYY-MM-DD) and paginated with page/page_size
+@app.route('/invoices', methods=['GET'])
+def list_invoices():
+    return jsonify(get_result_store().documents(**query_filters())), 200
+
+@app.route('/invoices/<document_hash>', methods=['GET'])
+def get_invoice(document_hash):
+    invoice = get_result_store().document(document_hash)
+    if invoice is None:
+        return jsonify({"error": "Invoice not found"}), 404
+    return jsonify(invoice), 200
+
+# Stored line items with the same filters as /invoices
+@app.route('/line-items', methods=['GET'])
+def list_line_items():
+    return jsonify(get_result_store().line_items(**query_filters())), 200
 
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
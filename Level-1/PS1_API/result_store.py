@@ -0,0 +1,189 @@
+import datetime
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv('.env')
+
+# SQLite file holding every extraction served by the API
+RESULT_STORE_DB = os.getenv('RESULT_STORE_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.db'))
+
+# Page size bounds for the query endpoints
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+# Values from Azure (CurrencyValue, dates, addresses) as JSON-friendly
+# values; missing values (None, NaN, pd.NA, NaT) become None, since NaN is
+# not valid JSON
+def to_plain(value):
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if type(value).__name__ in ('NAType', 'NaTType'):
+        return None
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if hasattr(value, 'amount'):
+        return value.amount
+    return str(value)
+
+
+def to_amount(value):
+    value = to_plain(value)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    try:
+        return float(str(value).replace(',', ''))
+    except (TypeError, ValueError):
+        return None
+
+
+# Stored item fields; NaN written by earlier versions is read back as None
+def load_fields(text: str) -> dict:
+    return json.loads(text, parse_constant=lambda constant: None)
+
+
+class ResultStore:
+    # Extracted invoices and their line items, indexed for the lookups the
+    # finance team makes: by document hash, file name, vendor and invoice date
+    def __init__(self, db_path: str = RESULT_STORE_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                document_hash TEXT PRIMARY KEY,
+                file_name TEXT NOT NULL,
+                vendor TEXT COLLATE NOCASE,
+                invoice_date TEXT,
+                invoice_total REAL,
+                item_count INTEGER NOT NULL,
+                extracted_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS documents_file_name ON documents (file_name);
+            CREATE INDEX IF NOT EXISTS documents_vendor ON documents (vendor);
+            CREATE INDEX IF NOT EXISTS documents_invoice_date ON documents (invoice_date);
+
+            CREATE TABLE IF NOT EXISTS line_items (
+                document_hash TEXT NOT NULL REFERENCES documents (document_hash) ON DELETE CASCADE,
+                row_index INTEGER NOT NULL,
+                file_name TEXT NOT NULL,
+                item_name TEXT,
+                item_amount REAL,
+                fields TEXT NOT NULL,
+                PRIMARY KEY (document_hash, row_index)
+            );
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+
+    # Replaces any earlier extraction of the same document in one transaction
+    def save(self, document_hash: str, file_name: str, summary: dict, rows):
+        rows = [{key: to_plain(value) for key, value in row.items()} for row in rows]
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN')
+            conn.execute('DELETE FROM documents WHERE document_hash = ?', (document_hash,))
+            conn.execute(
+                'INSERT INTO documents (document_hash, file_name, vendor, invoice_date, invoice_total, item_count, extracted_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (document_hash, file_name, summary.get('vendor'), to_plain(summary.get('invoice_date')),
+                 to_amount(summary.get('invoice_total')), len(rows), time.time())
+            )
+            conn.executemany(
+                'INSERT INTO line_items (document_hash, row_index, file_name, item_name, item_amount, fields) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(document_hash, index, file_name, row.get('item_name'), to_amount(row.get('item_amount')),
+                  json.dumps(row, default=str)) for index, row in enumerate(rows)]
+            )
+
+    @staticmethod
+    def _filters(document_hash=None, file_name=None, vendor=None, date_from=None, date_to=None):
+        clauses, params = [], []
+        if document_hash:
+            clauses.append('d.document_hash = ?')
+            params.append(document_hash)
+        if file_name:
+            clauses.append('d.file_name = ?')
+            params.append(file_name)
+        if vendor:
+            # Case-insensitive prefix match, served by the NOCASE vendor index
+            clauses.append('d.vendor LIKE ?')
+            params.append(vendor.replace('%', '').replace('_', '') + '%')
+        if date_from:
+            clauses.append('d.invoice_date >= ?')
+            params.append(date_from)
+        if date_to:
+            clauses.append('d.invoice_date <= ?')
+            params.append(date_to)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    @staticmethod
+    def _page(page, page_size):
+        page = max(int(page or 1), 1)
+        page_size = min(max(int(page_size or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+        return page, page_size
+
+    def _query(self, columns: str, source: str, order: str, filters: dict, page, page_size):
+        page, page_size = self._page(page, page_size)
+        where, params = self._filters(**filters)
+        conn = self._connect()
+        total = conn.execute(f'SELECT COUNT(*) FROM {source}{where}', params).fetchone()[0]
+        rows = conn.execute(
+            f'SELECT {columns} FROM {source}{where} ORDER BY {order} LIMIT ? OFFSET ?',
+            params + [page_size, (page - 1) * page_size]
+        ).fetchall()
+        return {'page': page, 'page_size': page_size, 'total': total, 'data': rows}
+
+    def documents(self, page=1, page_size=DEFAULT_PAGE_SIZE, **filters):
+        result = self._query('d.*', 'documents d', 'd.invoice_date DESC, d.document_hash', filters, page, page_size)
+        result['data'] = [dict(row) for row in result['data']]
+        return result
+
+    def line_items(self, page=1, page_size=DEFAULT_PAGE_SIZE, **filters):
+        result = self._query(
+            'i.document_hash, i.row_index, i.fields, d.vendor, d.invoice_date',
+            'line_items i JOIN documents d ON d.document_hash = i.document_hash',
+            'i.document_hash, i.row_index', filters, page, page_size
+        )
+        result['data'] = [
+            dict(load_fields(row['fields']), document_hash=row['document_hash'], row_index=row['row_index'],
+                 vendor=row['vendor'], invoice_date=row['invoice_date'])
+            for row in result['data']
+        ]
+        return result
+
+    def document(self, document_hash: str):
+        conn = self._connect()
+        row = conn.execute('SELECT * FROM documents WHERE document_hash = ?', (document_hash,)).fetchone()
+        if row is None:
+            return None
+        items = conn.execute(
+            'SELECT fields FROM line_items WHERE document_hash = ? ORDER BY row_index', (document_hash,)
+        ).fetchall()
+        return dict(row, items=[load_fields(item['fields']) for item in items])
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_result_store() -> ResultStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResultStore()
+        return _store
@@ -0,0 +1,40 @@
+import functools
+import os
+
+from dotenv import load_dotenv
+
+import shared_modules  # Level-2 modules shared with Level-1
+from ratelimit import azure_retry_policy, form_recognizer_limiter
+
+load_dotenv('.env')
+
+# Azure Form Recognizer configurations
+FR_ENDPOINT = os.getenv('AZURE_ENDPOINT')
+FR_KEY = os.getenv('AZURE_KEY')
+
+
+# Build the Document Analysis Client on first use so startup stays cheap.
+# Throttled requests are left to the shared rate limiter.
+@functools.lru_cache(maxsize=None)
+def get_document_analysis_client():
+    from azure.ai.formrecognizer import DocumentAnalysisClient
+    from azure.core.credentials import AzureKeyCredential
+
+    return DocumentAnalysisClient(
+        endpoint=str(FR_ENDPOINT), credential=AzureKeyCredential(str(FR_KEY)), retry_policy=azure_retry_policy()
+    )
+
+
+# Start an analysis through the rate limiter shared by every Level-1 app,
+# worker thread and process, retrying throttled submissions after their
+# Retry-After
+def begin_analyze_document(model_id: str, document, client=None):
+    client = client or get_document_analysis_client()
+
+    def begin():
+        # A throttled attempt may have consumed part of the stream
+        if hasattr(document, 'seek'):
+            document.seek(0)
+        return client.begin_analyze_document(model_id, document=document)
+
+    return form_recognizer_limiter(str(FR_ENDPOINT)).call(begin)
@@ -1,23 +1,53 @@
-import os
-import pandas as pd
+import hashlib
 import streamlit as st
 from dotenv import load_dotenv
-from azure.ai.formrecognizer import DocumentAnalysisClient
-from azure.core.credentials import AzureKeyCredential
 import io
 import base64
+from analysis import begin_analyze_document
+import shared_modules  # Level-2 modules shared with Level-1
+from invoice_items import normalize_items, to_text
+from preflight import describe as describe_rejection, preflight
 
 # Load environment variables
 load_dotenv('.env')
 
-# Azure Form Recognizer configurations
-FR_ENDPOINT = os.getenv('AZURE_ENDPOINT')
-FR_KEY = os.getenv('AZURE_KEY')
-
-# Initialize the Document Analysis Client
-document_analysis_client = DocumentAnalysisClient(
-    endpoint=str(FR_ENDPOINT), credential=AzureKeyCredential(str(FR_KEY))
-)
+# Normalized item columns shown by the full invoice extractor, with their labels
+DISPLAY_COLUMNS = {
+    "item_name": "Description",
+    "Quantity": "Quantity",
+    "Unit": "Unit",
+    "UnitPrice": "Unit Price",
+    "item_amount": "Amount",
+    "currency": "Currency",
+    "confidence": "Confidence",
+}
+
+# Analyze an invoice with the prebuilt model and return its general fields and line items
+def extract_invoice(document):
+    # Analyze using Prebuilt Invoice Model, through the shared rate limiter
+    poller = begin_analyze_document("prebuilt-invoice", document)
+    prebuilt_result = poller.result()
+
+    # Extract general fields
+    fields = []
+    for doc in prebuilt_result.documents:
+        for field_name, field in doc.fields.items():
+            if field.value_type != "list":  # Exclude the 'Items' field for now
+                fields.append((field_name, to_text(field.value)))
+
+    # Extract items as typed columns, labelled for display
+    items = normalize_items(prebuilt_result, None)[list(DISPLAY_COLUMNS)].rename(columns=DISPLAY_COLUMNS)
+
+    return fields, items
+
+# Memoize extraction per file content for the session, so widget changes
+# and reruns do not call Azure again
+def analyze_invoice(file_bytes):
+    cache = st.session_state.setdefault("invoice_cache", {})
+    key = hashlib.sha256(file_bytes).hexdigest()
+    if key not in cache:
+        cache[key] = extract_invoice(file_bytes)
+    return cache[key]
 
 # Full invoice extractor function
 def full_invoice_extractor():
@@ -35,6 +65,12 @@ def full_invoice_extractor():
 
     if uploaded_files:
         for uploaded_file in uploaded_files:
+            # Encrypted, truncated or oversize files are rejected before any remote call
+            reasons = preflight(uploaded_file.getvalue())
+            if reasons:
+                st.error(f"Skipped {uploaded_file.name}: {describe_rejection(reasons)}")
+                continue
+
             # Create two columns for layout
             col1, col2 = st.columns(2)
             file_name = uploaded_file.name
@@ -52,39 +88,16 @@ def full_invoice_extractor():
                 try:
                     st.write(f"### Extracted Features from {uploaded_file.name}")
 
-                    # Read the file bytes
-                    document = uploaded_file.read()
-
-                    # Analyze using Prebuilt Invoice Model
-                    poller = document_analysis_client.begin_analyze_document(
-                        "prebuilt-invoice", document=document
-                    )
-                    prebuilt_result = poller.result()
-
-                    # Extract general fields
-                    for doc in prebuilt_result.documents:
-                        for field_name, field in doc.fields.items():
-                            if field.value_type != "list":  # Exclude the 'Items' field for now
-                                st.write(f"**{field_name}:** {field.value}")
-
-                    # Extract items into a DataFrame
-                    items = []
-                    for doc in prebuilt_result.documents:
-                        if "Items" in doc.fields:
-                            for item in doc.fields["Items"].value:
-                                item_dict = {
-                                    "Description": item.value.get("Description").value if item.value.get("Description") else None,
-                                    "Quantity": item.value.get("Quantity").value if item.value.get("Quantity") else None,
-                                    "Unit": item.value.get("Unit").value if item.value.get("Unit") else None,
-                                    "Unit Price": item.value.get("UnitPrice").value.amount if item.value.get("UnitPrice") else None,
-                                    "Amount": item.value.get("Amount").value.amount if item.value.get("Amount") else None,
-                                }
-                                items.append(item_dict)
+                    # Analyze once per file content; reruns reuse the session's result
+                    fields, items = analyze_invoice(uploaded_file.getvalue())
+
+                    # Show general fields
+                    for field_name, value in fields:
+                        st.write(f"**{field_name}:** {value}")
 
                     # Display DataFrame if items are extracted
-                    if items:
-                        df = pd.DataFrame(items)
-                        st.dataframe(df)
+                    if not items.empty:
+                        st.dataframe(items)
 
                 except Exception as e:
                     st.write(f"Error processing invoice {uploaded_file.name}: {e}")
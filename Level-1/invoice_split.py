@@ -0,0 +1,168 @@
+import io
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from analysis import begin_analyze_document
+
+load_dotenv('.env')
+
+# PDFs holding several invoices back to back are split into one document
+# per invoice before analysis; "0" analyzes every PDF as a single invoice
+SPLIT_INVOICES = os.getenv('SPLIT_INVOICES', '1') == '1'
+
+# Scans without a text layer get a first pass of the read model, which
+# costs a fraction of the invoice model, to find the boundaries; "0"
+# analyzes them whole
+SPLIT_READ_FIRST_PASS = os.getenv('SPLIT_READ_FIRST_PASS', '1') == '1'
+
+# Invoices of one PDF analyzed at the same time; their submissions still
+# share the Form Recognizer rate limiter with every other analysis
+SPLIT_WORKERS = int(os.getenv('SPLIT_WORKERS', '4'))
+
+# A page whose text layer has fewer characters than this counts as a scan
+MIN_TEXT_CHARS = 20
+
+# "Invoice No: INV-2024/117", "Bill # 5521"; the number must contain a digit
+INVOICE_NUMBER = re.compile(
+    r"\b(?:invoice|inv|bill|receipt)\s*(?:no|number|num|#)\.?\s*[:#\-]?\s*([A-Z0-9][A-Z0-9\-/]*\d[A-Z0-9\-/]*)",
+    re.IGNORECASE,
+)
+# "Page 2 of 3", "Page 2/3", "Page 2"
+PAGE_NUMBER = re.compile(r"\bpage\s*(\d+)(?:\s*(?:of|/)\s*(\d+))?\b", re.IGNORECASE)
+# A title line opening an invoice: "TAX INVOICE", "Invoice", "Bill of Supply", "Cash Bill"
+INVOICE_TITLE = re.compile(
+    r"^\s*(?:(?:tax|sales|retail|commercial|proforma)\s+)?invoice\b|^\s*bill of supply\b|^\s*(?:cash\s+)?(?:bill|receipt)\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+# Titles are only looked for in the first lines of a page
+TITLE_LINES = 10
+
+
+# A document is passed around as its bytes or, for uploads spooled to disk,
+# as the path of its file, which is read from disk as needed
+def open_pdf(source):
+    import fitz  # PyMuPDF
+
+    if isinstance(source, str):
+        return fitz.open(source, filetype="pdf")
+    return fitz.open(stream=source, filetype="pdf")
+
+
+def open_document(source):
+    return open(source, "rb") if isinstance(source, str) else io.BytesIO(source)
+
+
+def is_pdf(source) -> bool:
+    with open_document(source) as f:
+        return f.read(4) == b"%PDF"
+
+
+def text_layer_pages(source) -> list:
+    with open_pdf(source) as doc:
+        return [page.get_text() for page in doc]
+
+
+# Text of every page from the read model, for scans
+def read_pages(source, client) -> list:
+    with open_document(source) as document:
+        result = begin_analyze_document("prebuilt-read", document, client=client).result()
+    return ["\n".join(line.content for line in page.lines or []) for page in result.pages]
+
+
+# Cues of one page: its invoice number, printed page number and page count,
+# and whether it opens with an invoice title
+def page_cues(text: str) -> dict:
+    number = INVOICE_NUMBER.search(text)
+    page = PAGE_NUMBER.search(text)
+    head = "\n".join(text.strip().splitlines()[:TITLE_LINES])
+    return {
+        "number": number.group(1).upper() if number else None,
+        "page": int(page.group(1)) if page else None,
+        "pages": int(page.group(2)) if page and page.group(2) else None,
+        "title": bool(INVOICE_TITLE.search(head)),
+    }
+
+
+# (start, end) page ranges of the invoices, end exclusive. A page starts a
+# new invoice when:
+# - it carries another invoice number than the open invoice
+# - its printed page number resets to 1
+# - the previous page was the last one of its count ("Page 3 of 3")
+# - it opens with an invoice title and has no page or invoice number
+# A page repeating the open invoice's number always continues it.
+def find_boundaries(page_texts: list) -> list:
+    starts = [0] if page_texts else []
+    current = None      # invoice number of the open invoice
+    previous = None
+    for i, text in enumerate(page_texts):
+        cues = page_cues(text)
+        if i > 0:
+            if cues["number"] is not None and cues["number"] == current:
+                new = False
+            elif cues["number"] is not None and current is not None:
+                new = True
+            elif cues["page"] == 1:
+                new = True
+            elif previous["page"] is not None and previous["page"] == previous["pages"]:
+                new = True
+            else:
+                new = cues["title"] and cues["page"] is None and cues["number"] is None
+            if new:
+                starts.append(i)
+                current = None
+        current = current or cues["number"]
+        previous = cues
+    return [(start, end) for start, end in zip(starts, starts[1:] + [len(page_texts)])]
+
+
+# The page ranges as separate PDFs: bytes, or files written to `directory`
+# and given by path when one is passed
+def split_pdf(source, ranges: list, directory=None) -> list:
+    import fitz  # PyMuPDF
+
+    parts = []
+    with open_pdf(source) as doc:
+        for start, end in ranges:
+            with fitz.open() as part:
+                part.insert_pdf(doc, from_page=start, to_page=end - 1)
+                if directory is None:
+                    parts.append(part.tobytes(garbage=1))
+                else:
+                    fd, path = tempfile.mkstemp(suffix=".pdf", dir=directory)
+                    os.close(fd)
+                    part.save(path, garbage=1)
+                    parts.append(path)
+    return parts
+
+
+# The invoices of an uploaded document as (page range, source) pairs, in
+# page order. Images and single invoice PDFs come back whole. `client` is
+# the Document Analysis Client used for the read pass over scans; the parts
+# are written to `directory` when one is given.
+def split_invoices(source, client=None, directory=None) -> list:
+    if not SPLIT_INVOICES or not is_pdf(source):
+        return [(None, source)]
+    texts = text_layer_pages(source)
+    if len(texts) < 2:
+        return [(None, source)]
+    if sum(len(text.strip()) >= MIN_TEXT_CHARS for text in texts) < len(texts) / 2:
+        if not SPLIT_READ_FIRST_PASS or client is None:
+            return [(None, source)]
+        texts = read_pages(source, client)
+    ranges = find_boundaries(texts)
+    if len(ranges) < 2:
+        return [(None, source)]
+    return list(zip(ranges, split_pdf(source, ranges, directory)))
+
+
+# Results of `analyze(part, invoice_index)` for every invoice, with
+# invoice indexes from 1, analyzed SPLIT_WORKERS at a time, in page order
+def analyze_parts(parts: list, analyze) -> list:
+    if len(parts) == 1:
+        return [analyze(parts[0][1], 1)]
+    with ThreadPoolExecutor(max_workers=SPLIT_WORKERS) as executor:
+        return list(executor.map(analyze, [part for _, part in parts], range(1, len(parts) + 1)))
@@ -1,74 +1,118 @@
+import hashlib
 import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import pandas as pd
 import streamlit as st
 from dotenv import load_dotenv
-from azure.ai.formrecognizer import DocumentAnalysisClient
-from azure.core.credentials import AzureKeyCredential
 import io
 import base64
+from analysis import begin_analyze_document, get_document_analysis_client
+import shared_modules  # Level-2 modules shared with Level-1
+from invoice_items import normalize_items, select_fields as select_item_fields
+from invoice_split import analyze_parts, split_invoices
+from preflight import describe as describe_rejection, preflight
 
 # Load environment variables
 load_dotenv('.env')
 
-# Azure Form Recognizer configurations
-FR_ENDPOINT = os.getenv('AZURE_ENDPOINT')
-FR_KEY = os.getenv('AZURE_KEY')
+# Invoices analyzed at the same time when several files are uploaded
+MAX_WORKERS = int(os.getenv('LINE_ITEM_WORKERS', '4'))
 
-# Initialize the Document Analysis Client
-document_analysis_client = DocumentAnalysisClient(
-    endpoint=str(FR_ENDPOINT), credential=AzureKeyCredential(str(FR_KEY))
-)
-
-def extract_invoice_line_items(document, file_name, selected_fields):
-    # Start analysis using the prebuilt invoice model
-    poller = document_analysis_client.begin_analyze_document(
-        "prebuilt-invoice", document=document
-    )
+# Extract every line item field once; selected fields are projected from the result
+def extract_all_line_items(document, file_name, invoice_index=1):
+    # Start analysis using the prebuilt invoice model, through the shared rate limiter
+    poller = begin_analyze_document("prebuilt-invoice", document)
     prebuilt_result = poller.result()
 
-    # Extract line items into a list
-    items = []
-    for document in prebuilt_result.documents:
-        if "Items" in document.fields:
-            for item in document.fields["Items"].value:
-                item_dict = {"file_name": file_name}
-                for key, field in item.value.items():
-                    if field and field.value and (key in selected_fields or key in ["Description", "Amount"]):
-                        item_dict[key] = field.value
-                items.append(item_dict)
-
-    df = pd.DataFrame(items)
-    df = df.rename(columns={"Description": "item_name", "Amount": "item_amount"})
-
-    # Ensure "item_name" and "item_amount" are always included in the selected fields
-    selected_fields = ["item_name", "item_amount"] + selected_fields
-
-    # Ensure all selected columns are in the dataframe, and fill missing columns with NaN
-    for field in selected_fields:
-        if field not in df.columns:
-            df[field] = pd.NA  # Use pd.NA for missing fields
-
-    # Return the dataframe with selected columns
-    selected_columns = ["file_name"] + selected_fields
-    df = df[selected_columns]
+    # Typed line item columns: amount and currency, numeric quantity, ISO dates, confidence
+    return normalize_items(prebuilt_result, file_name, invoice_index)
 
+# Cheap column projection of the full line item frame
+def select_fields(df, file_name, selected_fields):
+    df = select_item_fields(df, selected_fields)
+    df["file_name"] = file_name
     return df
 
-def process_file(uploaded_file, selected_fields):
-    # Process the file (PDF or Image)
-    file_name = uploaded_file.name
-    file_type = uploaded_file.type
-
-    if file_type == "application/pdf":
-        # Handle PDF file
-        document = io.BytesIO(uploaded_file.read())
-    else:
-        # Handle image file
-        document = uploaded_file.read()
-
-    # Extract and return the DataFrame
-    df = extract_invoice_line_items(document, file_name, selected_fields)
-    return df, file_type, uploaded_file
+def extract_invoice_line_items(document, file_name, selected_fields):
+    return select_fields(extract_all_line_items(document, file_name), file_name, selected_fields)
+
+# A PDF holding several invoices is split at the invoice boundaries and its
+# invoices analyzed concurrently; rows carry their invoice's index in the file
+def extract_file_line_items(file_bytes, file_name):
+    parts = split_invoices(file_bytes, get_document_analysis_client())
+    frames = analyze_parts(parts, lambda part, index: extract_all_line_items(io.BytesIO(part), file_name, index))
+    return pd.concat(frames, ignore_index=True)
+
+# Runs on a worker thread, so it must not touch st.session_state
+def timed_extraction(file_bytes, file_name, started, idx):
+    started[idx] = time.perf_counter()
+    df = extract_file_line_items(file_bytes, file_name)
+    return df, time.perf_counter() - started[idx]
+
+# Analyze the uploaded files several at a time and render the combined table
+# as each file completes, along with a live status/timing table per file.
+def process_files(uploaded_files, selected_fields, table, status_view):
+    # Memoize the full extraction per file content for the session, so reruns
+    # and field changes do not analyze the invoice again
+    cache = st.session_state.setdefault("line_items_cache", {})
+
+    status = [{"file": f.name, "status": "queued", "seconds": ""} for f in uploaded_files]
+    results = {}
+    started = {}
+    futures = {}
+
+    def show():
+        now = time.perf_counter()
+        rows = []
+        for idx, row in enumerate(status):
+            row = dict(row)
+            if row["status"] == "queued" and idx in started:
+                row.update(status="analyzing", seconds=f"{now - started[idx]:.1f} ...")
+            rows.append(row)
+        status_view.dataframe(pd.DataFrame(rows), hide_index=True)
+        if results:
+            table.dataframe(pd.concat([results[idx] for idx in sorted(results)], ignore_index=True))
+
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    try:
+        for idx, uploaded_file in enumerate(uploaded_files):
+            key = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+            if key in cache:
+                results[idx] = select_fields(cache[key], uploaded_file.name, selected_fields)
+                status[idx]["status"] = "cached"
+                continue
+            # Encrypted, truncated or oversize files are rejected before any remote call
+            reasons = preflight(uploaded_file.getvalue())
+            if reasons:
+                status[idx]["status"] = "rejected"
+                st.error(f"Skipped {uploaded_file.name}: {describe_rejection(reasons)}")
+            else:
+                future = executor.submit(timed_extraction, uploaded_file.getvalue(), uploaded_file.name, started, idx)
+                futures[future] = (idx, key)
+        show()
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx, key = futures[future]
+                file_name = uploaded_files[idx].name
+                try:
+                    df, seconds = future.result()
+                except Exception as e:
+                    status[idx]["status"] = "error"
+                    st.error(f"Error processing {file_name}: {e}")
+                    continue
+                cache[key] = df
+                results[idx] = select_fields(df, file_name, selected_fields)
+                status[idx].update(status="done", seconds=f"{seconds:.1f}")
+            show()
+    finally:
+        # A rerun (e.g. the cancel button) interrupts the script; drop the files not started yet
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return [results[idx] for idx in sorted(results)]
 
 def display_pdf(file, width=500, height=600):
     # Encode the PDF to base64
@@ -179,40 +223,30 @@ def main():
 
         # Button to start extraction
         if st.button("Start Extraction"):
-            # Add a progress bar and start a spinner
-            with st.spinner('Decoding your invoice, one line at a time...'):
-                progress_bar = st.progress(0)
-                total_files = len(uploaded_files)
-
-                all_invoices_data = []
-
-                for idx, uploaded_file in enumerate(uploaded_files):
-                    # Process each file and show progress
-                    df, file_type, uploaded_file = process_file(uploaded_file, selected_fields)
-                    all_invoices_data.append(df)
+            # Clicking cancel reruns the script, which stops the extraction; finished files stay cached
+            st.button("Cancel remaining files")
 
-                    # Update the progress bar
-                    progress_percentage = (idx + 1) / total_files
-                    progress_bar.progress(progress_percentage)
-
-                # Combine all the data into a single DataFrame if there are multiple files
+            with st.spinner('Decoding your invoice, one line at a time...'):
                 if len(uploaded_files) > 1:
-                    combined_df = pd.concat(all_invoices_data, ignore_index=True)
-                    st.dataframe(combined_df)
+                    # Combine all the data into a single table that fills in as files complete
+                    table = st.empty()
                 else:
                     # Display the individual DataFrame if only one invoice is processed
+                    uploaded_file = uploaded_files[0]
                     file_name = uploaded_file.name
                     # Create columns for displaying the PDF and data side by side
                     cols = st.columns(2)  # Equal width for PDF and table
                     with cols[0]:
-                        if file_type == "application/pdf":
+                        if uploaded_file.type == "application/pdf":
                             # Display the PDF in the Streamlit app
                             display_pdf(uploaded_file, width=500, height=600)
                         else:
                             # Display the uploaded image
                             st.image(uploaded_file, caption=file_name)
-                    with cols[1]:
-                        st.dataframe(all_invoices_data[0])  # Display the extracted data
+                    table = cols[1].empty()
+
+                status_view = st.empty()
+                process_files(uploaded_files, selected_fields, table, status_view)
 
                 # Display success message
                 st.success("Extraction completed successfully!")
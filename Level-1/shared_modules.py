@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Modules used by both levels have a single copy, in Level-2: the line item
+# normalizer, the pre-flight checks and the rate limiter, whose database
+# both levels share. Importing this module makes them importable from
+# Level-1; Level-1's own modules still come first.
+LEVEL_2_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Level-2')
+if LEVEL_2_DIR not in sys.path:
+    sys.path.append(LEVEL_2_DIR)
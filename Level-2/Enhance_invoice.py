@@ -1,18 +1,15 @@
 import os
-import json
-import fitz  # PyMuPDF
 import pandas as pd
-import openai
 import streamlit as st
 from dotenv import load_dotenv
-from azure.ai.formrecognizer import DocumentAnalysisClient
-from azure.core.credentials import AzureKeyCredential
 from io import BytesIO
-from PIL import Image
-import base64
-import cv2
-import numpy as np
-from backend import CustomDocExtractor
+from backend import CustomDocExtractor, analyze_document, get_document_analysis_client
+from llm import call_azure_openai
+import session_cache
+from document_buffer import DocumentBuffer, as_document
+from batch_view import accept_upload
+from cascade import run_cascade
+from slim_result import slim_custom_result, slim_result
 
 load_dotenv('.env')
 
@@ -22,22 +19,6 @@ AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 AZURE_OPENAI_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT")
 AZURE_OPENAI_API_KEY = os.getenv('AZURE_OPENAI_API_KEY')
 
-# Azure Form Recognizer configurations
-FR_ENDPOINT = os.getenv('AZURE_ENDPOINT')
-FR_KEY = os.getenv('AZURE_KEY')
-
-# Initialize the Document Analysis Client
-document_analysis_client = DocumentAnalysisClient(
-    endpoint=str(FR_ENDPOINT), credential=AzureKeyCredential(str(FR_KEY))
-)
-
-def extract_text_from_pdf(pdf_file):
-    doc = fitz.open(stream=pdf_file, filetype="pdf")
-    text = ""
-    for page in doc:
-        text += page.get_text()
-    return text
-
 def convert_image_to_pdf(image):
     pdf_bytes = BytesIO() 
     image.save(pdf_bytes, format='PDF')  
@@ -45,6 +26,10 @@ def convert_image_to_pdf(image):
     return pdf_bytes.read() 
 
 def enhance_image(image):
+    import cv2
+    import numpy as np
+    from PIL import Image
+
     # Convert PIL image to numpy array
     img_np = np.array(image)
 
@@ -60,15 +45,8 @@ def enhance_image(image):
     enhanced_image = Image.fromarray(enhanced_img_np)
     return enhanced_image
 
-# Function to call Azure OpenAI for LLM response and convert to table
-def call_azure_openai(document_text, api_version: str, azure_endpoint: str, azure_deployment: str, api_key: str, file_name: str):
-    client = openai.AzureOpenAI(
-        api_key=api_key,
-        api_version=api_version,
-        azure_endpoint=azure_endpoint,
-        azure_deployment=azure_deployment,
-    )
-    prompt = f"""
+# Prompt used for the LLM call on enhanced images
+PROMPT_TEMPLATE = """
         "Extract the following fields from the provided text in JSON format:
         - item_description
         - item_amount (total amount for all quantity)
@@ -78,40 +56,9 @@ def call_azure_openai(document_text, api_version: str, azure_endpoint: str, azur
         Text: {document_text}
     """
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "system", "content": prompt}],
-        temperature=0.7,
-        response_format={"type": "json_object"}
-    )
-
-    response_message = response.choices[0].message.content
-
-    try:
-        response_message = json.loads(response_message)
-    except json.JSONDecodeError:
-        st.write(f'Error decoding response: {response_message}')
-        return None
-
-    # Extract the fields from the response and create a table
-    items = []
-    for item in response_message.get("items", []):  # Assuming items is a list in the response
-        item_dict = {
-            "file_name": file_name,
-            "item-name": item.get("item_description", ""),
-            "item-amount": item.get("item_amount", ""),
-            "item-subcategory": item.get("item_subcategory", ""),
-            "item-sub-category-total": item.get("item_subcategory_total", "")
-        }
-        items.append(item_dict)
-
-    # Convert to DataFrame
-    df = pd.DataFrame(items)
-    return df
-
-def display_pdf(file, width=500, height=600):
+def display_pdf(document, width=500, height=600):
     # Encode the PDF to base64
-    base64_pdf = base64.b64encode(file.getvalue()).decode('utf-8')
+    base64_pdf = document.base64()
     # Display the PDF in an iframe
     pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="{width}" height="{height}" type="application/pdf"></iframe>'
     st.markdown(pdf_display, unsafe_allow_html=True)
@@ -200,22 +147,47 @@ def main():
         # Initialize a list to hold all the extracted data
         all_data = []
 
+        # Show line items in the table as soon as the LLM emits them
+        live_rows = []
+        live_table = None
+        if len(uploaded_files) > 1:
+            st.write("### Combined Extracted Data")
+            live_table = st.empty()
+
+        def show_rows(rows):
+            live_rows.extend(rows)
+            live_table.dataframe(pd.DataFrame(live_rows))
+
+        def show_row(row):
+            show_rows([row])
+
         # Loop through the uploaded files
         for uploaded_file in uploaded_files:
+            # One buffer per upload, shared by preflight, the hash, the preview and every analysis stage
+            upload = DocumentBuffer(uploaded_file.getvalue())
+
+            # Encrypted, truncated or oversize files are rejected before any remote call
+            if not accept_upload(uploaded_file.name, upload):
+                continue
+
+            # Results are memoized per file content, so reruns skip the remote calls
+            key = upload.digest
 
             # Process the uploaded file
             if uploaded_file.type == "application/pdf":
-                document = uploaded_file.read()
-                document_text = extract_text_from_pdf(document)
+                document = upload
 
                 # If only one file is uploaded, display the PDF
                 if len(uploaded_files) == 1:
                     col1, col2 = st.columns(2)
                     with col1:
-                        display_pdf(uploaded_file, width=500, height=600)
+                        display_pdf(upload, width=500, height=600)
+                    live_table = col2.empty()
 
             else:
                 # Handle image files
+                from PIL import Image
+
                 image = Image.open(uploaded_file)
 
                 # Enhance the image
@@ -230,16 +202,26 @@ def main():
                 else:
                     document = convert_image_to_pdf(enhanced_image)  # Convert other image types to PDF
 
-                document_text = extract_text_from_pdf(document)
-
                 # If only one file is uploaded, display the image
                 if len(uploaded_files) == 1:
                     col1, col2 = st.columns(2)
                     with col1:
                         st.image(enhanced_image, caption="Enhanced Invoice", use_column_width=True)
-
-            # Analyze using custom extractor
-            result, list_of_table_df = CustomDocExtractor().analyze_document(document)
+                    live_table = col2.empty()
+
+            # Analyze with the custom and prebuilt models; the second one only
+            # runs when the first one's result is not confident enough. Both
+            # read the same buffer, so converted images are hashed once too.
+            document = as_document(document)
+            models = {
+                "custom": lambda: slim_custom_result(CustomDocExtractor().analyze_document(document)),
+                "prebuilt": lambda: slim_result(analyze_document(
+                    get_document_analysis_client(), "prebuilt-invoice", document
+                )),
+            }
+            cached = [stage for stage in models if session_cache.get(stage, key) is not None]
+            values, route = run_cascade(lambda stage: session_cache.memoize(stage, key, models[stage]), cached)
+            result, list_of_table_df = values["custom"]
             document_text = result.content
 
             # Store results in session state
@@ -247,24 +229,25 @@ def main():
             st.session_state.list_of_table_df = list_of_table_df
             st.session_state.document_text = document_text
 
-            # Analyze using Prebuilt Model
-            poller = document_analysis_client.begin_analyze_document(
-                "prebuilt-invoice", document=document
-            )
-            prebuilt_result = poller.result()
-
             # Store Prebuilt result in session state
-            st.session_state.prebuilt_result = prebuilt_result
+            st.session_state.prebuilt_result = values["prebuilt"]
 
             # Call Azure OpenAI for LLM response
-            llm_df = call_azure_openai(
-                st.session_state.document_text,
-                AZURE_OPENAI_VERSION,
-                AZURE_OPENAI_ENDPOINT,
-                AZURE_OPENAI_DEPLOYMENT,
-                AZURE_OPENAI_API_KEY,
-                uploaded_file.name  # Pass the file name
-            )
+            llm_key = f"{key}:{uploaded_file.name}"
+            llm_df = session_cache.get("llm", llm_key)
+            if llm_df is None:
+                llm_df = session_cache.put("llm", llm_key, call_azure_openai(
+                    st.session_state.document_text,
+                    AZURE_OPENAI_VERSION,
+                    AZURE_OPENAI_ENDPOINT,
+                    AZURE_OPENAI_DEPLOYMENT,
+                    AZURE_OPENAI_API_KEY,
+                    uploaded_file.name,  # Pass the file name
+                    prompt_template=PROMPT_TEMPLATE,
+                    on_row=show_row
+                ))
+            else:
+                show_rows(llm_df.to_dict("records"))
 
             # Accumulate data into the list
             if llm_df is not None:
@@ -273,12 +256,8 @@ def main():
         if all_data:
             combined_df = pd.concat(all_data, ignore_index=True)
 
-            # Display the combined DataFrame in the second column or full width if more than one file
-            if len(uploaded_files) > 1:
-                st.write("### Combined Extracted Data")
-                st.dataframe(combined_df)
-            else:
-                col2.dataframe(combined_df)
+            # Replace the live table with the combined DataFrame
+            live_table.dataframe(combined_df)
 
         # Success message after processing all files
         st.success("Extraction completed successfully.")
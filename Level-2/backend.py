@@ -1,12 +1,21 @@
-import io
+import functools
 import os
+import threading
+from typing import TYPE_CHECKING
 
-from azure.ai.formrecognizer import DocumentAnalysisClient
-from azure.core.credentials import AzureKeyCredential
 from dotenv import load_dotenv
 
+from document_buffer import as_document
+from hedging import get_hedge_policy
+from invoice_items import normalize_items, select_fields
+from poller_store import get_token_store
+from ratelimit import azure_retry_policy, form_recognizer_limiter
+from result_archive import get_result_archive
 from transform.table_processing import tables_to_dataframe
 
+if TYPE_CHECKING:
+    from azure.ai.formrecognizer import DocumentAnalysisClient
+
 load_dotenv()
 
 # Azure Form Recognizer credentials
@@ -14,20 +23,175 @@ endpoint = os.getenv('AZURE_ENDPOINT')
 api_key = os.getenv('AZURE_KEY')
 custom_model_id = os.getenv('CUSTOM_AZURE_MODEL_ID')
 
+# Seconds between checks whether a hedged analysis has lost the race
+POLL_WAIT = 0.5
+
+# Service polling interval: a base plus a per-page share, capped
+ANALYZE_POLL_INTERVAL = float(os.getenv('ANALYZE_POLL_INTERVAL', '1.0'))
+ANALYZE_POLL_PER_PAGE = float(os.getenv('ANALYZE_POLL_PER_PAGE', '0.2'))
+ANALYZE_POLL_MAX = float(os.getenv('ANALYZE_POLL_MAX', '10.0'))
+
+# (document hash, model) pairs with an attempt running in this process
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+
+# The client is built on first use so importing this module stays cheap
+@functools.lru_cache(maxsize=None)
+def get_document_analysis_client() -> "DocumentAnalysisClient":
+    from azure.ai.formrecognizer import DocumentAnalysisClient
+    from azure.core.credentials import AzureKeyCredential
+
+    # Throttled requests are left to the shared rate limiter
+    return DocumentAnalysisClient(
+        endpoint=str(endpoint), credential=AzureKeyCredential(str(api_key)), retry_policy=azure_retry_policy()
+    )
+
+
+# Both take bytes or a DocumentBuffer, whose hash and page count are
+# computed once however many stages ask
+def document_hash(document_data: bytes) -> str:
+    return as_document(document_data).digest
+
+
+def count_pages(document_data: bytes) -> int:
+    return as_document(document_data).page_count
+
+
+# Large documents take longer, so they are polled less often
+def polling_interval_for(document_data: bytes) -> float:
+    pages = count_pages(document_data)
+    return min(ANALYZE_POLL_MAX, ANALYZE_POLL_INTERVAL + ANALYZE_POLL_PER_PAGE * (pages - 1))
+
+
+# Start an analysis through the shared Form Recognizer rate limiter
+def begin_analyze_document(client: "DocumentAnalysisClient", model_id: str, document, **kwargs):
+    def begin():
+        # A throttled attempt may have consumed part of the stream
+        if hasattr(document, 'seek'):
+            document.seek(0)
+        return client.begin_analyze_document(model_id, document, **kwargs)
+
+    return form_recognizer_limiter(str(endpoint)).call(begin)
+
+
+# Run a complete analysis, hedged against slow outliers when hedging is enabled.
+# An analysis left running by an earlier process is resumed from its
+# persisted continuation token instead of being submitted again.
+def analyze_document(client: "DocumentAnalysisClient", model_id: str, document_data: bytes):
+    from azure.core.exceptions import HttpResponseError
+
+    document = as_document(document_data)
+    key = (document.digest, model_id)
+    polling_interval = polling_interval_for(document)
+    store = get_token_store()
+
+    def submit():
+        # Each attempt reads the shared bytes through its own stream
+        with document.stream() as document_stream:
+            poller = begin_analyze_document(client, model_id, document_stream, polling_interval=polling_interval)
+        store.save(*key, poller.continuation_token())
+        return poller
+
+    def wait_for(poller, cancelled):
+        while not poller.done():
+            if cancelled.is_set():
+                return None
+            poller.wait(POLL_WAIT)
+        return poller.result()
+
+    def run(cancelled):
+        # Only the first attempt may resume; a hedged duplicate submits afresh
+        with _in_flight_lock:
+            first_attempt = key not in _in_flight
+            _in_flight.add(key)
+
+        try:
+            token = store.get(*key) if first_attempt else None
+            if token is not None:
+                try:
+                    poller = client.begin_analyze_document(
+                        model_id, None, continuation_token=token, polling_interval=polling_interval
+                    )
+                    result = wait_for(poller, cancelled)
+                    if result is not None:
+                        store.delete(*key)
+                    return result
+                except HttpResponseError:
+                    # Expired or failed operation: fall back to a new analysis
+                    store.delete(*key)
+
+            try:
+                result = wait_for(submit(), cancelled)
+            except HttpResponseError:
+                store.delete(*key)
+                raise
+            if result is not None:
+                store.delete(*key)
+            return result
+        finally:
+            if first_attempt:
+                with _in_flight_lock:
+                    _in_flight.discard(key)
+
+    result = get_hedge_policy(f"analyze:{model_id}").run(run)
+
+    # Keep the raw result so local stages can be re-run without a new analysis
+    archive = get_result_archive()
+    if archive is not None and result is not None:
+        try:
+            archive.save(key[0], model_id, result)
+        except OSError:
+            # A full or read-only archive must not fail the extraction
+            pass
+    return result
+
+
+# The archived result of an earlier analysis, for reprocessing without Azure
+def archived_analysis(model_id: str, document_data: bytes):
+    return archived_result(model_id, document_hash(document_data))
+
+
+# The archived result of the document with this hash, e.g. a near-duplicate
+def archived_result(model_id: str, digest: str):
+    archive = get_result_archive()
+    result = archive.load(digest, model_id) if archive is not None else None
+    if result is None:
+        raise LookupError(f"No archived {model_id} result for this document")
+    return result
+
 
 class CustomDocExtractor:
     def __init__(self):
-        # Initialize the Document Analysis Client
-        self.document_analysis_client = DocumentAnalysisClient(
-            endpoint=endpoint,
-            credential=AzureKeyCredential(str(api_key))
-        )
-
-    def analyze_document(self, document_data: bytes):
-        with io.BytesIO(document_data) as document_stream:
-            poller = self.document_analysis_client.begin_analyze_document(custom_model_id, document_stream)
-            result = poller.result()
-            list_of_extracted_tables = result.tables
-            list_of_table_df = tables_to_dataframe(list_of_extracted_tables)
+        # Share the lazily built Document Analysis Client
+        self.document_analysis_client = get_document_analysis_client()
+
+    # With `offline` the archived result is transformed again instead of analyzing the document
+    def analyze_document(self, document_data: bytes, offline: bool = False):
+        if offline:
+            result = archived_analysis(custom_model_id, document_data)
+        else:
+            result = analyze_document(self.document_analysis_client, custom_model_id, document_data)
+        list_of_extracted_tables = result.tables
+        # Materialize the (title, table) pairs so cached results can be read more than once
+        list_of_table_df = list(tables_to_dataframe(list_of_extracted_tables))
         return [result, list_of_table_df]
         
+
+
+# Line items of the prebuilt invoice model, with the columns of the Level-1
+# line item extractor: file_name, invoice_index, item_name, item_amount,
+# currency, the selected fields and the item confidence.
+# With `offline` the archived prebuilt result is used instead of a new analysis.
+def extract_invoice_line_items(document_data: bytes, file_name: str, selected_fields=(), offline: bool = False):
+    if offline:
+        prebuilt_result = archived_analysis("prebuilt-invoice", document_data)
+    else:
+        prebuilt_result = analyze_document(get_document_analysis_client(), "prebuilt-invoice", document_data)
+    return line_items_from_result(prebuilt_result, file_name, selected_fields)
+
+
+def line_items_from_result(prebuilt_result, file_name: str, selected_fields=()):
+    # Typed columns from the normalizer the Level-1 apps and API use, so
+    # amounts and dates are plain numbers and strings on every output path
+    return select_fields(normalize_items(prebuilt_result, file_name), selected_fields)
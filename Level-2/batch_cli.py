@@ -0,0 +1,276 @@
+"""Headless batch extraction over a directory or manifest of invoices.
+
+    python batch_cli.py invoices/ --output out/                      # LLM line items
+    python batch_cli.py manifest.txt --mode line-items --fields Quantity,Date --output out/
+    python batch_cli.py invoices/ --mode tables --output out/         # LLM columns from the tables, no OpenAI
+    python batch_cli.py invoices/ --output out/ --executor process --workers 8
+    python batch_cli.py invoices/ --output out-v2/ --reprocess        # archived results, no new analysis
+
+Rows are appended to <output>/items.jsonl as each file finishes (or, with
+--format parquet, to a Parquet dataset partitioned by ingest date and source
+under <output>/items/) and every finished file is recorded in
+<output>/checkpoint.jsonl, so a rerun with the same output directory skips
+files that were already extracted.
+
+--reprocess re-runs only the local transforms and the LLM over the raw
+analysis results archived by earlier runs (see result_archive.py); files
+without an archived result fail instead of being sent to Azure.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+
+from document_buffer import DocumentBuffer, as_document
+
+load_dotenv('.env')
+
+# File types the Form Recognizer models accept
+EXTENSIONS = (".pdf", ".jpeg", ".jpg", ".png")
+
+MODES = ("llm", "tables", "line-items")
+
+FORMATS = ("jsonl", "parquet")
+
+# Files submitted ahead of the workers; bounds memory for very large inputs
+QUEUE_FACTOR = 2
+
+
+# Paths listed by a manifest (one path per line, or a CSV with a "path"
+# column) or found under a directory, in a stable order
+def discover(source: str):
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(EXTENSIONS):
+                    yield os.path.join(root, name)
+        return
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, newline="") as f:
+        if source.lower().endswith(".csv"):
+            paths = (row["path"] for row in csv.DictReader(f))
+        else:
+            paths = (line.strip() for line in f)
+        for path in paths:
+            if path and not path.startswith("#"):
+                yield path if os.path.isabs(path) else os.path.join(base, path)
+
+
+# Cheap identity of a file on disk; a changed file is extracted again
+def file_signature(path: str) -> str:
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class Checkpoint:
+    # Append-only JSON lines log of finished files. The last record of a path
+    # wins, so failed files are retried and changed files are redone.
+    def __init__(self, path: str):
+        self.path = path
+        self.finished = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash
+                        continue
+                    self.finished[record["path"]] = record
+        self._file = open(path, "a")
+
+    def is_done(self, path: str, signature: str) -> bool:
+        record = self.finished.get(path)
+        return record is not None and record["status"] == "ok" and record["signature"] == signature
+
+    def record(self, record: dict):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        self.finished[record["path"]] = record
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlSink:
+    # Rows of every file appended as JSON lines; values Azure returns as
+    # objects (currency, dates) are written as strings
+    def __init__(self, path: str):
+        self._file = open(path, "a")
+
+    def write(self, rows, document_hash: str = None):
+        for row in rows:
+            self._file.write(json.dumps(row, default=str) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+# Where each file's rows are written as soon as it finishes
+def open_sink(output: str, output_format: str = "jsonl", source: str = "cli"):
+    if output_format == "parquet":
+        from parquet_sink import ParquetSink
+
+        return ParquetSink(os.path.join(output, "items"), source)
+    return JsonlSink(os.path.join(output, "items.jsonl"))
+
+
+# A Parquet part is complete once written, so only a JSON lines sink has a
+# file to close
+def close_sink(sink):
+    close = getattr(sink, "close", None)
+    if close is not None:
+        close()
+
+
+# Rows of one document for the given mode, plus extra checkpoint fields.
+# Files the models would reject raise preflight.Rejected before any remote call.
+def extract_document(document: bytes, file_name: str, mode: str, fields=(), offline: bool = False):
+    from preflight import Rejected, preflight
+
+    # One buffer for every stage, so the document is hashed once
+    document = as_document(document)
+    reasons = preflight(document.data)
+    if reasons:
+        raise Rejected(reasons)
+
+    if mode == "line-items":
+        from backend import extract_invoice_line_items
+
+        df = extract_invoice_line_items(document, file_name, fields, offline=offline)
+        return df.astype(object).where(df.notna(), None).to_dict("records"), {}
+
+    from backend import CustomDocExtractor
+    from llm import extract_rows, item_to_row
+
+    result, list_of_table_df = CustomDocExtractor().analyze_document(document, offline=offline)
+    if mode == "tables":
+        from transform.hierarchy import parse_tables
+
+        items, check = parse_tables(list_of_table_df)
+        return [item_to_row(item, file_name) for item in items], {"table_check": check}
+
+    rows, extraction = extract_rows(
+        result.content,
+        os.getenv("AZURE_OPENAI_VERSION"),
+        os.getenv("AZURE_OPENAI_ENDPOINT"),
+        os.getenv("AZURE_OPENAI_DEPLOYMENT"),
+        os.getenv("AZURE_OPENAI_API_KEY"),
+        file_name,
+    )
+    if not rows and not extraction.complete:
+        raise ValueError(f"Error decoding response: {extraction.text}")
+    return rows, {"complete": extraction.complete}
+
+
+# Runs in a worker thread or process; returns a checkpoint record with the rows
+def extract_file(path: str, mode: str, fields=(), offline: bool = False):
+    record = {"path": path, "signature": file_signature(path), "rows": []}
+    start = time.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            document = DocumentBuffer(f.read())
+        record["document_hash"] = document.digest
+        rows, extra = extract_document(document, os.path.basename(path), mode, fields, offline=offline)
+        record.update(extra, status="ok", rows=rows)
+    except Exception as e:
+        record.update(status="error", error=f"{type(e).__name__}: {e}")
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def run(source: str, output: str, mode: str = "llm", fields=(), workers: int = 4, executor: str = "thread",
+        retry_failed: bool = True, output_format: str = "jsonl", reprocess: bool = False):
+    os.makedirs(output, exist_ok=True)
+    checkpoint = Checkpoint(os.path.join(output, "checkpoint.jsonl"))
+    sink = open_sink(output, output_format, source="cli")
+    pool_class = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+    start = time.perf_counter()
+
+    def finish(future):
+        record = future.result()
+        rows = record.pop("rows")
+        # Rows are written before the checkpoint, so a crash can repeat a file but never lose one
+        if record["status"] == "ok":
+            sink.write(rows, document_hash=record.get("document_hash"))
+        record["row_count"] = len(rows)
+        checkpoint.record(record)
+        counts[record["status"]] += 1
+        message = f"{record['status']:5} {record['seconds']:7.1f}s {len(rows):4} rows  {record['path']}"
+        if record["status"] == "error":
+            message += f"  ({record['error']})"
+        print(message, flush=True)
+
+    try:
+        with pool_class(max_workers=workers) as pool:
+            pending = set()
+            for path in discover(source):
+                try:
+                    signature = file_signature(path)
+                except OSError as e:
+                    print(f"error {path}  ({e})", file=sys.stderr)
+                    counts["error"] += 1
+                    continue
+                previous = checkpoint.finished.get(path)
+                if checkpoint.is_done(path, signature) or (
+                        not retry_failed and previous is not None and previous["signature"] == signature):
+                    counts["skipped"] += 1
+                    continue
+
+                pending.add(pool.submit(extract_file, path, mode, tuple(fields), reprocess))
+                # Keep only a bounded number of files in flight
+                while len(pending) >= workers * QUEUE_FACTOR:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(future)
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(future)
+    finally:
+        checkpoint.close()
+        close_sink(sink)
+
+    elapsed = time.perf_counter() - start
+    print(f"{counts['ok']} extracted, {counts['error']} failed, {counts['skipped']} skipped in {elapsed:.1f}s")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="directory of invoices, or a manifest (.txt with one path per line, .csv with a path column)")
+    parser.add_argument("--output", required=True, help="directory for the extracted items and checkpoint.jsonl")
+    parser.add_argument("--format", choices=FORMATS, default="jsonl", help="items.jsonl, or a partitioned Parquet dataset")
+    parser.add_argument("--mode", choices=MODES, default="llm",
+                        help="llm: custom model + Azure OpenAI items; tables: the same columns parsed from the "
+                             "custom model tables; line-items: prebuilt invoice line items")
+    parser.add_argument("--fields", default="", help="extra line item fields for --mode line-items, comma separated")
+    parser.add_argument("--workers", type=int, default=4, help="files processed at the same time")
+    parser.add_argument("--executor", choices=("thread", "process"), default="thread",
+                        help="worker pool type; the rate limits are shared by both")
+    parser.add_argument("--no-retry-failed", action="store_true", help="also skip files that failed in an earlier run")
+    parser.add_argument("--reprocess", action="store_true",
+                        help="use the archived analysis results instead of analyzing the files again")
+    args = parser.parse_args()
+
+    fields = [field.strip() for field in args.fields.split(",") if field.strip()]
+    counts = run(args.source, args.output, mode=args.mode, fields=fields, workers=args.workers,
+                 executor=args.executor, retry_failed=not args.no_retry_failed, output_format=args.format,
+                 reprocess=args.reprocess)
+    if counts["error"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import os
+import time
+
+import pandas as pd
+import streamlit as st
+
+import cascade
+import session_cache
+from backend import CustomDocExtractor
+from llm import EXTRACTION_PROMPT
+from parquet_sink import PARQUET_SINK_DIR, ParquetSink
+from pipeline import STAGES, BatchRunner, process_document
+from preflight import describe as describe_rejection, preflight
+from reconcile import RECONCILE_GATE, describe
+
+# Set by the cancel button; until the user resumes, only files whose results
+# are already stored in the session are shown
+CANCELLED_KEY = "batch_cancelled"
+
+# Reconciliation decision of every processed file, by file name
+RECONCILIATION_KEY = "reconciliation"
+
+# Rows of a batch kept in memory for the live table; every row of a freshly
+# extracted file is written to the Parquet dataset instead
+BATCH_PREVIEW_ROWS = int(os.getenv('BATCH_PREVIEW_ROWS', '500'))
+
+
+def cancel_controls() -> bool:
+    if st.button("Cancel remaining files"):
+        st.session_state[CANCELLED_KEY] = True
+    if st.session_state.get(CANCELLED_KEY):
+        st.info("Processing was cancelled; only files that were already extracted are shown.")
+        if st.button("Resume processing"):
+            st.session_state[CANCELLED_KEY] = False
+    return st.session_state.get(CANCELLED_KEY, False)
+
+
+# Checks an upload before it is converted or sent anywhere; a rejected
+# file is reported and skipped
+# `upload` is the DocumentBuffer of the file, so its bytes are not read again
+def accept_upload(file_name: str, upload) -> bool:
+    reasons = preflight(upload.data)
+    if reasons:
+        st.error(f"Skipped {file_name}: {describe_rejection(reasons)}")
+    return not reasons
+
+
+def cached_stages(file_name: str, key: str) -> dict:
+    stored = {
+        "custom": session_cache.get("custom", key),
+        "prebuilt": session_cache.get("prebuilt", key),
+        "llm": session_cache.get("llm", f"{key}:{file_name}"),
+    }
+    return {stage: value for stage, value in stored.items() if value is not None}
+
+
+# Processes (file name, file key, document bytes) jobs concurrently and renders
+# LLM rows into `table` as they arrive, with a live per-stage timing table.
+# `on_file_done(file_name, results)` runs on the script thread for every
+# finished file. The timing table also shows the model path each file took
+# (see cascade.py) and whether its items balanced, and so whether the LLM
+# ran; the reconciliation decisions are kept in session state under
+# RECONCILIATION_KEY. Freshly extracted rows are appended to the Parquet
+# dataset (PARQUET_SINK_DIR) as each file finishes; only the first
+# BATCH_PREVIEW_ROWS rows of the batch are kept in memory. Returns them as
+# a DataFrame.
+def run_batch(jobs, table, openai_config, extractor=CustomDocExtractor, prompt_template: str = EXTRACTION_PROMPT,
+              on_file_done=None, source: str = "streamlit"):
+    only_cached = cancel_controls()
+    sink = ParquetSink(PARQUET_SINK_DIR, source) if PARQUET_SINK_DIR else None
+
+    st.write("### Processing Status")
+    timings_view = st.empty()
+    status = [
+        {"file": file_name, "status": "queued", **{stage: "" for stage in STAGES},
+         "duplicate of": "", "route": "", "reconciliation": ""}
+        for file_name, _, _ in jobs
+    ]
+    decisions = st.session_state.setdefault(RECONCILIATION_KEY, {})
+    # Files whose LLM stage was answered locally, with the reason shown instead of its time
+    local_llm = {}
+    running = {}
+
+    def show_timings():
+        now = time.perf_counter()
+        rows = []
+        for i, row in enumerate(status):
+            row = dict(row)
+            if i in running:
+                stage, start = running[i]
+                row[stage] = f"{now - start:.1f}s ..."
+            rows.append(row)
+        timings_view.dataframe(pd.DataFrame(rows), hide_index=True)
+
+    live_rows = []
+    row_count = 0
+
+    def show_rows(rows):
+        nonlocal row_count
+        row_count += len(rows)
+        room = BATCH_PREVIEW_ROWS - len(live_rows)
+        if room > 0:
+            live_rows.extend(rows[:room])
+            table.dataframe(pd.DataFrame(live_rows))
+
+    runner = BatchRunner()
+    for i, (file_name, key, document) in enumerate(jobs):
+        runner.submit(i, process_document, document, file_name, openai_config, cached=cached_stages(file_name, key),
+                      extractor=extractor, prompt_template=prompt_template, only_cached=only_cached)
+
+    try:
+        for kind, i, payload in runner.events():
+            if kind == "running":
+                running[i] = (payload, time.perf_counter())
+                status[i]["status"] = payload
+            elif kind == "stage":
+                stage, seconds, was_cached = payload
+                running.pop(i, None)
+                status[i][stage] = "cached" if was_cached else f"{seconds:.1f}s"
+                if stage == "llm" and not was_cached and i in local_llm:
+                    status[i][stage] = local_llm[i]
+            elif kind == "duplicate":
+                status[i]["duplicate of"] = f"{payload['file_name']} ({payload['similarity']:.0%})"
+            elif kind == "route":
+                status[i]["route"] = cascade.describe(payload)
+                if payload["skipped"]:
+                    status[i][payload["skipped"]] = "skipped"
+            elif kind == "reconciliation":
+                decisions[jobs[i][0]] = payload
+                status[i]["reconciliation"] = describe(payload)
+                if RECONCILE_GATE and payload["balanced"]:
+                    local_llm[i] = "skipped"
+            elif kind == "layout":
+                if payload["known"]:
+                    local_llm[i] = "known layout"
+            elif kind == "result":
+                # Workers cannot reach session_state, so their results are cached here
+                stage, value = payload
+                file_name, key, _ = jobs[i]
+                session_cache.put(stage, f"{key}:{file_name}" if stage == "llm" else key, value)
+            elif kind == "row":
+                show_rows([payload])
+            elif kind == "warning":
+                st.warning(payload)
+            elif kind == "done":
+                status[i]["status"] = "done"
+                if status[i]["llm"] == "cached":
+                    show_rows(payload["llm"].to_dict("records"))
+                elif sink is not None:
+                    sink.write(payload["llm"].to_dict("records"), document_hash=jobs[i][1])
+
+                st.session_state.result, st.session_state.list_of_table_df = payload["custom"]
+                st.session_state.document_text = payload["custom"][0].content
+                st.session_state.prebuilt_result = payload["prebuilt"]
+                if on_file_done is not None:
+                    on_file_done(jobs[i][0], payload)
+            elif kind == "error":
+                running.pop(i, None)
+                status[i]["status"] = "error"
+                st.error(f"Error processing {jobs[i][0]}: {payload}")
+            elif kind == "cancelled":
+                running.pop(i, None)
+                status[i]["status"] = "cancelled"
+            show_timings()
+    finally:
+        # A rerun (e.g. the cancel button) interrupts the script; stop the workers with it
+        if not runner.finished:
+            runner.cancel()
+    st.caption(cascade.describe_stats())
+    if row_count > len(live_rows):
+        where = f"in the Parquet dataset at {sink.root}" if sink is not None else "not kept; set PARQUET_SINK_DIR to keep them"
+        st.caption(f"Showing the first {len(live_rows)} of {row_count} rows; the rest are {where}.")
+
+    return pd.DataFrame(live_rows)
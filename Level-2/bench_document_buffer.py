@@ -0,0 +1,250 @@
+"""Document buffer benchmark: time and peak allocations of the per-document stages.
+
+    python bench_document_buffer.py                          # synthetic 40 MB document
+    python bench_document_buffer.py --file invoice.pdf       # a real document (page count needs PyMuPDF)
+    python bench_document_buffer.py --check                  # exit 1 when a stage copies the document
+
+Each stage is run the way one upload goes through the Level-2 pipeline:
+hashed for the session key, the near-duplicate index and both Azure calls,
+page counted for both polling intervals and streamed to both models. The
+"bytes" run repeats that work per stage as before; the "buffer" run shares
+one DocumentBuffer. The preview is base64 text, so it always allocates
+about 4/3 of the document and is reported but not checked.
+
+The buffer run also goes through the apps' own stages: accept_upload (the
+pre-flight checks) and process_document, with the Document Analysis Client
+replaced by a local one that reads the request body the way Azure's
+transport does and returns an empty result. Both need the app dependencies
+(Streamlit, pandas, the Azure SDK) and are left out when they are missing.
+The result archive, continuation tokens, rate limits and the other stores
+are kept in a temporary directory for the run. --check also fails when
+accept_upload rejects the document, so the pre-flight pass is measured in
+full.
+
+The synthetic document is a valid PDF of --pages letter pages, padded to
+--size-mb with an unreferenced stream of random bytes.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from document_buffer import DocumentBuffer
+
+# Azure's transport reads request bodies in chunks of this size
+CHUNK = 64 * 1024
+
+# Allowed peak allocations of a shared stage, whatever the document size
+MAX_STAGE_KB = 2 * CHUNK // 1024
+
+# Stores the app stages write to, pointed at the run's temporary directory
+STORE_SETTINGS = {
+    "RESULT_ARCHIVE_DIR": "result_archive",
+    "ANALYSIS_STATE_DB": "analysis_state.db",
+    "RATE_LIMIT_DB": "rate_limits.db",
+    "LAYOUT_STORE_DB": "layouts.db",
+    "NEAR_DUP_DB": "near_duplicates.db",
+}
+
+
+# A valid PDF with `pages` empty letter pages and an unreferenced stream
+# padding it to about `size` bytes
+def synthetic_pdf(size: int, pages: int) -> bytes:
+    page_ids = range(3, 3 + pages)
+    padding_id = 3 + pages
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % i for i in page_ids), pages),
+    ]
+    objects += [b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>" for _ in page_ids]
+    padding = os.urandom(max(size - 1024 - 100 * pages, 0))
+    objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(padding), padding))
+
+    out = bytearray(b"%PDF-1.7\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (padding_id + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (padding_id + 1, xref)
+    return bytes(out)
+
+
+def stream_to_model(stream):
+    while stream.read(CHUNK):
+        pass
+
+
+def bytes_stages(data: bytes):
+    import hashlib
+    import io
+
+    from backend import count_pages
+
+    return {
+        "hash": lambda: [hashlib.sha256(data).hexdigest() for _ in range(4)],
+        "pages": lambda: [count_pages(data) for _ in range(2)],
+        "streams": lambda: [stream_to_model(io.BytesIO(data)) for _ in range(2)],
+    }
+
+
+# Stand-in for the Document Analysis Client: the request body is read to
+# the end, nothing is sent, and every analysis finds nothing
+class LocalClient:
+    def begin_analyze_document(self, model_id, document, **kwargs):
+        stream_to_model(document)
+        return LocalPoller(model_id)
+
+
+class LocalPoller:
+    def __init__(self, model_id):
+        self.model_id = model_id
+
+    def continuation_token(self):
+        return f"local:{self.model_id}"
+
+    def done(self):
+        return True
+
+    def result(self):
+        return LocalResult(self.model_id)
+
+
+class LocalResult:
+    def __init__(self, model_id):
+        self.model_id = model_id
+        self.content = ""
+        self.documents = []
+        self.tables = []
+        self.pages = []
+
+    # What the result archive stores
+    def to_dict(self):
+        return {"model_id": self.model_id, "content": self.content, "documents": [], "tables": [], "pages": []}
+
+
+# accept_upload and process_document as the apps call them, the LLM stage
+# taken as cached, and whether accept_upload accepted the document
+def app_stages(document: DocumentBuffer):
+    import pandas as pd
+
+    import backend
+    import pipeline
+    from batch_view import accept_upload
+
+    backend.get_document_analysis_client = pipeline.get_document_analysis_client = LocalClient
+    stages = {
+        "accept_upload": lambda: accept_upload("bench.pdf", document),
+        "process_document": lambda: pipeline.process_document(
+            document, "bench.pdf", None, cached={"llm": pd.DataFrame()}, cascade=False, reconcile_gate=False
+        ),
+    }
+    # The first run imports the model libraries, which is not what is measured
+    accepted = stages["accept_upload"]()
+    stages["process_document"]()
+    return stages, accepted
+
+
+def buffer_stages(document: DocumentBuffer):
+    return {
+        "hash": lambda: [document.digest for _ in range(4)],
+        "pages": lambda: [document.page_count for _ in range(2)],
+        "streams": lambda: [stream_to_model(document.stream()) for _ in range(2)],
+        "preview": document.base64,
+    }
+
+
+def measure(stage):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    stage()
+    ms = (time.perf_counter() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"ms": ms, "peak_kb": peak / 1024}
+
+
+def run(data: bytes):
+    results = {"size_kb": len(data) / 1024, "bytes": {}, "buffer": {}}
+    try:
+        stages = bytes_stages(data)
+    except ImportError:
+        # backend needs the Azure and Streamlit dependencies; the buffer run does not
+        stages = {}
+    for name, stage in stages.items():
+        results["bytes"][name] = measure(stage)
+
+    tracemalloc.start()
+    document = DocumentBuffer(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results["buffer"]["wrap"] = {"ms": 0.0, "peak_kb": peak / 1024}
+    for name, stage in buffer_stages(document).items():
+        results["buffer"][name] = measure(stage)
+    try:
+        stages, results["accepted"] = app_stages(document)
+    except ImportError:
+        stages = {}
+    for name, stage in stages.items():
+        results["buffer"][name] = measure(stage)
+    return results
+
+
+def failures(results):
+    problems = [
+        f"{name} allocated {stage['peak_kb']:.0f} KB (limit {MAX_STAGE_KB} KB)"
+        for name, stage in results["buffer"].items()
+        if name != "preview" and stage["peak_kb"] > MAX_STAGE_KB
+    ]
+    if results.get("accepted") is False:
+        problems.append("accept_upload rejected the document, so only part of the pre-flight checks ran")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", help="document to measure instead of a synthetic one")
+    parser.add_argument("--size-mb", type=float, default=40, help="size of the synthetic document")
+    parser.add_argument("--pages", type=int, default=10, help="pages of the synthetic document")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--check", action="store_true", help="fail when a shared stage allocates a copy")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "rb") as f:
+            data = f.read()
+    else:
+        data = synthetic_pdf(int(args.size_mb * 1024 * 1024), args.pages)
+
+    # Nothing the app stages store outlives the run
+    workdir = tempfile.mkdtemp(prefix="bench_document_buffer_")
+    for name, path in STORE_SETTINGS.items():
+        os.environ[name] = os.path.join(workdir, path)
+    try:
+        results = run(data)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(f"document {results['size_kb'] / 1024:.1f} MB")
+    for run_name in ("bytes", "buffer"):
+        for name, stage in results[run_name].items():
+            print(f"  {run_name:<6} {name:<16} {stage['ms']:9.2f}ms  peak {stage['peak_kb']:10.1f} KB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.check:
+        problems = failures(results)
+        for problem in problems:
+            print(f"FAIL {problem}")
+        raise SystemExit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Header normalization benchmark: accuracy and lookup time of the fuzzy header index.
+
+    python bench_headers.py                                  # header_corpus.tsv, built-in synonyms
+    python bench_headers.py --corpus headers.tsv --synonyms synonyms.json
+    python bench_headers.py --json out.json --verbose        # save results, list the misses
+
+The corpus is a tab-separated file of (header, expected field) lines, with
+"-" for headers that should match no field; lines starting with # are skipped.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+from transform.headers import HeaderIndex, load_synonyms
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_corpus(path: str):
+    corpus = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            header, expected = line.rstrip("\n").split("\t")
+            corpus.append((header, None if expected == "-" else expected))
+    return corpus
+
+
+def run(corpus, synonyms, repeat: int):
+    start = time.perf_counter()
+    index = HeaderIndex(synonyms)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    # Cold lookups: the memo is bypassed so every call scores the header
+    timings = []
+    for _ in range(repeat):
+        for header, _ in corpus:
+            start = time.perf_counter()
+            index._match(header)
+            timings.append((time.perf_counter() - start) * 1e6)
+    timings.sort()
+
+    misses = []
+    for header, expected in corpus:
+        field, score = index.match(header)
+        if field != expected:
+            misses.append({"header": header, "expected": expected, "field": field, "score": round(score, 3)})
+
+    return {
+        "headers": len(corpus),
+        "synonyms": len(index),
+        "accuracy": 1 - len(misses) / len(corpus) if corpus else 0.0,
+        "build_ms": build_ms,
+        "median_us": statistics.median(timings) if timings else 0.0,
+        "p99_us": timings[int(len(timings) * 0.99) - 1] if timings else 0.0,
+        "max_us": timings[-1] if timings else 0.0,
+        "misses": misses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=os.path.join(ROOT, "header_corpus.tsv"), help="header corpus (.tsv)")
+    parser.add_argument("--synonyms", default=None, help="extra synonyms file (JSON), as HEADER_SYNONYMS_FILE")
+    parser.add_argument("--repeat", type=int, default=100, help="lookups per corpus header")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="list every header mapped to the wrong field")
+    args = parser.parse_args()
+
+    results = run(load_corpus(args.corpus), load_synonyms(args.synonyms), args.repeat)
+    print(f"{results['headers']} headers, {results['synonyms']} synonyms, index built in {results['build_ms']:.2f}ms")
+    print(f"accuracy {results['accuracy']:.1%}  lookup median {results['median_us']:.1f}us  "
+          f"p99 {results['p99_us']:.1f}us  max {results['max_us']:.1f}us")
+    if args.verbose:
+        for miss in results["misses"]:
+            print(f"  {miss['header']!r}: expected {miss['expected']}, got {miss['field']} ({miss['score']})")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
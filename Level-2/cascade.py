@@ -0,0 +1,178 @@
+import os
+import threading
+from collections import Counter
+
+from dotenv import load_dotenv
+
+from transform.table_processing import tables_to_dataframe
+
+load_dotenv()
+
+# Models are tried in this order and the second one only runs when the
+# first one's result misses its thresholds; set CASCADE=0 to always run both
+CASCADE = os.getenv('CASCADE', '1') not in ('0', 'false', 'False', '')
+CASCADE_ORDER = os.getenv('CASCADE_ORDER', 'prebuilt,custom')
+
+# The stage whose result the invoice totals are read from
+TOTALS_STAGE = "prebuilt"
+
+
+def _fields(value: str):
+    return tuple(field.strip() for field in value.split(',') if field.strip())
+
+
+# What a model's result needs for the other model to be skipped, per model:
+#   min_confidence        confidence of the analyzed document
+#   min_field_confidence  confidence of every required field
+#   required_fields       document fields that must have a value
+#   min_tables            tables found on the document
+#   min_table_fill        share of non-empty cells over all of its tables
+#   min_item_coverage     share of Items with both a Description and an Amount
+THRESHOLDS = {
+    "prebuilt": {
+        "min_confidence": float(os.getenv('CASCADE_PREBUILT_MIN_CONFIDENCE', '0.8')),
+        "min_field_confidence": float(os.getenv('CASCADE_PREBUILT_MIN_FIELD_CONFIDENCE', '0.7')),
+        "required_fields": _fields(os.getenv('CASCADE_PREBUILT_REQUIRED_FIELDS', 'Items,InvoiceTotal')),
+        "min_tables": int(os.getenv('CASCADE_PREBUILT_MIN_TABLES', '1')),
+        "min_table_fill": float(os.getenv('CASCADE_PREBUILT_MIN_TABLE_FILL', '0.6')),
+        "min_item_coverage": float(os.getenv('CASCADE_PREBUILT_MIN_ITEM_COVERAGE', '0.9')),
+    },
+    "custom": {
+        "min_confidence": float(os.getenv('CASCADE_CUSTOM_MIN_CONFIDENCE', '0.8')),
+        "min_field_confidence": float(os.getenv('CASCADE_CUSTOM_MIN_FIELD_CONFIDENCE', '0.7')),
+        "required_fields": _fields(os.getenv('CASCADE_CUSTOM_REQUIRED_FIELDS', '')),
+        "min_tables": int(os.getenv('CASCADE_CUSTOM_MIN_TABLES', '1')),
+        "min_table_fill": float(os.getenv('CASCADE_CUSTOM_MIN_TABLE_FILL', '0.6')),
+        "min_item_coverage": float(os.getenv('CASCADE_CUSTOM_MIN_ITEM_COVERAGE', '0')),
+    },
+}
+
+
+# Both stages of THRESHOLDS, each once, in the configured order
+def cascade_order(value: str) -> tuple:
+    order = tuple(stage.strip() for stage in value.split(',') if stage.strip())
+    if sorted(order) != sorted(THRESHOLDS):
+        raise ValueError(f"CASCADE_ORDER must name each of {', '.join(THRESHOLDS)} once, not {value!r}")
+    return order
+
+
+ORDER = cascade_order(CASCADE_ORDER)
+
+
+# The analyze result of a stage value; the custom stage holds [result, list_of_table_df]
+def stage_result(stage: str, value):
+    return value[0] if stage == "custom" else value
+
+
+# Reasons the result of `stage` misses its thresholds; empty when it is good enough
+def assess(stage: str, value) -> list:
+    limits = THRESHOLDS[stage]
+    result = stage_result(stage, value)
+    reasons = []
+
+    documents = result.documents or []
+    confidence = max((doc.confidence or 0.0 for doc in documents), default=0.0)
+    if confidence < limits["min_confidence"]:
+        reasons.append(f"document confidence {confidence:.2f}")
+
+    fields = documents[0].fields if documents else {}
+    for name in limits["required_fields"]:
+        field = fields.get(name)
+        if field is None or not field.value:
+            reasons.append(f"no {name}")
+        elif (field.confidence or 0.0) < limits["min_field_confidence"]:
+            reasons.append(f"{name} confidence {field.confidence or 0.0:.2f}")
+
+    tables = result.tables or []
+    if len(tables) < limits["min_tables"]:
+        reasons.append(f"{len(tables)} tables")
+    elif tables:
+        cells = [cell for table in tables for cell in table.cells]
+        filled = sum(1 for cell in cells if cell.content and cell.content.strip()) / max(len(cells), 1)
+        if filled < limits["min_table_fill"]:
+            reasons.append(f"table fill {filled:.2f}")
+
+    if limits["min_item_coverage"] and "Items" in fields and fields["Items"].value:
+        items = fields["Items"].value
+        covered = sum(
+            1 for item in items
+            if (item.value or {}).get("Description") is not None and (item.value or {}).get("Amount") is not None
+        ) / len(items)
+        if covered < limits["min_item_coverage"]:
+            reasons.append(f"item coverage {covered:.2f}")
+    return reasons
+
+
+# Stands in for the stage that was skipped, built from the accepted one:
+# the prebuilt tables take the place of the custom tables, and the custom
+# result takes the place of the prebuilt one for callers that need no totals
+def derive(stage: str, other_value):
+    if stage == "custom":
+        return [other_value, list(tables_to_dataframe(other_value.tables)) if other_value.tables else []]
+    return stage_result("custom", other_value)
+
+
+class CascadeStats:
+    # How often each path was taken and the model calls it cost, for the
+    # documents routed by this process
+    def __init__(self):
+        self._paths = Counter()
+        self._calls = 0
+        self._lock = threading.Lock()
+
+    def record(self, path: str, calls: int):
+        with self._lock:
+            self._paths[path] += 1
+            self._calls += calls
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            documents = sum(self._paths.values())
+            return {
+                "documents": documents,
+                "paths": dict(self._paths),
+                "model_calls": self._calls,
+                "calls_per_document": self._calls / documents if documents else 0.0,
+            }
+
+
+cascade_stats = CascadeStats()
+
+
+# Runs the custom and prebuilt stages through `run_stage(stage)`, cached
+# stages first since they cost nothing. Returns the value of both stages,
+# derived for a skipped one, and the route: the path taken, the skipped
+# stage and why the second model was needed when it ran.
+# With `needs_totals` set the prebuilt stage always runs: the invoice totals
+# shown by the apps and reconciled against are only read from a real
+# prebuilt result, so only the custom model can be skipped.
+def run_cascade(run_stage, cached=(), enabled: bool = CASCADE, needs_totals: bool = True):
+    first, second = sorted(ORDER, key=lambda stage: stage not in cached)
+    values = {first: run_stage(first)}
+
+    # A cached second stage is free, so there is nothing to save by skipping it
+    escalate = not enabled or second in cached or (needs_totals and second == TOTALS_STAGE)
+    reasons = [] if escalate else assess(first, values[first])
+    if escalate or reasons:
+        values[second] = run_stage(second)
+        route = {"path": f"{first}+{second}", "skipped": None, "reasons": reasons}
+    else:
+        values[second] = derive(second, values[first])
+        route = {"path": first, "skipped": second, "reasons": []}
+
+    cascade_stats.record(route["path"], sum(1 for stage in values if stage not in cached and stage != route["skipped"]))
+    return values, route
+
+
+def describe(route: dict) -> str:
+    if route["skipped"]:
+        return f"{route['path']} only"
+    if route["reasons"]:
+        return f"{route['path']}: " + ", ".join(route["reasons"])
+    return route["path"]
+
+
+def describe_stats() -> str:
+    stats = cascade_stats.snapshot()
+    paths = ", ".join(f"{path} {count}" for path, count in sorted(stats["paths"].items()))
+    return f"Model paths: {paths} ({stats['calls_per_document']:.2f} model calls per document)"
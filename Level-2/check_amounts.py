@@ -0,0 +1,61 @@
+"""Amount parsing check: currency marks, separators and credits on invoice cells.
+
+    python check_amounts.py          # exit 1 when an amount is parsed wrongly
+
+Every cell is parsed one at a time (parse_amount, used by the Parquet sink)
+and, when pandas is installed, as a column (parse_amounts, used by the
+table parser, the layout mappings and the reconciliation gate).
+"""
+import math
+
+from transform.amounts import parse_amount, parse_amounts
+
+# (cell, expected amount); None for cells that hold no amount
+CASES = [
+    ("500", 500.0),
+    ("1,250.00", 1250.0),
+    ("Rs.500", 500.0),
+    ("Rs. 1,200.00", 1200.0),
+    ("RS 75.50", 75.5),
+    ("Rs 2,000/-", 2000.0),
+    ("500/-", 500.0),
+    ("1,250.00 Rs.", 1250.0),
+    ("INR 90", 90.0),
+    ("₹45", 45.0),
+    ("₹ 1,00,000.00", 100000.0),
+    ("$12", 12.0),
+    ("(12.50)", -12.5),
+    ("-40", -40.0),
+    ("", None),
+    ("Pharmacy", None),
+]
+
+
+def failures():
+    problems = []
+    for cell, expected in CASES:
+        value = parse_amount(cell)
+        if value != expected:
+            problems.append(f"parse_amount({cell!r}) = {value!r}, expected {expected!r}")
+    try:
+        import pandas as pd
+    except ImportError:
+        return problems
+    values = parse_amounts(pd.Series([cell for cell, _ in CASES])).tolist()
+    for (cell, expected), value in zip(CASES, values):
+        value = None if math.isnan(value) else value
+        if value != expected:
+            problems.append(f"parse_amounts([{cell!r}]) = {value!r}, expected {expected!r}")
+    return problems
+
+
+def main():
+    problems = failures()
+    for problem in problems:
+        print(f"FAIL {problem}")
+    print(f"{len(CASES)} cells, {len(problems)} failures")
+    raise SystemExit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Near-duplicate check: a PDF, a rescan of it and another invoice on the same letterhead.
+
+    python check_near_duplicates.py      # exit 1 when a document is matched wrongly
+
+An invoice PDF is indexed the way the pipeline indexes it. Its re-export
+must match it by text, and a rescan of it (a JPEG without a text layer) by
+image, confirmed by the numbers the prebuilt model would read. A second
+invoice of the same hospital, as a PDF and as a rescan, must match nothing
+even though its first page looks alike. The prebuilt content of a rescan is
+stood in for by the text of the PDF it was printed from. Needs PyMuPDF,
+Pillow and numpy.
+"""
+import io
+import os
+import tempfile
+
+from near_duplicates import NearDuplicateIndex, document_text, hamming, needs_content, signature
+
+LETTERHEAD = [
+    "CITY CARE HOSPITAL",
+    "12 MG Road, Pune 411001",
+    "Phone 020 2612 3456   GSTIN 27AABCC1234F1Z5",
+]
+
+
+def invoice_pdf(number: str, date: str, items: list) -> bytes:
+    import fitz  # PyMuPDF
+
+    lines = LETTERHEAD + ["", f"Invoice No: {number}", f"Date: {date}", "", "Description            Amount"]
+    lines += [f"{name:<22} {amount:>8.2f}" for name, amount in items]
+    lines += ["", f"Total                  {sum(amount for _, amount in items):>8.2f}"]
+    with fitz.open() as doc:
+        page = doc.new_page()
+        for i, line in enumerate(lines):
+            page.insert_text((72, 72 + 16 * i), line, fontname="cour", fontsize=11)
+        return doc.tobytes()
+
+
+# The first page printed and scanned again: rendered, slightly rotated and
+# blurred, saved as a JPEG without a text layer
+def rescan(pdf: bytes) -> bytes:
+    import fitz  # PyMuPDF
+    from PIL import Image, ImageFilter
+
+    with fitz.open(stream=pdf, filetype="pdf") as doc:
+        pixmap = doc[0].get_pixmap(dpi=100, colorspace=fitz.csGRAY)
+        image = Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
+    image = image.rotate(0.5, fillcolor=255).filter(ImageFilter.GaussianBlur(0.8))
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=70)
+    return out.getvalue()
+
+
+def failures():
+    original = invoice_pdf("INV-2024/117", "03/02/2024", [("Consultation", 800.0), ("X-Ray Chest", 1250.0),
+                                                           ("Pharmacy", 432.5)])
+    other = invoice_pdf("INV-2024/118", "04/02/2024", [("Consultation", 800.0), ("Blood Test CBC", 350.0),
+                                                        ("Pharmacy", 219.0)])
+    # (name, document, prebuilt content, expected match)
+    cases = [
+        ("re-export of the PDF", original, document_text(original), "original.pdf"),
+        ("rescan of the PDF", rescan(original), document_text(original), "original.pdf"),
+        ("other invoice, same letterhead", other, document_text(other), None),
+        ("rescan of the other invoice", rescan(other), document_text(other), None),
+    ]
+
+    problems = []
+    with tempfile.TemporaryDirectory() as directory:
+        index = NearDuplicateIndex(os.path.join(directory, "near_duplicates.db"))
+        indexed = signature(original)
+        index.add("original", "original.pdf", indexed, rows=[], content=document_text(original))
+        for name, document, content, expected in cases:
+            sig = signature(document)
+            prior = index.find(sig, content=content if needs_content(sig) else None)
+            found = prior["file_name"] if prior else None
+            distance = hamming(sig["phash"], indexed["phash"]) if sig["phash"] is not None else None
+            outcome = f"match {found} ({prior['similarity']:.2f})" if prior else "no match"
+            kind = "image" if needs_content(sig) else "text"
+            print(f"  {name:<32} {kind:<5} phash distance {distance}  {outcome}")
+            if found != expected:
+                problems.append(f"{name} matched {found}, expected {expected}")
+    return problems
+
+
+def main():
+    problems = failures()
+    for problem in problems:
+        print(f"FAIL {problem}")
+    print(f"{len(problems)} failures")
+    raise SystemExit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,13 @@
 import os,io
-import json
-import fitz  # PyMuPDF
 import pandas as pd
-import openai
 import streamlit as st
 from dotenv import load_dotenv
-from azure.ai.formrecognizer import DocumentAnalysisClient, DocumentTable, DocumentTableCell
-from azure.core.credentials import AzureKeyCredential
 from io import BytesIO
-from PIL import Image
-import base64
-from typing import List
+from typing import TYPE_CHECKING, List
+from backend import analyze_document, get_document_analysis_client
+from document_buffer import DocumentBuffer
+from batch_view import accept_upload, run_batch
+from reconcile import describe
 
 # Load environment variables
 load_dotenv('.env')
@@ -20,29 +17,11 @@ AZURE_OPENAI_VERSION = os.getenv("AZURE_OPENAI_VERSION")
 AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 AZURE_OPENAI_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT")
 AZURE_OPENAI_API_KEY = os.getenv('AZURE_OPENAI_API_KEY')
+OPENAI_CONFIG = (AZURE_OPENAI_VERSION, AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_DEPLOYMENT, AZURE_OPENAI_API_KEY)
 
-# Azure Form Recognizer configurations
-FR_ENDPOINT = os.getenv('AZURE_ENDPOINT')
-FR_KEY = os.getenv('AZURE_KEY')
-
-endpoint = os.getenv('AZURE_ENDPOINT')
-api_key = os.getenv('AZURE_KEY')
+# Custom model used by the Form Recognizer extractor
 custom_model_id = os.getenv('CUSTOM_AZURE_MODEL_ID')
 
-# Initialize the Document Analysis Client
-document_analysis_client = DocumentAnalysisClient(
-    endpoint=str(FR_ENDPOINT), credential=AzureKeyCredential(str(FR_KEY))
-)
-
-def extract_text_from_pdf(pdf_file):
-    try:
-        doc = fitz.open(stream=pdf_file, filetype="pdf")
-        text = "".join([page.get_text() for page in doc])
-        return text
-    except Exception as e:
-        st.error(f"Error extracting text from PDF: {e}")
-        return ""
-
 # Function to convert an image to PDF
 def convert_image_to_pdf(image):
     pdf_bytes = BytesIO()
@@ -61,60 +40,8 @@ def extract_invoice_total_from_azure(prebuilt_result):
         st.error("Could not find InvoiceTotal in the result.")
     return 0.0
 
-# Function to call Azure OpenAI for LLM response and convert to table
-def call_azure_openai(document_text, api_version: str, azure_endpoint: str, azure_deployment: str, api_key: str, file_name: str):
-    client = openai.AzureOpenAI(
-        api_key=api_key,
-        api_version=api_version,
-        azure_endpoint=azure_endpoint,
-        azure_deployment=azure_deployment,
-    )
-    prompt = f"""
-Extract the following fields from the provided text in JSON format:
-1. item_description: The name of the item.
-2. item_amount: The total amount for the item, including quantity.
-3. item_subcategory: The main category to which the item belongs. If not specified, print it as "None".
-4. item_subcategory_total: The total amount for item_subcategory. Total in the middle of the table is also considered as item_subcategory_total. If not available, print it as "None".
-
-Instructions:
-- Maintain the order of items as they appear in the invoice.
-- Do not ignore duplicate items; include them as they appear.
-- If an amount is missing after an item name, treat the item name as a category.
-- Ensure each item and its details are properly structured in the JSON output.
-        Text: {document_text}
-    """
-
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "system", "content": prompt}],
-        temperature=0.7,
-        response_format={"type": "json_object"}
-    )
-
-    response_message = response.choices[0].message.content
-
-    try:
-        response_message = json.loads(response_message)
-    except json.JSONDecodeError:
-        st.write(f'Error decoding response: {response_message}')
-        return None
-
-    items = []
-    for item in response_message.get("items", []):
-        item_dict = {
-            "file_name": file_name,
-            "item-name": item.get("item_description", ""),
-            "item-amount": item.get("item_amount", ""),
-            "item-subcategory": item.get("item_subcategory", ""),
-            "item-sub-category-total": item.get("item_subcategory_total", "")
-        }
-        items.append(item_dict)
-
-    df = pd.DataFrame(items)
-    return df
-
-def display_pdf(file, width=500, height=600):
-    base64_pdf = base64.b64encode(file.getvalue()).decode('utf-8')
+def display_pdf(document, width=500, height=600):
+    base64_pdf = document.base64()
     pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="{width}" height="{height}" type="application/pdf"></iframe>'
     st.markdown(pdf_display, unsafe_allow_html=True)
 
@@ -126,10 +53,14 @@ def highlight_none(val):
         color = ''
     return color
 
-Row = List[DocumentTableCell]
+# Table types are only needed for annotations
+if TYPE_CHECKING:
+    from azure.ai.formrecognizer import DocumentTable, DocumentTableCell
+
+Row = List["DocumentTableCell"]
 RawTable = List[Row]
 
-def group_table_by_rows(table: DocumentTable) -> RawTable:
+def group_table_by_rows(table: "DocumentTable") -> RawTable:
     cells = sorted(table.cells, key=lambda cell: (cell.row_index, cell.column_index))
     curr_row_idx = cells[0].row_index
 
@@ -165,7 +96,7 @@ def extract_table_title(raw_table) -> str:
 def has_table_title(raw_table) -> bool:
     return len(raw_table[0]) == 1
 
-def tables_to_dataframe(tables: List[DocumentTable]) -> List[pd.DataFrame]:
+def tables_to_dataframe(tables: List["DocumentTable"]) -> List[pd.DataFrame]:
     if not tables:
         return []
 
@@ -195,18 +126,14 @@ def tables_to_dataframe(tables: List[DocumentTable]) -> List[pd.DataFrame]:
 
 class CustomDocExtractor:
     def __init__(self):
-        # Initialize the Document Analysis Client
-        self.document_analysis_client = DocumentAnalysisClient(
-            endpoint=endpoint,
-            credential=AzureKeyCredential(str(api_key))
-        )
+        # Share the lazily built Document Analysis Client
+        self.document_analysis_client = get_document_analysis_client()
 
     def analyze_document(self, document_data: bytes):
-        with io.BytesIO(document_data) as document_stream:
-            poller = self.document_analysis_client.begin_analyze_document(custom_model_id, document_stream)
-            result = poller.result()
-            list_of_extracted_tables = result.tables
-            list_of_table_df = tables_to_dataframe(list_of_extracted_tables)
+        result = analyze_document(self.document_analysis_client, custom_model_id, document_data)
+        list_of_extracted_tables = result.tables
+        # Materialize the (title, table) pairs so cached results can be read more than once
+        list_of_table_df = list(tables_to_dataframe(list_of_extracted_tables))
         return [result, list_of_table_df]
 
 def main():
@@ -258,19 +185,36 @@ def main():
         else:
             st.markdown("<div class='blue-heading'>Extracting information from Multiple invoices...</div>", unsafe_allow_html=True)
 
-        all_data = []
+        # Rows of every file are shown in the table as soon as the LLM emits them
+        live_table = None
+        if len(uploaded_files) > 1:
+            st.write("### Combined Extracted Data")
+            live_table = st.empty()
 
+        # Prepare the documents; the extraction itself runs in background workers
+        jobs = []
         for uploaded_file in uploaded_files:
+            # One buffer per upload, shared by preflight, the hash, the preview and every analysis stage
+            upload = DocumentBuffer(uploaded_file.getvalue())
+
+            # Encrypted, truncated or oversize files are rejected before any remote call
+            if not accept_upload(uploaded_file.name, upload):
+                continue
+
+            # Results are memoized per file content, so reruns skip the remote calls
+            key = upload.digest
             if uploaded_file.type == "application/pdf":
-                document = uploaded_file.read()
-                document_text = extract_text_from_pdf(document)
+                document = upload
 
                 if len(uploaded_files) == 1:
                     col1, col2 = st.columns(2)
                     with col1:
-                        display_pdf(uploaded_file, width=500, height=600)
+                        display_pdf(upload, width=500, height=600)
+                    live_table = col2.empty()
             
             else:
+                from PIL import Image
+
                 image = Image.open(uploaded_file)
                 if uploaded_file.type == "image/png":
                     jpg_bytes = BytesIO()
@@ -280,66 +224,32 @@ def main():
                 else:
                     document = convert_image_to_pdf(image)
 
-                document_text = extract_text_from_pdf(document)
-
                 if len(uploaded_files) == 1:
                     col1, col2 = st.columns(2)
                     with col1:
                         st.image(image, caption="Uploaded Invoice", use_column_width=True)
+                    live_table = col2.empty()
 
-            result, list_of_table_df = CustomDocExtractor().analyze_document(document)
-            document_text = result.content
-
-            st.session_state.result = result
-            st.session_state.list_of_table_df = list_of_table_df
-            st.session_state.document_text = document_text
-
-            poller = document_analysis_client.begin_analyze_document(
-                "prebuilt-invoice", document=document
-            )
-            prebuilt_result = poller.result()
-
-            st.session_state.prebuilt_result = prebuilt_result
+            jobs.append((uploaded_file.name, key, document))
 
-            llm_df = call_azure_openai(
-                st.session_state.document_text,
-                AZURE_OPENAI_VERSION,
-                AZURE_OPENAI_ENDPOINT,
-                AZURE_OPENAI_DEPLOYMENT,
-                AZURE_OPENAI_API_KEY,
-                uploaded_file.name
-            )
-
-            if llm_df is not None:
-                all_data.append(llm_df)
-
-            with io.BytesIO(document) as document_stream:
-                poller = document_analysis_client.begin_analyze_document(
-                    model_id="prebuilt-invoice", document=document_stream
-                )
-                prebuilt_result = poller.result()
-
-            # Extract the invoice total directly from Azure's result
-            invoice_total = extract_invoice_total_from_azure(prebuilt_result)
+        # Extract the invoice total directly from Azure's result as each file finishes
+        def show_invoice_total(file_name, results):
+            nonlocal total_amount
+            invoice_total = extract_invoice_total_from_azure(results["prebuilt"])
             total_amount += invoice_total
 
             # Display the invoice total for the current document
-            st.write(f"### Extracted Invoice Total for {uploaded_file.name}:{invoice_total:.2f}")
+            st.write(f"### Extracted Invoice Total for {file_name}:{invoice_total:.2f}")
+            # Whether the extracted items add up to it, which decides if the LLM had to run
+            st.caption(f"Line items: {describe(results['reconciliation'])}")
 
-        if all_data:
-            combined_df = pd.concat(all_data, ignore_index=True)
-            styled_df = combined_df.style.applymap(highlight_none)
-
-            if len(uploaded_files) > 1:
-                st.write("### Combined Extracted Data")
-                st.dataframe(styled_df)
-            else:
-                col2.dataframe(styled_df)
+        preview = run_batch(jobs, live_table, OPENAI_CONFIG, extractor=CustomDocExtractor,
+                            on_file_done=show_invoice_total)
 
-        if all_data:
-            combined_df = pd.concat(all_data, ignore_index=True)
-            styled_df = combined_df.style.applymap(highlight_none)
+        if not preview.empty:
+            styled_df = preview.style.applymap(highlight_none)
 
+            live_table.dataframe(styled_df)
 
         st.success("Extraction completed successfully.")
 
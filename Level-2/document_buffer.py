@@ -0,0 +1,66 @@
+import base64
+import functools
+import hashlib
+import io
+
+
+class DocumentBuffer:
+    # The bytes of one uploaded document, read once and shared by every
+    # stage. Hashing, page counting, text extraction, both Azure calls and
+    # the preview all read these immutable bytes through memoryview and
+    # stream views. The values derived from them are computed once per
+    # document, however many stages ask for them.
+    def __init__(self, data):
+        # bytes are kept as they are; a bytearray or memoryview is copied once
+        self._data = data if isinstance(data, bytes) else bytes(data)
+        self.view = memoryview(self._data)
+
+    @property
+    def data(self) -> bytes:
+        return self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    # Slices are small copies (headers, trailers); whole-document readers
+    # use `view`, `stream()` or `data`
+    def __getitem__(self, index):
+        return self._data[index]
+
+    @property
+    def is_pdf(self) -> bool:
+        return self._data.startswith(b"%PDF")
+
+    # A new read-only position over the shared bytes: a BytesIO built from
+    # bytes uses them in place until it is written to, which nothing does
+    def stream(self) -> io.BytesIO:
+        return io.BytesIO(self._data)
+
+    @functools.cached_property
+    def digest(self) -> str:
+        return hashlib.sha256(self.view).hexdigest()
+
+    # PyMuPDF reads the shared bytes in place
+    def open_pdf(self):
+        import fitz  # PyMuPDF
+
+        return fitz.open(stream=self._data, filetype="pdf")
+
+    @functools.cached_property
+    def page_count(self) -> int:
+        if not self.is_pdf:
+            return 1
+        try:
+            with self.open_pdf() as doc:
+                return max(doc.page_count, 1)
+        except Exception:
+            return 1
+
+    # Base64 text for data URIs, encoded straight from the view
+    def base64(self) -> str:
+        return base64.b64encode(self.view).decode("ascii")
+
+
+# Stages accept raw bytes as well; they are wrapped without copying
+def as_document(data) -> DocumentBuffer:
+    return data if isinstance(data, DocumentBuffer) else DocumentBuffer(data)
@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Hedging is opt-in: HEDGE_REQUESTS=1 enables it for analyses, completions
+# and the first chunk of streamed completions
+HEDGE_REQUESTS = os.getenv('HEDGE_REQUESTS', '0') == '1'
+# A duplicate is issued once a call runs longer than this latency percentile
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '95'))
+# Extra calls never exceed this fraction of all calls
+HEDGE_BUDGET = float(os.getenv('HEDGE_BUDGET', '0.05'))
+# Latencies needed before the percentile is trusted, and how many are kept
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 200
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv('HEDGE_WORKERS', '32')), thread_name_prefix='hedge')
+
+
+# Passes the result a losing call returned anyway to `discard`
+def discard_result(future, discard):
+    if not future.cancelled() and future.exception() is None and future.result() is not None:
+        discard(future.result())
+
+
+class HedgePolicy:
+    # Runs fn(cancelled) and, when it is slower than the configured
+    # percentile, races a duplicate against it. The first result wins and
+    # the loser's `cancelled` event is set so it can stop early.
+    def __init__(self, name: str, percentile: float = HEDGE_PERCENTILE, budget: float = HEDGE_BUDGET,
+                 enabled: bool = HEDGE_REQUESTS):
+        self.name = name
+        self.percentile = percentile
+        self.budget = budget
+        self.enabled = enabled
+        self.latencies = deque(maxlen=HEDGE_WINDOW)
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def hedge_delay(self):
+        with self._lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return ordered[index]
+
+    def _record(self, latency: float):
+        with self._lock:
+            self.latencies.append(latency)
+
+    def _take_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+    # `discard(result)` releases the result of a losing call that returned
+    # one anyway, e.g. closes a stream
+    def run(self, fn, discard=None):
+        with self._lock:
+            self.calls += 1
+
+        delay = self.hedge_delay() if self.enabled else None
+        start = time.monotonic()
+        if delay is None:
+            result = fn(threading.Event())
+            self._record(time.monotonic() - start)
+            return result
+
+        primary_cancelled = threading.Event()
+        primary = _executor.submit(fn, primary_cancelled)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_hedge():
+            result = primary.result()
+            self._record(time.monotonic() - start)
+            return result
+
+        hedge_cancelled = threading.Event()
+        hedge = _executor.submit(fn, hedge_cancelled)
+        cancel_events = {primary: primary_cancelled, hedge: hedge_cancelled}
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                # Both calls may have finished together; the other one loses
+                # either way, and a result it already returned is discarded
+                for loser in set(cancel_events) - {future}:
+                    cancel_events[loser].set()
+                    if not loser.cancel() and discard is not None:
+                        loser.add_done_callback(lambda lost: discard_result(lost, discard))
+                if future is hedge:
+                    with self._lock:
+                        self.hedge_wins += 1
+                self._record(time.monotonic() - start)
+                return future.result()
+        raise error
+
+    def stats(self) -> dict:
+        delay = self.hedge_delay()
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "hedge_delay": delay,
+            }
+
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+def get_hedge_policy(name: str) -> HedgePolicy:
+    with _policies_lock:
+        if name not in _policies:
+            _policies[name] = HedgePolicy(name)
+        return _policies[name]
+
+
+# Hedge counts and wins of every policy in this process
+def hedge_stats() -> dict:
+    with _policies_lock:
+        policies = list(_policies.values())
+    return {policy.name: policy.stats() for policy in policies}
@@ -0,0 +1,315 @@
+"""Watch a folder and extract every invoice dropped into it.
+
+    python ingest_daemon.py /shared/invoices --output out/
+    python ingest_daemon.py /shared/invoices --output out/ --mode line-items --workers 8
+
+Files are hashed and skipped when the same content was already extracted.
+Rows are appended to <output>/items.jsonl (or the Parquet dataset
+<output>/items/ with --format parquet) and every file is recorded in the
+ledger <output>/ledger.db. On startup only files changed since the ledger's
+last checkpoint are rescanned, plus files that failed before.
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from batch_cli import EXTENSIONS, FORMATS, MODES, close_sink, extract_document, open_sink
+from document_buffer import DocumentBuffer
+
+load_dotenv('.env')
+
+# Seconds a file must stay unchanged before it is picked up, so files that
+# are still being written by a scanner or a copy are not read half-way
+SETTLE_SECONDS = float(os.getenv('INGEST_SETTLE_SECONDS', '2.0'))
+
+# Seconds between loop iterations, and between rescans without watchdog
+POLL_INTERVAL = float(os.getenv('INGEST_POLL_INTERVAL', '1.0'))
+
+# Tolerance for clock differences between the file server and this host
+CLOCK_SLACK = 5.0
+
+
+# Last time the file or its directory entry changed. A file moved into the
+# folder keeps its old mtime, but the rename updates its ctime.
+def changed_time(stat) -> float:
+    return max(stat.st_mtime, stat.st_ctime)
+
+
+class Ledger:
+    # Processed files by content hash, and the checkpoint time up to which
+    # every change in the folder has been handled
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS processed (
+                document_hash TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                row_count INTEGER NOT NULL,
+                seconds REAL NOT NULL,
+                error TEXT,
+                processed_at REAL NOT NULL
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS processed_path ON processed (path)')
+        conn.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value REAL NOT NULL)')
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def is_processed(self, document_hash: str) -> bool:
+        row = self._connect().execute(
+            "SELECT 1 FROM processed WHERE document_hash = ? AND status = 'ok'", (document_hash,)
+        ).fetchone()
+        return row is not None
+
+    def record(self, document_hash: str, path: str, status: str, row_count: int, seconds: float, error: str = None):
+        self._connect().execute(
+            'INSERT OR REPLACE INTO processed (document_hash, path, status, row_count, seconds, error, processed_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (document_hash, path, status, row_count, seconds, error, time.time())
+        )
+
+    def failed_paths(self):
+        rows = self._connect().execute("SELECT path FROM processed WHERE status = 'error'").fetchall()
+        return [path for (path,) in rows]
+
+    def checkpoint(self) -> float:
+        row = self._connect().execute("SELECT value FROM state WHERE key = 'checkpoint'").fetchone()
+        return row[0] if row else 0.0
+
+    def set_checkpoint(self, value: float):
+        self._connect().execute("INSERT OR REPLACE INTO state (key, value) VALUES ('checkpoint', ?)", (value,))
+
+
+class IngestDaemon:
+    def __init__(self, folder: str, output: str, mode: str = "llm", fields=(), workers: int = 4,
+                 settle: float = SETTLE_SECONDS, output_format: str = "jsonl"):
+        os.makedirs(output, exist_ok=True)
+        self.folder = folder
+        self.mode = mode
+        self.fields = tuple(fields)
+        self.workers = workers
+        self.settle = settle
+        self.ledger = Ledger(os.path.join(output, "ledger.db"))
+        self.sink = open_sink(output, output_format, source="watch")
+        self.stopped = threading.Event()
+
+        # path -> (time of the last event, size, changed time) for files not yet submitted
+        self._seen = {}
+        self._seen_lock = threading.Lock()
+        # path -> changed time of the version last submitted
+        self._submitted = {}
+        # future -> (path, changed time) for files being extracted
+        self._running = {}
+        # Hashes being extracted, so copies dropped together are processed once
+        self._in_flight = set()
+        self._in_flight_lock = threading.Lock()
+
+    # Files under the folder that changed at or after `since`
+    def scan(self, since: float = 0.0):
+        stack = [self.folder]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith(EXTENSIONS):
+                    try:
+                        if changed_time(entry.stat()) >= since - CLOCK_SLACK:
+                            yield entry.path
+                    except OSError:
+                        continue
+
+    # Called from the watcher thread as well as the main loop
+    def notice(self, path: str):
+        if not path.lower().endswith(EXTENSIONS):
+            return
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        changed = changed_time(stat)
+        with self._seen_lock:
+            # Rescans and repeated events for an unchanged file keep its settle timer
+            if self._submitted.get(path) == changed:
+                return
+            previous = self._seen.get(path)
+            if previous is not None and previous[1:] == (stat.st_size, changed):
+                return
+            self._seen[path] = (time.time(), stat.st_size, changed)
+
+    # Files whose size and times have not changed for the settle period
+    def _settled(self):
+        now = time.time()
+        ready = []
+        with self._seen_lock:
+            for path, (seen_at, size, changed) in list(self._seen.items()):
+                if now - seen_at < self.settle:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # Deleted or moved away before it was picked up
+                    del self._seen[path]
+                    continue
+                if stat.st_size != size or changed_time(stat) != changed:
+                    self._seen[path] = (now, stat.st_size, changed_time(stat))
+                    continue
+                ready.append((path, changed))
+        return ready
+
+    # Runs on a worker thread: hash, skip duplicates, extract
+    def _process(self, path: str):
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            document = DocumentBuffer(f.read())
+        digest = document.digest
+        with self._in_flight_lock:
+            if digest in self._in_flight or self.ledger.is_processed(digest):
+                return {"path": path, "document_hash": digest, "status": "duplicate", "rows": []}
+            self._in_flight.add(digest)
+
+        try:
+            rows, _ = extract_document(document, os.path.basename(path), self.mode, self.fields)
+            record = {"status": "ok", "rows": rows}
+        except Exception as e:
+            record = {"status": "error", "rows": [], "error": f"{type(e).__name__}: {e}"}
+        record.update(path=path, document_hash=digest, seconds=round(time.perf_counter() - start, 3))
+        return record
+
+    def _finish(self, future):
+        path, _ = self._running.pop(future)
+        try:
+            record = future.result()
+        except OSError as e:
+            print(f"error {path}  ({e})", flush=True)
+            return
+
+        if record["status"] == "duplicate":
+            print(f"skip  {path}  (already processed)", flush=True)
+            return
+        # Rows are written before the ledger entry, so a crash can repeat a file but never lose one
+        if record["status"] == "ok":
+            self.sink.write(record["rows"], document_hash=record["document_hash"])
+        self.ledger.record(record["document_hash"], path, record["status"], len(record["rows"]),
+                           record["seconds"], record.get("error"))
+        with self._in_flight_lock:
+            self._in_flight.discard(record["document_hash"])
+        message = f"{record['status']:5} {record['seconds']:7.1f}s {len(record['rows']):4} rows  {path}"
+        if record["status"] == "error":
+            message += f"  ({record['error']})"
+        print(message, flush=True)
+
+    # Everything that changed before the returned time has been handled
+    def _safe_checkpoint(self, loop_start: float) -> float:
+        with self._seen_lock:
+            unfinished = [changed for _, _, changed in self._seen.values()]
+        unfinished += [changed for _, changed in self._running.values()]
+        return min(unfinished + [loop_start])
+
+    def _start_watcher(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            print("watchdog is not installed; polling the folder instead", flush=True)
+            return None
+
+        daemon = self
+
+        class Handler(FileSystemEventHandler):
+            def on_created(self, event):
+                if not event.is_directory:
+                    daemon.notice(event.src_path)
+
+            def on_modified(self, event):
+                if not event.is_directory:
+                    daemon.notice(event.src_path)
+
+            def on_moved(self, event):
+                if not event.is_directory:
+                    daemon.notice(event.dest_path)
+
+        observer = Observer()
+        observer.schedule(Handler(), self.folder, recursive=True)
+        observer.start()
+        return observer
+
+    def run(self):
+        since = self.ledger.checkpoint()
+        print(f"Watching {self.folder}; rescanning changes since checkpoint {since:.0f}", flush=True)
+
+        # Start watching before the rescan so nothing dropped in between is missed
+        observer = self._start_watcher()
+        last_scan = time.time()
+        for path in list(self.scan(since)) + self.ledger.failed_paths():
+            self.notice(path)
+
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ingest")
+        try:
+            while not self.stopped.is_set():
+                loop_start = time.time()
+                if observer is None and loop_start - last_scan >= POLL_INTERVAL:
+                    for path in self.scan(last_scan):
+                        self.notice(path)
+                    last_scan = loop_start
+
+                for future in [f for f in self._running if f.done()]:
+                    self._finish(future)
+
+                # Bounded concurrency: only as many files in flight as workers
+                for path, changed in self._settled()[:self.workers - len(self._running)]:
+                    with self._seen_lock:
+                        self._seen.pop(path, None)
+                        self._submitted[path] = changed
+                    self._running[executor.submit(self._process, path)] = (path, changed)
+
+                self.ledger.set_checkpoint(self._safe_checkpoint(loop_start))
+                self.stopped.wait(POLL_INTERVAL)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            # Let the files in flight finish so their results are not lost
+            executor.shutdown(wait=True)
+            for future in list(self._running):
+                self._finish(future)
+            self.ledger.set_checkpoint(self._safe_checkpoint(time.time()))
+            close_sink(self.sink)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("folder", help="folder to watch, including subfolders")
+    parser.add_argument("--output", required=True, help="directory for the extracted items and ledger.db")
+    parser.add_argument("--format", choices=FORMATS, default="jsonl", help="items.jsonl, or a partitioned Parquet dataset")
+    parser.add_argument("--mode", choices=MODES, default="llm",
+                        help="llm: custom model + Azure OpenAI items; line-items: prebuilt invoice line items")
+    parser.add_argument("--fields", default="", help="extra line item fields for --mode line-items, comma separated")
+    parser.add_argument("--workers", type=int, default=4, help="files processed at the same time")
+    args = parser.parse_args()
+
+    fields = [field.strip() for field in args.fields.split(",") if field.strip()]
+    IngestDaemon(args.folder, args.output, mode=args.mode, fields=fields, workers=args.workers,
+                 output_format=args.format).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import datetime
+
+from transform.amounts import parse_amount
+
+# Azure item field -> (column, kind). Extra columns keep the Azure field
+# names, which are also the names callers pass as selected fields.
+ITEM_FIELDS = {
+    "Description": ("item_name", "text"),
+    "Amount": ("item_amount", "currency"),
+    "UnitPrice": ("UnitPrice", "currency"),
+    "Tax": ("Tax", "currency"),
+    "Quantity": ("Quantity", "number"),
+    "Unit": ("Unit", "text"),
+    "Date": ("Date", "date"),
+    "ProductCode": ("ProductCode", "text"),
+}
+
+# Every normalized frame has these columns, in this order
+COLUMNS = ["file_name", "invoice_index", "item_name", "item_amount", "currency", "UnitPrice", "Tax", "Quantity", "Unit", "Date",
+           "ProductCode", "confidence"]
+
+# Columns returned whatever fields are selected
+BASE_COLUMNS = ["file_name", "invoice_index", "item_name", "item_amount", "currency"]
+
+NUMERIC_COLUMNS = [column for column, kind in ITEM_FIELDS.values() if kind in ("currency", "number")] + ["confidence"]
+TEXT_COLUMNS = [column for column, kind in ITEM_FIELDS.values() if kind in ("text", "date")] + ["currency"]
+
+
+def to_iso_date(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+# CurrencyValue, numbers and dates as plain display text
+def to_text(value):
+    if hasattr(value, "amount"):
+        code = getattr(value, "code", None) or getattr(value, "symbol", None) or ""
+        return f"{value.amount:.2f} {code}".strip()
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+# All Items of a prebuilt invoice result as one typed frame, built column by
+# column in a single pass: amounts split into a float and a currency code,
+# numeric quantities, ISO dates and the item confidence. `invoice_index`
+# numbers the invoices of a file that holds several, from 1.
+def normalize_items(prebuilt_result, file_name, invoice_index=1):
+    import numpy as np
+    import pandas as pd
+
+    items = [
+        item
+        for doc in prebuilt_result.documents
+        if "Items" in doc.fields
+        for item in doc.fields["Items"].value or []
+    ]
+    count = len(items)
+
+    numeric = {column: np.full(count, np.nan) for column in NUMERIC_COLUMNS}
+    text = {column: [None] * count for column in TEXT_COLUMNS}
+
+    for i, item in enumerate(items):
+        if item.confidence is not None:
+            numeric["confidence"][i] = item.confidence
+        for name, field in (item.value or {}).items():
+            spec = ITEM_FIELDS.get(name)
+            if spec is None or field is None or field.value is None:
+                continue
+            column, kind = spec
+            value = field.value
+            if kind == "currency":
+                amount = parse_amount(value)
+                if amount is not None:
+                    numeric[column][i] = amount
+                # The line amount's currency, else the unit price's
+                code = getattr(value, "code", None) or getattr(value, "symbol", None)
+                if code and (column == "item_amount" or text["currency"][i] is None):
+                    text["currency"][i] = code
+            elif kind == "number":
+                number = parse_amount(value)
+                if number is not None:
+                    numeric[column][i] = number
+            elif kind == "date":
+                text[column][i] = to_iso_date(value)
+            else:
+                text[column][i] = str(value)
+
+    data = {"file_name": [file_name] * count, "invoice_index": [invoice_index] * count}
+    data.update(numeric)
+    data.update(text)
+    return pd.DataFrame(data, columns=COLUMNS)
+
+
+# Base columns, the selected extra fields and the confidence; fields that
+# are not extracted come back as empty columns
+def select_fields(df, selected_fields):
+    import pandas as pd
+
+    columns = BASE_COLUMNS + [field for field in selected_fields if field not in BASE_COLUMNS] + ["confidence"]
+    return df.reindex(columns=columns, fill_value=pd.NA)
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from transform.amounts import parse_amounts
+from transform.hierarchy import parse_tables
+
+load_dotenv()
+
+# SQLite file mapping layout fingerprints to learned column mappings; an
+# empty value disables layout learning
+LAYOUT_STORE_DB = os.getenv('LAYOUT_STORE_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'layouts.db'))
+
+# Share of the LLM rows the learned columns must reproduce before a mapping is stored
+LAYOUT_MIN_MATCH = float(os.getenv('LAYOUT_MIN_MATCH', '0.9'))
+
+
+def normalize_text(value) -> str:
+    return re.sub(r"\s+", " ", str(value)).strip().lower()
+
+
+# Header cells lose digits and punctuation, so "Amount (Rs.)" and
+# "Amount Rs" or a page number in a header do not make a new layout
+def normalize_header(value) -> str:
+    return re.sub(r"[^a-z]+", " ", str(value).lower()).strip()
+
+
+def vendor_name(prebuilt_result) -> str:
+    for doc in prebuilt_result.documents or []:
+        field = doc.fields.get("VendorName")
+        if field is not None and field.value:
+            return normalize_text(field.value)
+    return ""
+
+
+# Identity of a vendor's table layout, hashed from the vendor name and the
+# header row of every table in order; returns (fingerprint, headers), with
+# no fingerprint when the document has no tables
+def fingerprint(vendor: str, list_of_table_df):
+    headers = [[normalize_header(column) for column in df.columns] for _, df in list_of_table_df or []]
+    if not headers:
+        return None, headers
+    key = json.dumps([vendor, headers], separators=(",", ":"))
+    return hashlib.sha256(key.encode("utf-8")).hexdigest(), headers
+
+
+# Learns which table columns hold the item descriptions and amounts the LLM
+# returned: per table, the column whose cells match the most LLM item names
+# and the one whose values match the most LLM amounts. Returns the mapping
+# ({"tables": [[description, amount] or None, ...]}) when at least
+# LAYOUT_MIN_MATCH of the LLM rows are reproduced, at least LAYOUT_MIN_MATCH
+# of the parsed rows are LLM rows, and the reproduced rows carry the LLM's
+# subcategories; else None.
+def learn_mapping(list_of_table_df, rows):
+    import pandas as pd
+
+    if not rows:
+        return None
+    names = {normalize_text(row.get("item-name", "")) for row in rows}
+    amounts = {round(value, 2) for value in parse_amounts(pd.Series([row.get("item-amount") for row in rows])).dropna()}
+
+    tables = []
+    for title, df in list_of_table_df or []:
+        if df is None or df.empty:
+            tables.append(None)
+            continue
+        name_hits = [df.iloc[:, i].map(normalize_text).isin(names).sum() for i in range(df.shape[1])]
+        amount_hits = [parse_amounts(df.iloc[:, i]).round(2).isin(amounts).sum() for i in range(df.shape[1])]
+        amount_column = max(range(df.shape[1]), key=lambda i: amount_hits[i])
+        candidates = [i for i in range(df.shape[1]) if i != amount_column]
+        description_column = max(candidates, key=lambda i: name_hits[i]) if candidates else None
+        if amount_hits[amount_column] == 0:
+            tables.append(None)
+            continue
+        if description_column is not None and name_hits[description_column] == 0:
+            description_column = None
+        tables.append([None if description_column is None else int(description_column), int(amount_column)])
+
+    # The mapping must reproduce the LLM rows through the same parser that
+    # applies it. Each LLM row is matched once, so duplicates count as often
+    # as they occur, and parsed rows the LLM did not return count against it.
+    items, check = parse_tables(list_of_table_df, columns=tables)
+    if not check["consistent"] or not items:
+        return None
+    titles = {normalize_text(title) for title, _ in list_of_table_df or []} | {"none", ""}
+    expected = {}
+    for row, amount in zip(rows, parse_amounts(pd.Series([row.get("item-amount") for row in rows]))):
+        if not pd.isna(amount):
+            key = (normalize_text(row.get("item-name", "")), round(amount, 2))
+            expected.setdefault(key, []).append(normalize_text(row.get("item-subcategory", "")))
+    reproduced = same_subcategory = 0
+    for item in items:
+        subcategories = expected.get((normalize_text(item["item_description"]), round(item["item_amount"], 2)))
+        if not subcategories:
+            continue
+        reproduced += 1
+        llm_subcategory = subcategories.pop(0)
+        subcategory = normalize_text(item["item_subcategory"])
+        # The parser falls back to the table title where the LLM says there is no subcategory
+        if subcategory == llm_subcategory or (llm_subcategory in ("none", "") and subcategory in titles):
+            same_subcategory += 1
+    if reproduced < LAYOUT_MIN_MATCH * len(rows) or reproduced < LAYOUT_MIN_MATCH * len(items):
+        return None
+    return {"tables": tables} if same_subcategory >= LAYOUT_MIN_MATCH * reproduced else None
+
+
+class LayoutStore:
+    # Learned column mappings of the table layouts seen so far, keyed by
+    # layout fingerprint, with how often each one was used
+    def __init__(self, db_path: str = LAYOUT_STORE_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS layouts (
+                fingerprint TEXT PRIMARY KEY,
+                vendor TEXT NOT NULL,
+                headers TEXT NOT NULL,
+                mapping TEXT NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                learned REAL NOT NULL,
+                used REAL
+            )
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def get(self, fingerprint: str):
+        row = self._connect().execute('SELECT mapping FROM layouts WHERE fingerprint = ?', (fingerprint,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    # A newly learned mapping replaces the old one and starts counting again
+    def save(self, fingerprint: str, vendor: str, headers, mapping: dict):
+        self._connect().execute(
+            'INSERT OR REPLACE INTO layouts (fingerprint, vendor, headers, mapping, hits, learned) VALUES (?, ?, ?, ?, 0, ?)',
+            (fingerprint, vendor, json.dumps(headers), json.dumps(mapping), time.time())
+        )
+
+    def hit(self, fingerprint: str):
+        self._connect().execute(
+            'UPDATE layouts SET hits = hits + 1, used = ? WHERE fingerprint = ?', (time.time(), fingerprint)
+        )
+
+    def delete(self, fingerprint: str):
+        self._connect().execute('DELETE FROM layouts WHERE fingerprint = ?', (fingerprint,))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_layout_store():
+    global _store
+    if not LAYOUT_STORE_DB:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = LayoutStore()
+        return _store
+
+
+# Items of a document whose layout has a learned mapping, or None when the
+# layout is unknown or its mapping no longer parses cleanly
+def known_layout_items(store: LayoutStore, fingerprint: str, list_of_table_df):
+    mapping = store.get(fingerprint)
+    if mapping is None:
+        return None
+    items, check = parse_tables(list_of_table_df, columns=mapping["tables"])
+    if not items or not check["consistent"]:
+        return None
+    store.hit(fingerprint)
+    return items
+
+
+# After the LLM ran on a miss: learns the layout's mapping from its rows, or
+# drops a stored mapping the rows no longer confirm. True when one was learned.
+def refresh_layout(store: LayoutStore, fingerprint: str, vendor: str, headers, list_of_table_df, rows) -> bool:
+    mapping = learn_mapping(list_of_table_df, rows)
+    if mapping is None:
+        store.delete(fingerprint)
+        return False
+    store.save(fingerprint, vendor, headers, mapping)
+    return True
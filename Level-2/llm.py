@@ -0,0 +1,266 @@
+import functools
+import itertools
+import json
+
+from hedging import get_hedge_policy
+from ratelimit import openai_limiter
+from transform.amounts import parse_amount
+from transform.json_stream import ItemStreamParser, find_items, salvage_items
+
+EXTRACTION_PROMPT = """
+Extract the following fields from the provided text in JSON format:
+1. item_description: The name of the item.
+2. item_amount: The total amount for the item, including quantity.
+3. item_subcategory: The main category to which the item belongs. If not specified, print it as "None".
+4. item_subcategory_total: The total amount for item_subcategory. Total in the middle of the table is also considered as item_subcategory_total. If not available, print it as "None".
+
+Instructions:
+- Maintain the order of items as they appear in the invoice.
+- Do not ignore duplicate items; include them as they appear.
+- If an amount is missing after an item name, treat the item name as a category.
+- Ensure each item and its details are properly structured in the JSON output.
+        Text: {document_text}
+    """
+
+# Appended to the prompt when a truncated response has to be continued
+CONTINUATION_PROMPT = """
+The previous extraction was cut off. These are the last items that were already extracted:
+{last_items}
+Only return the items that come after them in the text. Do not repeat the items above.
+    """
+
+# Structured output schema every response is bound to
+ITEM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "item_description": {"type": "string"},
+                    "item_amount": {"type": ["number", "string"]},
+                    "item_subcategory": {"type": "string"},
+                    "item_subcategory_total": {"type": ["number", "string"]},
+                },
+                "required": ["item_description", "item_amount", "item_subcategory", "item_subcategory_total"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["items"],
+    "additionalProperties": False,
+}
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "invoice_items", "strict": True, "schema": ITEM_SCHEMA},
+}
+
+# How many times a truncated response is continued, and how many of the
+# already extracted items are sent back as the anchor for the continuation
+MAX_CONTINUATIONS = 3
+CONTINUATION_CONTEXT_ITEMS = 3
+
+
+# Clients are built on first use and reused across calls
+@functools.lru_cache(maxsize=None)
+def get_openai_client(api_version: str, azure_endpoint: str, azure_deployment: str, api_key: str):
+    import openai
+
+    # No retries inside the SDK: 429s go to the shared rate limiter, which
+    # backs off and shrinks its concurrency window
+    return openai.AzureOpenAI(
+        api_key=api_key,
+        api_version=api_version,
+        azure_endpoint=azure_endpoint,
+        azure_deployment=azure_deployment,
+        max_retries=0,
+    )
+
+
+# Convert one item of the LLM response into a row of the output table
+def item_to_row(item: dict, file_name: str) -> dict:
+    return {
+        "file_name": file_name,
+        "item-name": item.get("item_description", ""),
+        "item-amount": item.get("item_amount", ""),
+        "item-subcategory": item.get("item_subcategory", ""),
+        "item-sub-category-total": item.get("item_subcategory_total", "")
+    }
+
+
+# Key two items are compared by when a continuation repeats already extracted ones
+def item_key(item: dict):
+    description = " ".join(str(item.get("item_description", "")).split()).lower()
+    return description, parse_amount(item.get("item_amount"))
+
+
+class ItemExtraction:
+    # Iterating yields the extracted item dicts in invoice order. Complete
+    # items of a truncated or malformed response are kept, and only the
+    # missing tail of the document is requested again.
+    def __init__(self, document_text, api_version: str, azure_endpoint: str, azure_deployment: str, api_key: str,
+                 prompt_template: str = EXTRACTION_PROMPT, stream: bool = False, max_continuations: int = MAX_CONTINUATIONS):
+        self.document_text = document_text
+        self.client = get_openai_client(api_version, azure_endpoint, azure_deployment, api_key)
+        self.limiter = openai_limiter(str(azure_endpoint), str(azure_deployment))
+        self.hedge = get_hedge_policy(f"completion:{azure_deployment}")
+        # Streamed completions are hedged on their time to the first chunk
+        self.first_chunk_hedge = get_hedge_policy(f"first-chunk:{azure_deployment}")
+        self.prompt_template = prompt_template
+        self.stream = stream
+        self.max_continuations = max_continuations
+
+        self.items = []
+        # Offset of each item's description in the document, None when the
+        # model paraphrased it; items are located in order from the cursor
+        self.positions = []
+        self.cursor = 0
+        # Index of the first item the continuation text starts at
+        self.resume_index = 0
+        self.complete = False
+        self.continuations = 0
+        self.text = ""
+
+    def __iter__(self):
+        prompt = self.prompt_template.format(document_text=self.document_text)
+        while True:
+            received = 0
+            # The continuation text starts at an item already extracted, so
+            # the response may open with those items again; they are dropped
+            # in order until the first new item
+            repeats = iter(self.items[self.resume_index:] if self.continuations else [])
+            repeat = next(repeats, None)
+            for item in self._request(prompt):
+                if repeat is not None and item_key(item) == item_key(repeat):
+                    repeat = next(repeats, None)
+                    continue
+                repeat = None
+                received += 1
+                self._locate(item)
+                self.items.append(item)
+                yield item
+
+            if self.complete or not received or self.continuations >= self.max_continuations:
+                return
+            self.continuations += 1
+            prompt = self._continuation_prompt()
+
+    def _request(self, prompt: str):
+        request = dict(
+            model="gpt-4o-mini",
+            messages=[{"role": "system", "content": prompt}],
+            temperature=0.7,
+            response_format=RESPONSE_FORMAT
+        )
+
+        if not self.stream:
+            # A losing duplicate cannot be aborted mid-request; its response is discarded
+            response = self.hedge.run(lambda cancelled: self.limiter.call(self.client.chat.completions.create, **request))
+            choice = response.choices[0]
+            text = choice.message.content or ""
+            try:
+                items, closed = find_items(json.loads(text)), True
+            except json.JSONDecodeError:
+                items, closed = salvage_items(text)
+            self._finish(text, closed and choice.finish_reason != "length")
+            yield from items
+            return
+
+        # The limiter slot is held until the whole response has streamed in.
+        # A duplicate request races a slow first chunk; the losing stream is
+        # closed, which frees its slot, as soon as its own first chunk arrives
+        # or, when both arrived together, as soon as the winner is picked.
+        def first_chunk(cancelled):
+            stream = self.limiter.stream(self.client.chat.completions.create, stream=True, **request)
+            first = next(stream, None)
+            if cancelled.is_set():
+                stream.close()
+                return None
+            return first, stream
+
+        first, stream = self.first_chunk_hedge.run(first_chunk, discard=lambda result: result[1].close())
+        chunks = stream if first is None else itertools.chain([first], stream)
+
+        parser = ItemStreamParser(None)
+        finish_reason = None
+        for chunk in chunks:
+            # Azure sends content filter results in chunks without choices
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.delta.content:
+                yield from parser.feed(choice.delta.content)
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+        self._finish(parser.text, parser.array_closed and finish_reason != "length")
+
+    def _finish(self, text: str, complete: bool):
+        if not self.text:
+            self.text = text
+        self.complete = complete
+
+    def _locate(self, item: dict):
+        description = str(item.get("item_description", "")).strip()
+        position = self.document_text.find(description, self.cursor) if description else -1
+        if position < 0:
+            self.positions.append(None)
+            return
+        self.positions.append(position)
+        self.cursor = position + len(description)
+
+    # Ask only for the part of the document from the last recovered items on.
+    # The text starts at the first of them that was located; when none was,
+    # at the last located item before them, or at the top of the document.
+    def _continuation_prompt(self) -> str:
+        context = max(len(self.items) - CONTINUATION_CONTEXT_ITEMS, 0)
+        located = [i for i, position in enumerate(self.positions) if position is not None]
+        starts = [i for i in located if i >= context] or [i for i in located if i < context][-1:]
+        self.resume_index = starts[0] if starts else 0
+        document_text = self.document_text[self.positions[starts[0]]:] if starts else self.document_text
+        return self.prompt_template.format(document_text=document_text) + CONTINUATION_PROMPT.format(
+            last_items=json.dumps(self.items[context:])
+        )
+
+
+# Stream the chat completion and yield each item dict as soon as its JSON object closes
+def stream_azure_openai_items(document_text, api_version: str, azure_endpoint: str, azure_deployment: str, api_key: str,
+                              prompt_template: str = EXTRACTION_PROMPT):
+    return iter(ItemExtraction(document_text, api_version, azure_endpoint, azure_deployment, api_key,
+                               prompt_template=prompt_template, stream=True))
+
+
+# Table rows for the items of one document, without any Streamlit output, so
+# background workers can run it. Returns the rows and the finished extraction.
+def extract_rows(document_text, api_version: str, azure_endpoint: str, azure_deployment: str, api_key: str, file_name: str,
+                 prompt_template: str = EXTRACTION_PROMPT, on_row=None):
+    extraction = ItemExtraction(document_text, api_version, azure_endpoint, azure_deployment, api_key,
+                                prompt_template=prompt_template, stream=on_row is not None)
+
+    rows = []
+    for item in extraction:
+        row = item_to_row(item, file_name)
+        if on_row is not None:
+            on_row(row)
+        rows.append(row)
+    return rows, extraction
+
+
+# Function to call Azure OpenAI for LLM response and convert to table.
+# When `on_row` is given the completion is streamed and each row is passed to it as soon as it is parsed.
+def call_azure_openai(document_text, api_version: str, azure_endpoint: str, azure_deployment: str, api_key: str, file_name: str,
+                      prompt_template: str = EXTRACTION_PROMPT, on_row=None):
+    import pandas as pd
+    import streamlit as st
+
+    items, extraction = extract_rows(document_text, api_version, azure_endpoint, azure_deployment, api_key, file_name,
+                                     prompt_template=prompt_template, on_row=on_row)
+
+    if not items and not extraction.complete:
+        st.write(f'Error decoding response: {extraction.text}')
+        return None
+    if not extraction.complete:
+        st.warning(f"The response for {file_name} was incomplete; showing the {len(items)} items that could be recovered.")
+
+    return pd.DataFrame(items)
@@ -1,16 +1,9 @@
 import os
-import json
-import fitz  # PyMuPDF
-import pandas as pd
-import openai
 import streamlit as st
 from dotenv import load_dotenv
-from azure.ai.formrecognizer import DocumentAnalysisClient
-from azure.core.credentials import AzureKeyCredential
 from io import BytesIO
-from PIL import Image
-import base64
-from backend import CustomDocExtractor
+from document_buffer import DocumentBuffer
+from batch_view import accept_upload, run_batch
 
 # Load environment variables
 load_dotenv('.env')
@@ -20,23 +13,7 @@ AZURE_OPENAI_VERSION = os.getenv("AZURE_OPENAI_VERSION")
 AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 AZURE_OPENAI_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT")
 AZURE_OPENAI_API_KEY = os.getenv('AZURE_OPENAI_API_KEY')
-
-# Azure Form Recognizer configurations
-FR_ENDPOINT = os.getenv('AZURE_ENDPOINT')
-FR_KEY = os.getenv('AZURE_KEY')
-
-# Initialize the Document Analysis Client
-document_analysis_client = DocumentAnalysisClient(
-    endpoint=FR_ENDPOINT, credential=AzureKeyCredential(FR_KEY)
-)
-
-# Function to extract text from PDF
-def extract_text_from_pdf(pdf_file):
-    doc = fitz.open(stream=pdf_file, filetype="pdf")
-    text = ""
-    for page in doc:
-        text += page.get_text()
-    return text
+OPENAI_CONFIG = (AZURE_OPENAI_VERSION, AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_DEPLOYMENT, AZURE_OPENAI_API_KEY)
 
 # Function to convert an image to PDF
 def convert_image_to_pdf(image):
@@ -45,68 +22,13 @@ def convert_image_to_pdf(image):
     pdf_bytes.seek(0)  # Move to the beginning of the BytesIO object
     return pdf_bytes.read()  # Return the bytes
 
-# Function to call Azure OpenAI for LLM response and convert to table
-def call_azure_openai(document_text, api_version: str, azure_endpoint: str, azure_deployment: str, api_key: str, file_name: str):
-    client = openai.AzureOpenAI(
-        api_key=api_key,
-        api_version=api_version,
-        azure_endpoint=azure_endpoint,
-        azure_deployment=azure_deployment,
-    )
-    prompt = f"""
-Extract the following fields from the provided text in JSON format:
-1. item_description: The name of the item.
-2. item_amount: The total amount for the item, including quantity.
-3. item_subcategory: The main category to which the item belongs. If not specified, print it as "None".
-4. item_subcategory_total: The total amount for item_subcategory. Totel in the middle of the table is also considered as item_subcategory_total. If not available, print it as "None". 
-
-Instructions:
-- Maintain the order of items as they appear in the invoice.
-- Do not ignore duplicate items; include them as they appear.
-- If an amount is missing after an item name, treat the item name as a category.
-- Ensure each item and its details are properly structured in the JSON output.
-        Text: {document_text}
-    """
-
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "system", "content": prompt}],
-        temperature=0.7,
-        response_format={"type": "json_object"}
-    )
-
-    response_message = response.choices[0].message.content
-
-    try:
-        response_message = json.loads(response_message)
-    except json.JSONDecodeError:
-        st.write(f'Error decoding response: {response_message}')
-        return None
-
-    # Extract the fields from the response and create a table
-    items = []
-    for item in response_message.get("items", []):  # Assuming items is a list in the response
-        item_dict = {
-            "file_name": file_name,
-            "item-name": item.get("item_description", ""),
-            "item-amount": item.get("item_amount", ""),
-            "item-subcategory": item.get("item_subcategory", ""),
-            "item-sub-category-total": item.get("item_subcategory_total", "")
-        }
-        items.append(item_dict)
-
-    # Convert to DataFrame
-    df = pd.DataFrame(items)
-    return df
-def display_pdf(file, width=500, height=600):
+def display_pdf(document, width=500, height=600):
     # Encode the PDF to base64
-    base64_pdf = base64.b64encode(file.getvalue()).decode('utf-8')
+    base64_pdf = document.base64()
     # Display the PDF in an iframe
     pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="{width}" height="{height}" type="application/pdf"></iframe>'
     st.markdown(pdf_display, unsafe_allow_html=True)
 
-import pandas as pd
-
 # Function to highlight 'None' cells in red
 def highlight_none(val):
     if val == "None":
@@ -199,25 +121,40 @@ def main():
             st.markdown("<div class='blue-heading'>Extracting information from Multiple invoices...</div>", unsafe_allow_html=True)
 
 
-        # Initialize a list to hold all the extracted data
-        all_data = []
+        # Rows of every file are shown in the table as soon as the LLM emits them
+        live_table = None
+        if len(uploaded_files) > 1:
+            st.write("### Combined Extracted Data")
+            live_table = st.empty()
 
-        # Loop through the uploaded files
+        # Prepare the documents; the extraction itself runs in background workers
+        jobs = []
         for uploaded_file in uploaded_files:
+            # One buffer per upload, shared by preflight, the hash, the preview and every analysis stage
+            upload = DocumentBuffer(uploaded_file.getvalue())
+
+            # Encrypted, truncated or oversize files are rejected before any remote call
+            if not accept_upload(uploaded_file.name, upload):
+                continue
+
+            # Results are memoized per file content, so reruns skip the remote calls
+            key = upload.digest
 
             # Process the uploaded file
             if uploaded_file.type == "application/pdf":
-                document = uploaded_file.read()
-                document_text = extract_text_from_pdf(document)
+                document = upload
 
                 # If only one file is uploaded, display the PDF
                 if len(uploaded_files) == 1:
                     col1, col2 = st.columns(2)
                     with col1:
-                        display_pdf(uploaded_file, width=500, height=600)
+                        display_pdf(upload, width=500, height=600)
+                    live_table = col2.empty()
             
             else:
                 # Handle image files
+                from PIL import Image
+
                 image = Image.open(uploaded_file)
 
                 # Convert PNG to JPG if the file is in PNG format
@@ -229,59 +166,25 @@ def main():
                 else:
                     document = convert_image_to_pdf(image)  # Convert other image types to PDF
 
-                document_text = extract_text_from_pdf(document)
-
                 # If only one file is uploaded, display the image
                 if len(uploaded_files) == 1:
                     col1, col2 = st.columns(2)
                     with col1:
                         st.image(image, caption="Uploaded Invoice", use_column_width=True)
+                    live_table = col2.empty()
+
+            jobs.append((uploaded_file.name, key, document))
 
-            # Analyze using custom extractor
-            result, list_of_table_df = CustomDocExtractor().analyze_document(document)
-            document_text = result.content
-
-            # Store results in session state
-            st.session_state.result = result
-            st.session_state.list_of_table_df = list_of_table_df
-            st.session_state.document_text = document_text
-
-            # Analyze using Prebuilt Model
-            poller = document_analysis_client.begin_analyze_document(
-                "prebuilt-invoice", document=document
-            )
-            prebuilt_result = poller.result()
-
-            # Store Prebuilt result in session state
-            st.session_state.prebuilt_result = prebuilt_result
-
-            # Call Azure OpenAI for LLM response
-            llm_df = call_azure_openai(
-                st.session_state.document_text,
-                AZURE_OPENAI_VERSION,
-                AZURE_OPENAI_ENDPOINT,
-                AZURE_OPENAI_DEPLOYMENT,
-                AZURE_OPENAI_API_KEY,
-                uploaded_file.name  # Pass the file name
-            )
-
-            # Accumulate data into the list
-            if llm_df is not None:
-                all_data.append(llm_df)
-
-        # Combine all DataFrames into a single DataFrame if there are multiple files
-        if all_data:
-            combined_df = pd.concat(all_data, ignore_index=True)
+        # Analyze with the custom and prebuilt models and call Azure OpenAI, several files at a time
+        # Every row goes to the Parquet dataset; the first rows come back for display
+        preview = run_batch(jobs, live_table, OPENAI_CONFIG)
 
+        if not preview.empty:
             # Apply conditional styling to highlight 'None' cells
-            styled_df = combined_df.style.applymap(highlight_none)
+            styled_df = preview.style.applymap(highlight_none)
 
-            # Display the combined DataFrame with styling in the second column or full width if more than one file
-            if len(uploaded_files) > 1:
-                st.write("### Combined Extracted Data")
-                st.dataframe(styled_df)
-            else:
-                col2.dataframe(styled_df)
+            # Replace the live table with the styled rows
+            live_table.dataframe(styled_df)
 
         # Success message after processing all files
         st.success("Extraction completed successfully.")
@@ -0,0 +1,304 @@
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from document_buffer import as_document
+
+load_dotenv()
+
+# Near-duplicate detection reuses another document's results, so it is
+# opt-in: "1" turns it on
+NEAR_DUP = os.getenv('NEAR_DUP', '0') == '1'
+
+# SQLite file of the signatures of analyzed documents; an empty value
+# disables near-duplicate detection
+NEAR_DUP_DB = os.getenv('NEAR_DUP_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'near_duplicates.db'))
+
+# A document is a near-duplicate of an earlier one when their text is at
+# least this similar (estimated Jaccard similarity of word shingles) and
+# both carry exactly the same numbers (invoice number, dates, amounts).
+NEAR_DUP_MIN_SIMILARITY = float(os.getenv('NEAR_DUP_MIN_SIMILARITY', '0.9'))
+
+# Documents without a text layer (rescans, photos, faxes) are matched in two
+# steps. Their first page's perceptual hash, within this many differing
+# bits, only finds candidates: it is dominated by the letterhead, which two
+# invoices of one hospital share. A candidate is confirmed once the
+# prebuilt model has read the new document: at least this share of the
+# numbers of both documents' text (invoice number, dates, amounts) must be
+# the same, and that text is not in the letterhead.
+NEAR_DUP_MAX_DISTANCE = int(os.getenv('NEAR_DUP_MAX_DISTANCE', '10'))
+NEAR_DUP_MIN_NUMBER_OVERLAP = float(os.getenv('NEAR_DUP_MIN_NUMBER_OVERLAP', '0.9'))
+
+# MinHash permutations, split into LSH bands of MINHASH_ROWS rows. With
+# 16 bands of 8 rows, pairs at 0.9 similarity share a band 99.9% of the time.
+# The 64 bit perceptual hash is split into 8 bands of 8 bits; hashes within
+# 10 bits share a band unless the differences fall in every band.
+PHASH_BANDS = 8
+MINHASH_PERMUTATIONS = 128
+MINHASH_ROWS = 8
+SHINGLE_WORDS = 3
+_PRIME = (1 << 61) - 1
+_rng = random.Random(5381)
+_A = [_rng.randrange(1, 1 << 29) for _ in range(MINHASH_PERMUTATIONS)]
+_B = [_rng.randrange(0, 1 << 61) for _ in range(MINHASH_PERMUTATIONS)]
+
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+def _signed(value: int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+# Difference hash of the first page: grayscale, 9x8 pixels, one bit per
+# horizontally adjacent pair. Survives rescans, recompression and resizing.
+def perceptual_hash(document: bytes):
+    from PIL import Image
+
+    document = as_document(document)
+    if document.is_pdf:
+        import fitz  # PyMuPDF
+
+        with document.open_pdf() as doc:
+            if doc.page_count == 0:
+                return None
+            pixmap = doc[0].get_pixmap(matrix=fitz.Matrix(0.25, 0.25), colorspace=fitz.csGRAY)
+            image = Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
+    else:
+        image = Image.open(document.stream()).convert("L")
+
+    pixels = list(image.resize((9, 8), Image.LANCZOS).getdata())
+    bits = 0
+    for row in range(8):
+        for column in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return bits
+
+
+def hamming(left: int, right: int) -> int:
+    return bin(left ^ right).count("1")
+
+
+def document_text(document: bytes) -> str:
+    document = as_document(document)
+    if not document.is_pdf:
+        return ""
+    with document.open_pdf() as doc:
+        return "".join(page.get_text() for page in doc)
+
+
+# MinHash signature of the word shingles of the text, or None for documents
+# with too little text (scans without a text layer)
+def minhash(text: str):
+    import numpy as np
+
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return None
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    # 32 bit shingle hashes keep a * x + b below 2**63
+    values = np.array([_hash64(shingle.encode("utf-8")) & 0xFFFFFFFF for shingle in shingles], dtype=np.uint64)
+    a = np.array(_A, dtype=np.uint64)[:, None]
+    b = np.array(_B, dtype=np.uint64)[:, None]
+    return ((a * values + b) % np.uint64(_PRIME)).min(axis=1).astype(np.uint64)
+
+
+# Distinct numbers of the text, in order of appearance
+def text_numbers(text: str) -> list:
+    return list(dict.fromkeys(re.findall(r"\d+(?:[.,/-]\d+)*", text or "")))
+
+
+# Hash of the distinct numbers of the text; a re-export keeps them all,
+# another invoice changes some
+def number_key(text: str):
+    numbers = text_numbers(text)
+    if not numbers:
+        return None
+    return hashlib.blake2b("\n".join(numbers).encode("utf-8"), digest_size=16).hexdigest()
+
+
+# Share of the numbers of two texts found in both (Jaccard similarity)
+def number_overlap(left: list, right: list) -> float:
+    left, right = set(left), set(right)
+    return len(left & right) / len(left | right) if left or right else 0.0
+
+
+# Text signature (MinHash and number key, None without a text layer) and
+# the first page's perceptual hash. Every document gets the perceptual hash,
+# so a rescan can find the PDF it was printed from.
+def signature(document: bytes) -> dict:
+    text = document_text(document)
+    try:
+        phash = perceptual_hash(document)
+    except Exception:
+        phash = None
+    return {"minhash": minhash(text), "numbers": number_key(text), "phash": phash}
+
+
+# Whether the document can only be matched by its image, once its content
+# has been read by the prebuilt model
+def needs_content(sig: dict) -> bool:
+    return sig["minhash"] is None and sig["phash"] is not None
+
+
+def decode_minhash(data: bytes):
+    import numpy as np
+
+    return np.frombuffer(data, dtype=np.uint64)
+
+
+def similarity(left, right) -> float:
+    return float((left == right).mean())
+
+
+def _bands(sig: dict):
+    if sig["minhash"] is not None and sig["numbers"] is not None:
+        rows = sig["minhash"]
+        for band in range(MINHASH_PERMUTATIONS // MINHASH_ROWS):
+            yield "minhash", band, _signed(_hash64(rows[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS].tobytes()))
+    if sig["phash"] is not None:
+        for band in range(PHASH_BANDS):
+            yield "phash", band, (sig["phash"] >> (8 * band)) & 0xFF
+
+
+class NearDuplicateIndex:
+    # Signatures of analyzed documents with their LSH bands, so candidates
+    # are found by band lookups instead of comparing against every document.
+    # The LLM rows of each document are kept to answer its near-duplicates.
+    def __init__(self, db_path: str = NEAR_DUP_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS signatures (
+                document_hash TEXT PRIMARY KEY,
+                file_name TEXT NOT NULL,
+                minhash BLOB,
+                numbers TEXT,
+                phash INTEGER,
+                content_numbers TEXT,
+                rows TEXT,
+                created REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS bands (
+                kind TEXT NOT NULL,
+                band INTEGER NOT NULL,
+                value INTEGER NOT NULL,
+                document_hash TEXT NOT NULL,
+                PRIMARY KEY (kind, band, value, document_hash)
+            ) WITHOUT ROWID;
+        """)
+        # Indexes created before these were stored; their rows never match
+        columns = [row[1] for row in self._connect().execute('PRAGMA table_info(signatures)')]
+        for column, column_type in (("numbers", "TEXT"), ("phash", "INTEGER"), ("content_numbers", "TEXT")):
+            if column not in columns:
+                self._connect().execute(f'ALTER TABLE signatures ADD COLUMN {column} {column_type}')
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    # `content` is the text the prebuilt model read from the document, whose
+    # numbers confirm image matches
+    def add(self, document_hash: str, file_name: str, sig: dict, rows=None, content=None):
+        conn = self._connect()
+        numbers = text_numbers(content)
+        with conn:
+            conn.execute('BEGIN')
+            conn.execute(
+                'INSERT OR REPLACE INTO signatures '
+                '(document_hash, file_name, minhash, numbers, phash, content_numbers, rows, created) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (document_hash, file_name, None if sig["minhash"] is None else sig["minhash"].tobytes(), sig["numbers"],
+                 None if sig["phash"] is None else _signed(sig["phash"]), json.dumps(numbers) if numbers else None,
+                 None if rows is None else json.dumps(rows, default=str), time.time())
+            )
+            conn.executemany(
+                'INSERT OR IGNORE INTO bands (kind, band, value, document_hash) VALUES (?, ?, ?, ?)',
+                [(kind, band, value, document_hash) for kind, band, value in _bands(sig)]
+            )
+
+    def _candidates(self, sig: dict, kind: str):
+        conn = self._connect()
+        candidates = set()
+        for band_kind, band, value in _bands(sig):
+            if band_kind == kind:
+                candidates.update(row[0] for row in conn.execute(
+                    'SELECT document_hash FROM bands WHERE kind = ? AND band = ? AND value = ?', (kind, band, value)
+                ))
+        rows = []
+        for digest in candidates:
+            row = conn.execute(
+                'SELECT file_name, minhash, numbers, phash, content_numbers, rows FROM signatures WHERE document_hash = ?',
+                (digest,)
+            ).fetchone()
+            if row is not None:
+                rows.append((digest,) + tuple(row))
+        return rows
+
+    # Whether an image match may still be confirmed: an earlier document's
+    # first page looks the same. Only worth reading the document's content for.
+    def has_image_candidates(self, sig: dict) -> bool:
+        return needs_content(sig) and any(
+            phash is not None and hamming(phash & ((1 << 64) - 1), sig["phash"]) <= NEAR_DUP_MAX_DISTANCE
+            for _, _, _, _, phash, _, _ in self._candidates(sig, "phash")
+        )
+
+    # The most similar earlier document, as a dict with its document_hash,
+    # file_name, rows (or None) and similarity, or None when there is none.
+    # A byte-identical earlier document is found as well. Documents without
+    # a text layer are matched by image and need `content`, the text the
+    # prebuilt model read from them; their similarity is the number overlap.
+    def find(self, sig: dict, content=None):
+        best = None
+        if not needs_content(sig):
+            for digest, file_name, stored_minhash, numbers, _, _, rows in self._candidates(sig, "minhash"):
+                if stored_minhash is None or numbers != sig["numbers"]:
+                    continue
+                score = similarity(sig["minhash"], decode_minhash(stored_minhash))
+                if score < NEAR_DUP_MIN_SIMILARITY:
+                    continue
+                if best is None or score > best["similarity"]:
+                    best = {"document_hash": digest, "file_name": file_name, "similarity": score,
+                            "rows": None if rows is None else json.loads(rows)}
+            return best
+
+        numbers = text_numbers(content)
+        if not numbers:
+            return None
+        for digest, file_name, _, _, phash, content_numbers, rows in self._candidates(sig, "phash"):
+            if phash is None or content_numbers is None:
+                continue
+            if hamming(phash & ((1 << 64) - 1), sig["phash"]) > NEAR_DUP_MAX_DISTANCE:
+                continue
+            score = number_overlap(numbers, json.loads(content_numbers))
+            if score < NEAR_DUP_MIN_NUMBER_OVERLAP:
+                continue
+            if best is None or score > best["similarity"]:
+                best = {"document_hash": digest, "file_name": file_name, "similarity": score,
+                        "rows": None if rows is None else json.loads(rows)}
+        return best
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_near_duplicate_index():
+    global _index
+    if not NEAR_DUP or not NEAR_DUP_DB:
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = NearDuplicateIndex()
+        return _index
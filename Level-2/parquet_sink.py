@@ -0,0 +1,134 @@
+import datetime
+import os
+import re
+import uuid
+
+from dotenv import load_dotenv
+
+from transform.amounts import parse_amount
+
+load_dotenv()
+
+# Root of the partitioned dataset the Streamlit apps write every extracted
+# row to, so a batch's rows are not held in memory; an empty value disables it
+PARQUET_SINK_DIR = os.getenv('PARQUET_SINK_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'extracted_items'))
+
+# Row keys of the LLM extraction and of the prebuilt line items, by column
+COLUMN_SOURCES = {
+    "item_name": ("item-name", "item_name"),
+    "item_amount": ("item-amount", "item_amount"),
+    "subcategory": ("item-subcategory",),
+    "subcategory_total": ("item-sub-category-total",),
+    "quantity": ("Quantity",),
+    "item_date": ("Date",),
+    "product_code": ("ProductCode",),
+}
+
+
+# Fixed schema of every file in the dataset. The partition columns
+# (ingest_date, source) are encoded in the directory names.
+def dataset_schema():
+    import pyarrow as pa
+
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("document_hash", pa.string()),
+        ("file_name", dictionary),
+        ("row_index", pa.int32()),
+        ("item_name", pa.string()),
+        ("item_amount", pa.float64()),
+        ("subcategory", dictionary),
+        ("subcategory_total", pa.float64()),
+        ("quantity", pa.float64()),
+        ("item_date", pa.string()),
+        ("product_code", pa.string()),
+        ("extracted_at", pa.timestamp("ms", tz="UTC")),
+    ])
+
+
+def to_text(value):
+    if value is None:
+        return None
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    text = str(value)
+    return text if text and text not in ("None", "nan", "<NA>") else None
+
+
+def first_present(row: dict, keys):
+    for key in keys:
+        if row.get(key) is not None:
+            return row[key]
+    return None
+
+
+def partition_value(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", value) or "unknown"
+
+
+class ParquetSink:
+    # Appends every file's line items to a hive-partitioned Parquet dataset
+    # (<root>/ingest_date=YYYY-MM-DD/source=<source>/<part>.parquet) as soon
+    # as the file finishes, so memory stays flat and results are queryable
+    # immediately. Each part is written to a hidden temporary name and
+    # renamed into place, so readers never see a half-written file.
+    def __init__(self, root: str, source: str):
+        self.root = root
+        self.source = partition_value(source)
+        self.schema = dataset_schema()
+
+    def partition_dir(self, ingest_date: datetime.date) -> str:
+        return os.path.join(self.root, f"ingest_date={ingest_date.isoformat()}", f"source={self.source}")
+
+    def table(self, rows, document_hash: str = None):
+        import pyarrow as pa
+
+        extracted_at = datetime.datetime.now(datetime.timezone.utc)
+        columns = {name: [] for name in self.schema.names}
+        for index, row in enumerate(rows):
+            columns["document_hash"].append(document_hash)
+            columns["file_name"].append(to_text(row.get("file_name")))
+            columns["row_index"].append(index)
+            columns["item_name"].append(to_text(first_present(row, COLUMN_SOURCES["item_name"])))
+            columns["item_amount"].append(parse_amount(first_present(row, COLUMN_SOURCES["item_amount"])))
+            columns["subcategory"].append(to_text(first_present(row, COLUMN_SOURCES["subcategory"])))
+            columns["subcategory_total"].append(parse_amount(first_present(row, COLUMN_SOURCES["subcategory_total"])))
+            columns["quantity"].append(parse_amount(first_present(row, COLUMN_SOURCES["quantity"])))
+            columns["item_date"].append(to_text(first_present(row, COLUMN_SOURCES["item_date"])))
+            columns["product_code"].append(to_text(first_present(row, COLUMN_SOURCES["product_code"])))
+            columns["extracted_at"].append(extracted_at)
+        return pa.Table.from_pydict(columns, schema=self.schema)
+
+    # Returns the path of the written part, or None when there were no rows
+    def write(self, rows, document_hash: str = None):
+        import pyarrow.parquet as pq
+
+        rows = list(rows)
+        if not rows:
+            return None
+
+        directory = self.partition_dir(datetime.date.today())
+        os.makedirs(directory, exist_ok=True)
+        name = f"{document_hash or 'part'}-{uuid.uuid4().hex[:12]}.parquet"
+        path = os.path.join(directory, name)
+        tmp_path = os.path.join(directory, f".{name}.tmp")
+
+        try:
+            pq.write_table(self.table(rows, document_hash), tmp_path, use_dictionary=["file_name", "subcategory"])
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path
+
+
+# The dataset as one pyarrow Table, optionally filtered, e.g.
+# read_dataset(root, filter=(ds.field("source") == "cli") & (ds.field("item_amount") > 100))
+def read_dataset(root: str, filter=None, columns=None):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    partitioning = ds.partitioning(pa.schema([("ingest_date", pa.string()), ("source", pa.string())]), flavor="hive")
+    dataset = ds.dataset(root, format="parquet", schema=dataset_schema().append(pa.field("ingest_date", pa.string()))
+                         .append(pa.field("source", pa.string())), partitioning=partitioning)
+    return dataset.to_table(filter=filter, columns=columns)
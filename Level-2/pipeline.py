@@ -0,0 +1,243 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from backend import (CustomDocExtractor, analyze_document, archived_result, custom_model_id, document_hash,
+                     get_document_analysis_client)
+from cascade import CASCADE, run_cascade
+from document_buffer import as_document
+from layouts import fingerprint, get_layout_store, known_layout_items, refresh_layout, vendor_name
+from llm import EXTRACTION_PROMPT, extract_rows, item_to_row
+from near_duplicates import get_near_duplicate_index, needs_content, signature
+from reconcile import RECONCILE_GATE, reconcile
+from slim_result import slim_custom_result, slim_result
+from transform.table_processing import tables_to_dataframe
+
+load_dotenv()
+
+# Files processed at the same time by one batch; the shared rate limiters
+# still bound the calls that actually reach Azure and OpenAI
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', '4'))
+
+# Stages of one document, in the order they run
+STAGES = ("custom", "prebuilt", "llm")
+
+
+class Cancelled(Exception):
+    pass
+
+
+# Stage results of an earlier near-duplicate document: its archived model
+# results and its LLM rows, relabelled with this file's name. Stages with
+# nothing stored are left out and run as usual.
+def near_duplicate_stages(prior: dict, file_name: str) -> dict:
+    import pandas as pd
+
+    stages = {}
+    try:
+        result = archived_result(custom_model_id, prior["document_hash"])
+        stages["custom"] = slim_custom_result([result, list(tables_to_dataframe(result.tables)) if result.tables else []])
+    except LookupError:
+        pass
+    try:
+        stages["prebuilt"] = slim_result(archived_result("prebuilt-invoice", prior["document_hash"]))
+    except LookupError:
+        pass
+    if prior["rows"] is not None:
+        stages["llm"] = pd.DataFrame(prior["rows"]).assign(file_name=file_name)
+    return stages
+
+
+# Runs the custom, prebuilt and LLM stages for one document.
+# `cached` holds stage results that are already known and are not recomputed.
+# Progress is reported through `emit(kind, payload)`:
+#   ("running", stage)                    a stage started
+#   ("stage", (stage, seconds, cached))   a stage finished
+#   ("result", (stage, value))            a freshly computed stage result
+#   ("row", row)                          an LLM row, as soon as it is parsed
+#   ("route", route)                      the custom and prebuilt models were routed
+#   ("reconciliation", decision)          the item sums were checked against the totals
+#   ("layout", layout)                    the table layout was looked up or learned
+#   ("duplicate", prior)                  stages were taken from a near-duplicate document
+#   ("warning", message)
+# With `only_cached` set, stages that are not cached are not started.
+# With `cascade` set, the second model only runs when the first one's
+# result misses its confidence and coverage thresholds.
+# With `reconcile_gate` set, the LLM stage returns the deterministic items
+# instead of calling OpenAI when they balance against the invoice totals.
+# Otherwise documents whose table layout was learned from an earlier LLM
+# response are converted locally (see layouts.py).
+# With `near_duplicates` set and NEAR_DUP on, a re-export of an earlier
+# document with the same text and numbers reuses that document's results.
+# A rescan without a text layer that looks like an earlier document has its
+# prebuilt stage run first, and reuses the custom and LLM results when the
+# numbers the model read match (see near_duplicates.py).
+def process_document(document, file_name: str, openai_config, cached=None, emit=None, cancelled=None,
+                     extractor=CustomDocExtractor, prompt_template: str = EXTRACTION_PROMPT, only_cached=False,
+                     reconcile_gate: bool = RECONCILE_GATE, cascade: bool = CASCADE, near_duplicates: bool = True):
+    # Every stage reads the same bytes; the hash and page count are computed once
+    document = as_document(document)
+    cached = dict(cached or {})
+    emit = emit or (lambda kind, payload=None: None)
+    cancelled = cancelled or threading.Event()
+    results = {}
+
+    def run_stage(stage, compute):
+        # A stage run early to confirm a near-duplicate is not run again
+        if stage in results:
+            return results[stage]
+        if stage in cached:
+            results[stage] = cached[stage]
+            emit("stage", (stage, 0.0, True))
+            return results[stage]
+        if only_cached or cancelled.is_set():
+            raise Cancelled()
+        emit("running", stage)
+        start = time.perf_counter()
+        results[stage] = compute()
+        emit("stage", (stage, time.perf_counter() - start, False))
+        emit("result", (stage, results[stage]))
+        return results[stage]
+
+    def on_row(row):
+        if cancelled.is_set():
+            raise Cancelled()
+        emit("row", row)
+
+    def llm():
+        import pandas as pd
+
+        if reconcile_gate and results["reconciliation"]["balanced"]:
+            for row in balanced_rows:
+                on_row(row)
+            return pd.DataFrame(balanced_rows)
+
+        tables = results["custom"][1]
+        store = get_layout_store()
+        vendor = vendor_name(results["prebuilt"])
+        layout_key, headers = fingerprint(vendor, tables) if store is not None else (None, None)
+        layout = results["layout"] = {"fingerprint": layout_key, "known": False, "learned": False}
+        if layout_key is not None:
+            items = known_layout_items(store, layout_key, tables)
+            if items is not None:
+                layout["known"] = True
+                emit("layout", layout)
+                rows = [item_to_row(item, file_name) for item in items]
+                for row in rows:
+                    on_row(row)
+                return pd.DataFrame(rows)
+
+        rows, extraction = extract_rows(results["custom"][0].content, *openai_config, file_name,
+                                        prompt_template=prompt_template, on_row=on_row)
+        if not rows and not extraction.complete:
+            raise ValueError(f'Error decoding response: {extraction.text}')
+        if not extraction.complete:
+            emit("warning", f"The response for {file_name} was incomplete; showing the {len(rows)} items that could be recovered.")
+        # Only a complete response describes the whole layout
+        elif layout_key is not None:
+            layout["learned"] = refresh_layout(store, layout_key, vendor, headers, tables, rows)
+        emit("layout", layout)
+        return pd.DataFrame(rows)
+
+    # Only the slim projection of each result is passed on and cached
+    models = {
+        "custom": lambda: slim_custom_result(extractor().analyze_document(document)),
+        "prebuilt": lambda: slim_result(analyze_document(get_document_analysis_client(), "prebuilt-invoice", document)),
+    }
+
+    def use_prior(prior):
+        stages = near_duplicate_stages(prior, file_name)
+        if stages:
+            cached.update((stage, value) for stage, value in stages.items() if stage not in cached and stage not in results)
+            results["duplicate_of"] = {key: prior[key] for key in ("document_hash", "file_name", "similarity")}
+            emit("duplicate", results["duplicate_of"])
+
+    index = get_near_duplicate_index() if near_duplicates else None
+    digest = sig = None
+    if index is not None and not all(stage in cached for stage in STAGES):
+        digest = document_hash(document)
+        try:
+            sig = signature(document)
+        except Exception:
+            # An unreadable document is still sent to the models, which report the problem
+            sig = None
+        if sig is not None and not needs_content(sig):
+            prior = index.find(sig)
+            if prior is not None:
+                use_prior(prior)
+        elif sig is not None and index.has_image_candidates(sig):
+            # The prebuilt model always runs; running it first reads the
+            # numbers that confirm or reject the image match
+            prior = index.find(sig, content=run_stage("prebuilt", models["prebuilt"]).content)
+            if prior is not None:
+                use_prior(prior)
+
+    values, results["route"] = run_cascade(lambda stage: run_stage(stage, models[stage]), cached, enabled=cascade)
+    # A skipped model's stand-in is not cached, so a later run can still use the real one
+    results.update(values)
+    emit("route", results["route"])
+    results["reconciliation"], balanced_rows = reconcile(results["custom"], results["prebuilt"], file_name)
+    emit("reconciliation", results["reconciliation"])
+    run_stage("llm", llm)
+
+    # Rows taken from an earlier document are not indexed again under this one
+    if sig is not None and "duplicate_of" not in results:
+        index.add(digest, file_name, sig, rows=results["llm"].to_dict("records"),
+                  content=getattr(results["prebuilt"], "content", None))
+    return results
+
+
+class BatchRunner:
+    # Runs jobs on a pool of background threads. Workers never touch
+    # Streamlit: every job reports through a queue of (kind, job id, payload)
+    # events that the script thread drains with `events()` and renders.
+    # A job ends with exactly one "done", "error" or "cancelled" event.
+    def __init__(self, max_workers: int = BATCH_WORKERS):
+        self.cancelled = threading.Event()
+        self._events = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch")
+        self._futures = {}
+
+    def submit(self, job_id, fn, *args, **kwargs):
+        def emit(kind, payload=None):
+            self._events.put((kind, job_id, payload))
+
+        def run():
+            try:
+                emit("done", fn(*args, emit=emit, cancelled=self.cancelled, **kwargs))
+            except Cancelled:
+                emit("cancelled")
+            except Exception as e:
+                emit("error", e)
+
+        self._futures[job_id] = self._executor.submit(run)
+
+    def events(self, poll: float = 0.1):
+        remaining = len(self._futures)
+        while remaining:
+            try:
+                event = self._events.get(timeout=poll)
+            except queue.Empty:
+                # Lets the caller refresh live timings while nothing finishes
+                yield ("idle", None, None)
+                continue
+            if event[0] in ("done", "error", "cancelled"):
+                remaining -= 1
+            yield event
+        self._executor.shutdown(wait=False)
+
+    @property
+    def finished(self) -> bool:
+        return all(future.done() for future in self._futures.values())
+
+    # Jobs that have not started are dropped; running jobs stop at their next stage or row
+    def cancel(self):
+        self.cancelled.set()
+        for job_id, future in self._futures.items():
+            if future.cancel():
+                self._events.put(("cancelled", job_id, None))
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# SQLite file holding continuation tokens of analyses that are still running
+ANALYSIS_STATE_DB = os.getenv('ANALYSIS_STATE_DB', os.path.join(tempfile.gettempdir(), 'invoice_analysis_state.db'))
+
+# Azure keeps analysis results for 24 hours; older tokens cannot be resumed
+TOKEN_TTL_SECONDS = 24 * 60 * 60
+
+
+class ContinuationTokenStore:
+    # Persists poller continuation tokens per (document hash, model) so an
+    # analysis started by a crashed worker or an interrupted rerun is resumed
+    # instead of being submitted and billed again.
+    def __init__(self, db_path: str = ANALYSIS_STATE_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS continuation_tokens (
+                document_hash TEXT NOT NULL,
+                model_id TEXT NOT NULL,
+                token TEXT NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (document_hash, model_id)
+            )
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def get(self, document_hash: str, model_id: str):
+        row = self._connect().execute(
+            'SELECT token, created FROM continuation_tokens WHERE document_hash = ? AND model_id = ?',
+            (document_hash, model_id)
+        ).fetchone()
+        if row is None:
+            return None
+        token, created = row
+        if time.time() - created > TOKEN_TTL_SECONDS:
+            self.delete(document_hash, model_id)
+            return None
+        return token
+
+    # The first token wins; a hedged duplicate does not replace it
+    def save(self, document_hash: str, model_id: str, token: str):
+        self._connect().execute(
+            'INSERT OR IGNORE INTO continuation_tokens (document_hash, model_id, token, created) VALUES (?, ?, ?, ?)',
+            (document_hash, model_id, token, time.time())
+        )
+
+    def delete(self, document_hash: str, model_id: str):
+        self._connect().execute(
+            'DELETE FROM continuation_tokens WHERE document_hash = ? AND model_id = ?',
+            (document_hash, model_id)
+        )
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_token_store() -> ContinuationTokenStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ContinuationTokenStore()
+        return _store
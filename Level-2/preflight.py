@@ -0,0 +1,128 @@
+import io
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Limits of the Form Recognizer models (S0 tier); lower PREFLIGHT_MAX_MB to
+# 4 on the free tier
+PREFLIGHT_MAX_MB = float(os.getenv('PREFLIGHT_MAX_MB', '500'))
+PREFLIGHT_MAX_PAGES = int(os.getenv('PREFLIGHT_MAX_PAGES', '2000'))
+PREFLIGHT_MIN_SIDE = int(os.getenv('PREFLIGHT_MIN_SIDE', '50'))
+PREFLIGHT_MAX_SIDE = int(os.getenv('PREFLIGHT_MAX_SIDE', '10000'))
+
+# PDF pages larger than 17 x 17 inches are rejected by the service
+MAX_PAGE_INCHES = 17
+
+# Leading bytes of the accepted formats
+SIGNATURES = (
+    (b"%PDF-", "pdf"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"BM", "bmp"),
+)
+
+# Bytes a complete file ends with, searched for in its last 1 KB. JPEGs
+# are left out: phone cameras append depth maps and other data after the
+# end of the image, often well past 1 KB; check_image decodes them instead.
+TRAILERS = {
+    "pdf": b"%%EOF",
+    "png": b"IEND",
+}
+
+
+class Rejected(ValueError):
+    # Raised for a document that failed the pre-flight checks
+    def __init__(self, reasons: list):
+        super().__init__(describe(reasons))
+        self.reasons = reasons
+
+
+def rejection(code: str, message: str) -> dict:
+    return {"code": code, "message": message}
+
+
+def sniff_format(data: bytes):
+    for signature, kind in SIGNATURES:
+        if data[:len(signature)] == signature:
+            return kind
+    return None
+
+
+def check_pdf(data: bytes, path=None) -> list:
+    import fitz  # PyMuPDF
+
+    try:
+        doc = fitz.open(path, filetype="pdf") if path else fitz.open(stream=data, filetype="pdf")
+    except Exception as e:
+        return [rejection("corrupt", f"The PDF cannot be opened: {e}")]
+    with doc:
+        if doc.needs_pass:
+            return [rejection("encrypted", "The PDF is password protected.")]
+        if doc.page_count == 0:
+            return [rejection("no_pages", "The PDF has no pages.")]
+        if doc.page_count > PREFLIGHT_MAX_PAGES:
+            return [rejection("too_many_pages", f"The PDF has {doc.page_count} pages; the limit is {PREFLIGHT_MAX_PAGES}.")]
+        # Only the page sizes are read; nothing is rendered
+        for page in doc:
+            width, height = page.rect.width / 72, page.rect.height / 72
+            if max(width, height) > MAX_PAGE_INCHES:
+                return [rejection("page_too_large", f"Page {page.number + 1} is {width:.0f} x {height:.0f} inches; "
+                                                    f"the limit is {MAX_PAGE_INCHES} x {MAX_PAGE_INCHES}.")]
+    return []
+
+
+def check_image(data: bytes, path=None) -> list:
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        # Only the header is parsed until the pixels are accessed
+        with Image.open(path or io.BytesIO(data)) as image:
+            width, height = image.size
+            if image.format == "JPEG":
+                # verify() does not read JPEG data; decoding at 1/8 scale
+                # is cheap and fails on a file cut off before its last scan
+                image.draft("L", (max(width // 8, 1), max(height // 8, 1)))
+                image.load()
+            else:
+                image.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError) as e:
+        if "truncated" in str(e):
+            return [rejection("truncated", "The image is incomplete; it may have been cut off during upload.")]
+        return [rejection("corrupt", f"The image cannot be read: {e}")]
+    if min(width, height) < PREFLIGHT_MIN_SIDE:
+        return [rejection("image_too_small", f"The image is {width} x {height} pixels; "
+                                             f"both sides must be at least {PREFLIGHT_MIN_SIDE}.")]
+    if max(width, height) > PREFLIGHT_MAX_SIDE:
+        return [rejection("image_too_large", f"The image is {width} x {height} pixels; "
+                                             f"neither side may exceed {PREFLIGHT_MAX_SIDE}.")]
+    return []
+
+
+# Reasons the document would be rejected by the models, each a dict with a
+# "code" and a "message"; an empty list means it can be sent. Only headers,
+# trailers, the PDF page tree and JPEGs at 1/8 scale are read, so this takes
+# milliseconds.
+# `data` may be a memory map of the file at `path`, which the PDF and image
+# checks then open themselves.
+def preflight(data: bytes, path=None) -> list:
+    if not len(data):
+        return [rejection("empty", "The file is empty.")]
+    size_mb = len(data) / (1024 * 1024)
+    if size_mb > PREFLIGHT_MAX_MB:
+        return [rejection("too_large", f"The file is {size_mb:.1f} MB; the limit is {PREFLIGHT_MAX_MB:g} MB.")]
+
+    kind = sniff_format(data)
+    if kind is None:
+        return [rejection("unsupported_format", "The file is not a PDF, JPEG, PNG, TIFF or BMP document.")]
+    trailer = TRAILERS.get(kind)
+    if trailer is not None and trailer not in data[-1024:]:
+        return [rejection("truncated", f"The {kind.upper()} file is incomplete; it may have been cut off during upload.")]
+    return check_pdf(data, path) if kind == "pdf" else check_image(data, path)
+
+
+def describe(reasons: list) -> str:
+    return "; ".join(reason["message"] for reason in reasons)
@@ -0,0 +1,284 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# SQLite file used to coordinate limits between threads and worker processes
+RATE_LIMIT_DB = os.getenv('RATE_LIMIT_DB', os.path.join(tempfile.gettempdir(), 'invoice_rate_limits.db'))
+
+# Requests per second, burst size and maximum concurrency per service
+FR_RATE_LIMIT = float(os.getenv('FR_RATE_LIMIT', '15'))
+FR_MAX_CONCURRENCY = int(os.getenv('FR_MAX_CONCURRENCY', '8'))
+OPENAI_RATE_LIMIT = float(os.getenv('OPENAI_RATE_LIMIT', '5'))
+OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', '4'))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv('RATE_LIMIT_MAX_RETRIES', '5'))
+
+# Back-off used when a 429 does not carry a Retry-After header
+DEFAULT_RETRY_AFTER = 2.0
+# A slot held longer than this is treated as leaked by a crashed process
+LEASE_SECONDS = 600.0
+# Concurrency is halved at most once per window, however many calls fail at once
+DECREASE_WINDOW = 1.0
+POLL_INTERVAL = 0.05
+
+_local = threading.local()
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    if db_path not in connections:
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS limits (
+                name TEXT PRIMARY KEY,
+                rate REAL NOT NULL,
+                burst REAL NOT NULL,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                concurrency REAL NOT NULL,
+                max_concurrency INTEGER NOT NULL,
+                blocked_until REAL NOT NULL DEFAULT 0,
+                last_decrease REAL NOT NULL DEFAULT 0,
+                throttles INTEGER NOT NULL DEFAULT 0,
+                requests INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                expires REAL NOT NULL
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_leases_name ON leases (name)')
+        connections[db_path] = conn
+    return connections[db_path]
+
+
+@contextmanager
+def _transaction(conn: sqlite3.Connection):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+
+
+# Seconds to wait before retrying, or None when the error is not a throttle.
+# Works for azure-core HttpResponseError and openai.RateLimitError alike.
+def throttle_delay(error: Exception):
+    status = getattr(error, 'status_code', None)
+    response = getattr(error, 'response', None)
+    if status is None and response is not None:
+        status = getattr(response, 'status_code', None)
+    if status != 429:
+        return None
+
+    headers = getattr(response, 'headers', None) or {}
+    for header, scale in (('retry-after-ms', 0.001), ('x-ms-retry-after-ms', 0.001), ('retry-after', 1.0)):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return float(value) * scale
+        except ValueError:
+            continue
+    return DEFAULT_RETRY_AFTER
+
+
+class _Slot:
+    def __init__(self):
+        self.retry_after = None
+
+    def throttled(self, retry_after: float):
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    # Token bucket for the request rate plus an AIMD concurrency window,
+    # both stored in SQLite so every thread and process shares one budget.
+    def __init__(self, name: str, rate: float, max_concurrency: int, burst: float = None,
+                 max_retries: int = RATE_LIMIT_MAX_RETRIES, db_path: str = RATE_LIMIT_DB):
+        self.name = name
+        self.rate = rate
+        self.burst = burst or max(rate, 1.0)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.db_path = db_path
+
+        with _transaction(_connect(db_path)) as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO limits (name, rate, burst, tokens, updated, concurrency, max_concurrency) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (name, rate, self.burst, self.burst, time.time(), float(max_concurrency), max_concurrency)
+            )
+            conn.execute('UPDATE limits SET rate = ?, burst = ?, max_concurrency = ? WHERE name = ?',
+                         (rate, self.burst, max_concurrency, name))
+
+    # Take a token and a concurrency slot, waiting as long as needed
+    def _acquire(self) -> str:
+        conn = _connect(self.db_path)
+        while True:
+            with _transaction(conn):
+                now = time.time()
+                conn.execute('DELETE FROM leases WHERE name = ? AND expires < ?', (self.name, now))
+                tokens, updated, concurrency, blocked_until = conn.execute(
+                    'SELECT tokens, updated, concurrency, blocked_until FROM limits WHERE name = ?', (self.name,)
+                ).fetchone()
+                in_flight = conn.execute('SELECT COUNT(*) FROM leases WHERE name = ?', (self.name,)).fetchone()[0]
+                tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+                if now < blocked_until:
+                    wait = blocked_until - now
+                elif in_flight >= max(1, int(concurrency)):
+                    wait = POLL_INTERVAL
+                elif tokens < 1:
+                    wait = (1 - tokens) / self.rate
+                else:
+                    lease = uuid.uuid4().hex
+                    conn.execute('UPDATE limits SET tokens = ?, updated = ?, requests = requests + 1 WHERE name = ?',
+                                 (tokens - 1, now, self.name))
+                    conn.execute('INSERT INTO leases (id, name, expires) VALUES (?, ?, ?)',
+                                 (lease, self.name, now + LEASE_SECONDS))
+                    return lease
+                conn.execute('UPDATE limits SET tokens = ?, updated = ? WHERE name = ?', (tokens, now, self.name))
+            time.sleep(max(wait, POLL_INTERVAL))
+
+    # Return the slot: additive increase on success, multiplicative decrease on a throttle
+    def _release(self, lease: str, retry_after: float = None):
+        conn = _connect(self.db_path)
+        with _transaction(conn):
+            now = time.time()
+            conn.execute('DELETE FROM leases WHERE id = ?', (lease,))
+            concurrency, blocked_until, last_decrease = conn.execute(
+                'SELECT concurrency, blocked_until, last_decrease FROM limits WHERE name = ?', (self.name,)
+            ).fetchone()
+
+            if retry_after is None:
+                concurrency = min(self.max_concurrency, concurrency + 1.0 / max(concurrency, 1.0))
+                conn.execute('UPDATE limits SET concurrency = ? WHERE name = ?', (concurrency, self.name))
+                return
+
+            if now - last_decrease >= DECREASE_WINDOW:
+                concurrency = max(1.0, concurrency / 2)
+                last_decrease = now
+            conn.execute(
+                'UPDATE limits SET concurrency = ?, last_decrease = ?, blocked_until = ?, throttles = throttles + 1, '
+                'tokens = 0, updated = ? WHERE name = ?',
+                (concurrency, last_decrease, max(blocked_until, now + retry_after), now, self.name)
+            )
+
+    @contextmanager
+    def slot(self):
+        lease = self._acquire()
+        slot = _Slot()
+        try:
+            yield slot
+        finally:
+            self._release(lease, slot.retry_after)
+
+    # Run fn under the limiter, retrying throttled calls after their Retry-After
+    def call(self, fn, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            with self.slot() as slot:
+                try:
+                    return fn(*args, **kwargs)
+                except Exception as e:
+                    retry_after = throttle_delay(e)
+                    if retry_after is None or attempt == self.max_retries:
+                        raise
+                    slot.throttled(retry_after)
+
+    # Like call, for a streamed response: yields its chunks and keeps the slot
+    # until the stream is used up or closed, so running generations count
+    def stream(self, fn, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            with self.slot() as slot:
+                try:
+                    response = fn(*args, **kwargs)
+                except Exception as e:
+                    retry_after = throttle_delay(e)
+                    if retry_after is None or attempt == self.max_retries:
+                        raise
+                    slot.throttled(retry_after)
+                    continue
+                try:
+                    yield from response
+                finally:
+                    close = getattr(response, 'close', None)
+                    if close is not None:
+                        close()
+                return
+
+    def stats(self) -> dict:
+        return limiter_stats(self.db_path).get(self.name, {})
+
+
+# Current limits and throttle counts of every limiter sharing the database
+def limiter_stats(db_path: str = RATE_LIMIT_DB) -> dict:
+    conn = _connect(db_path)
+    now = time.time()
+    stats = {}
+    rows = conn.execute(
+        'SELECT name, rate, burst, tokens, updated, concurrency, max_concurrency, blocked_until, throttles, requests FROM limits'
+    ).fetchall()
+    for name, rate, burst, tokens, updated, concurrency, max_concurrency, blocked_until, throttles, requests in rows:
+        in_flight = conn.execute('SELECT COUNT(*) FROM leases WHERE name = ? AND expires >= ?', (name, now)).fetchone()[0]
+        stats[name] = {
+            "rate": rate,
+            "tokens": min(burst, tokens + (now - updated) * rate),
+            "concurrency": int(concurrency),
+            "max_concurrency": max_concurrency,
+            "in_flight": in_flight,
+            "blocked_for": max(0.0, blocked_until - now),
+            "throttles": throttles,
+            "requests": requests,
+        }
+    return stats
+
+
+# Retry policy for Azure clients: a throttled analysis request is returned
+# to the limiter instead of being retried inside azure-core, so the window
+# shrinks on the first 429 rather than after the SDK's retry storm. Other
+# failures, and throttled polls, are still retried by the SDK.
+def azure_retry_policy():
+    from azure.core.pipeline.policies import RetryPolicy
+
+    class LimiterRetryPolicy(RetryPolicy):
+        def is_retry(self, settings, response):
+            if response.http_response.status_code == 429 and response.http_request.method == 'POST':
+                return False
+            return super().is_retry(settings, response)
+
+    return LimiterRetryPolicy()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str, rate: float, max_concurrency: int) -> RateLimiter:
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(name, rate, max_concurrency)
+        return _limiters[name]
+
+
+def form_recognizer_limiter(endpoint: str) -> RateLimiter:
+    return get_limiter(f"form-recognizer:{endpoint}", FR_RATE_LIMIT, FR_MAX_CONCURRENCY)
+
+
+def openai_limiter(endpoint: str, deployment: str) -> RateLimiter:
+    return get_limiter(f"openai:{endpoint}:{deployment}", OPENAI_RATE_LIMIT, OPENAI_MAX_CONCURRENCY)
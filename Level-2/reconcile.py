@@ -0,0 +1,116 @@
+import os
+
+from dotenv import load_dotenv
+
+from llm import item_to_row
+from transform.hierarchy import parse_tables
+
+load_dotenv()
+
+# The LLM stage is skipped for documents whose deterministic line items
+# already add up; set to 0 to always run it
+RECONCILE_GATE = os.getenv('RECONCILE_GATE', '1') not in ('0', 'false', 'False', '')
+
+# Items balance when their sum is within the larger of these of the invoice
+# figure: an absolute amount for rounding, a fraction for large totals
+RECONCILE_TOLERANCE = float(os.getenv('RECONCILE_TOLERANCE', '0.05'))
+RECONCILE_RELATIVE_TOLERANCE = float(os.getenv('RECONCILE_RELATIVE_TOLERANCE', '0.001'))
+
+
+def field_amount(field):
+    if field is None or field.value is None:
+        return None
+    value = getattr(field.value, "amount", field.value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# SubTotal, InvoiceTotal and the total less tax, in the order they are tried
+def invoice_targets(prebuilt_result) -> dict:
+    for doc in prebuilt_result.documents or []:
+        subtotal = field_amount(doc.fields.get("SubTotal"))
+        total = field_amount(doc.fields.get("InvoiceTotal"))
+        tax = field_amount(doc.fields.get("TotalTax"))
+        targets = {"SubTotal": subtotal, "InvoiceTotal": total}
+        if total is not None and tax is not None:
+            targets["InvoiceTotal-TotalTax"] = total - tax
+        return {name: value for name, value in targets.items() if value}
+    return {}
+
+
+# Description and amount of every prebuilt item, amounts as one float array
+def prebuilt_items(prebuilt_result):
+    import numpy as np
+
+    names, amounts = [], []
+    for doc in prebuilt_result.documents or []:
+        items = doc.fields.get("Items")
+        for item in (items.value or []) if items is not None else []:
+            fields = item.value or {}
+            description = fields.get("Description")
+            names.append(description.value if description is not None and description.value else "")
+            amount = field_amount(fields.get("Amount"))
+            amounts.append(np.nan if amount is None else amount)
+    return names, np.asarray(amounts, dtype=float)
+
+
+def within_tolerance(items_total: float, expected: float) -> bool:
+    return abs(items_total - expected) <= max(RECONCILE_TOLERANCE, RECONCILE_RELATIVE_TOLERANCE * abs(expected))
+
+
+# Compares the item sums of the prebuilt Items and of the custom tables with
+# the invoice totals. Returns the decision, a JSON friendly dict recorded per
+# file, and the rows in the LLM output columns built from the balancing
+# source (empty when nothing balances).
+def reconcile(custom, prebuilt_result, file_name: str):
+    import numpy as np
+
+    targets = invoice_targets(prebuilt_result)
+    names, amounts = prebuilt_items(prebuilt_result)
+    table_items, table_check = parse_tables(custom[1] if custom is not None else None)
+
+    # The table items come first: like the LLM rows they carry subcategories.
+    # Table items whose own subtotals do not add up are not trusted.
+    sources = {}
+    if table_items and table_check["consistent"]:
+        sources["custom"] = (
+            float(np.sum([item["item_amount"] for item in table_items])),
+            [item_to_row(item, file_name) for item in table_items],
+        )
+    if amounts.size and not np.isnan(amounts).any():
+        sources["prebuilt"] = (
+            float(amounts.sum()),
+            [item_to_row({"item_description": name, "item_amount": float(amount), "item_subcategory": "None",
+                          "item_subcategory_total": "None"}, file_name) for name, amount in zip(names, amounts)],
+        )
+
+    decision = {"balanced": False, "source": None, "target": None, "expected": None, "items_total": None,
+                "difference": None, "item_counts": {source: len(rows) for source, (_, rows) in sources.items()},
+                "table_check": table_check}
+    closest = None
+    for source, (items_total, rows) in sources.items():
+        for target, expected in targets.items():
+            difference = round(items_total - expected, 2)
+            if closest is None or abs(difference) < abs(closest[3]):
+                closest = (source, target, expected, difference, items_total)
+            if within_tolerance(items_total, expected):
+                decision.update(balanced=True, source=source, target=target, expected=expected,
+                                items_total=round(items_total, 2), difference=difference)
+                return decision, rows
+
+    # Not balanced: the closest comparison explains why the LLM ran
+    if closest is not None:
+        source, target, expected, difference, items_total = closest
+        decision.update(source=source, target=target, expected=expected, items_total=round(items_total, 2),
+                        difference=difference)
+    return decision, []
+
+
+def describe(decision: dict) -> str:
+    if decision["balanced"]:
+        return f"balanced ({decision['source']} items = {decision['target']})"
+    if decision["source"] is None:
+        return "no totals to check"
+    return f"off by {decision['difference']:.2f} ({decision['source']} vs {decision['target']})"
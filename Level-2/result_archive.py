@@ -0,0 +1,101 @@
+import datetime
+import gzip
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Directory of the compressed raw analysis results; an empty value disables archiving
+RESULT_ARCHIVE_DIR = os.getenv('RESULT_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'result_archive'))
+
+# gzip level: results are written once and read rarely, so favour size
+COMPRESS_LEVEL = int(os.getenv('RESULT_ARCHIVE_COMPRESS_LEVEL', '6'))
+
+
+# AnalyzeResult.to_dict() keeps dates and times as Python objects; they are
+# tagged so from_dict() gets the same types back
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, datetime.time):
+        return {"__time__": value.isoformat()}
+    raise TypeError(f"Cannot archive value of type {type(value).__name__}")
+
+
+def _decode(obj):
+    if len(obj) == 1:
+        if "__datetime__" in obj:
+            return datetime.datetime.fromisoformat(obj["__datetime__"])
+        if "__date__" in obj:
+            return datetime.date.fromisoformat(obj["__date__"])
+        if "__time__" in obj:
+            return datetime.time.fromisoformat(obj["__time__"])
+    return obj
+
+
+class ResultArchive:
+    # Raw AnalyzeResult of every analyzed document, gzipped JSON stored at
+    # <root>/<model id>/<hash[:2]>/<document hash>.json.gz, so transforms and
+    # prompts can be re-run over old documents without paying for OCR again
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, document_hash: str, model_id: str) -> str:
+        model_dir = re.sub(r"[^A-Za-z0-9_.-]", "_", model_id)
+        return os.path.join(self.root, model_dir, document_hash[:2], f"{document_hash}.json.gz")
+
+    def exists(self, document_hash: str, model_id: str) -> bool:
+        return os.path.exists(self.path(document_hash, model_id))
+
+    # Written to a temporary name and renamed, so readers never see a partial file
+    def save(self, document_hash: str, model_id: str, result):
+        path = self.path(document_hash, model_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = {
+            "document_hash": document_hash,
+            "model_id": model_id,
+            "archived_at": time.time(),
+            "result": result.to_dict(),
+        }
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=COMPRESS_LEVEL) as f:
+                json.dump(payload, f, default=_encode, separators=(",", ":"))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path
+
+    # The archived AnalyzeResult, or None when the document was never archived
+    def load(self, document_hash: str, model_id: str):
+        from azure.ai.formrecognizer import AnalyzeResult
+
+        try:
+            with gzip.open(self.path(document_hash, model_id), "rt", encoding="utf-8") as f:
+                payload = json.load(f, object_hook=_decode)
+        except FileNotFoundError:
+            return None
+        return AnalyzeResult.from_dict(payload["result"])
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_result_archive():
+    global _archive
+    if not RESULT_ARCHIVE_DIR:
+        return None
+    with _archive_lock:
+        if _archive is None:
+            _archive = ResultArchive(RESULT_ARCHIVE_DIR)
+        return _archive
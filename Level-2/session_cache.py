@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import streamlit as st
+
+from slim_result import approx_size
+
+# Key in st.session_state holding the per-session extraction results
+CACHE_KEY = "extraction_cache"
+
+# Memory bounds of the cached results, per session and for all sessions of the process
+SESSION_CACHE_MAX_MB = float(os.getenv('SESSION_CACHE_MAX_MB', '64'))
+PROCESS_CACHE_MAX_MB = float(os.getenv('PROCESS_CACHE_MAX_MB', '1024'))
+
+
+class SizedLRU:
+    # Least recently used entries are evicted once the approximate size of
+    # the cached values exceeds `max_bytes`
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()  # key -> (value, size, last used)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self._entries[key] = (entry[0], entry[1], time.monotonic())
+            return entry[0]
+
+    def put(self, key, value):
+        size = approx_size(value)
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            # A value larger than the whole budget is not cached at all
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size, time.monotonic())
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._pop_oldest_locked()
+
+    def _pop_oldest_locked(self) -> int:
+        _, (_, size, _) = self._entries.popitem(last=False)
+        self.bytes -= size
+        return size
+
+    def pop_oldest(self) -> int:
+        with self._lock:
+            return self._pop_oldest_locked() if self._entries else 0
+
+    def oldest_use(self):
+        with self._lock:
+            if not self._entries:
+                return None
+            return next(iter(self._entries.values()))[2]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Caches of all live sessions; a session's cache goes away with its session state
+_sessions = weakref.WeakSet()
+_sessions_lock = threading.Lock()
+
+
+def _enforce_process_limit():
+    limit = PROCESS_CACHE_MAX_MB * 1024 * 1024
+    with _sessions_lock:
+        caches = list(_sessions)
+        total = sum(cache.bytes for cache in caches)
+        while total > limit:
+            # Evict the least recently used entry across all sessions
+            used = [(cache.oldest_use(), cache) for cache in caches]
+            used = [(last_used, cache) for last_used, cache in used if last_used is not None]
+            if not used:
+                break
+            total -= min(used, key=lambda pair: pair[0])[1].pop_oldest()
+
+
+# Extraction results memoized per session and uploaded file content, so
+# widget interactions and reruns do not repeat Azure and OpenAI calls.
+def _cache() -> SizedLRU:
+    if CACHE_KEY not in st.session_state:
+        cache = SizedLRU(int(SESSION_CACHE_MAX_MB * 1024 * 1024))
+        with _sessions_lock:
+            _sessions.add(cache)
+        st.session_state[CACHE_KEY] = cache
+    return st.session_state[CACHE_KEY]
+
+
+def get(stage: str, key: str):
+    return _cache().get((stage, key))
+
+
+def put(stage: str, key: str, value):
+    # Failed stages are not cached so the next rerun retries them
+    if value is not None:
+        _cache().put((stage, key), value)
+        _enforce_process_limit()
+    return value
+
+
+def memoize(stage: str, key: str, compute):
+    value = get(stage, key)
+    if value is None:
+        value = put(stage, key, compute())
+    return value
+
+
+# Memory accounting of the cached results, for this session and the process
+def stats() -> dict:
+    cache = _cache()
+    with _sessions_lock:
+        process_bytes = sum(c.bytes for c in _sessions)
+        sessions = len(_sessions)
+    return {
+        "entries": len(cache),
+        "session_bytes": cache.bytes,
+        "process_bytes": process_bytes,
+        "sessions": sessions,
+    }
@@ -0,0 +1,116 @@
+import sys
+
+# Compact projections of AnalyzeResult holding only what the apps and the
+# later stages read: content, document fields (including the Items list) and
+# table cells. Words, lines, spans, polygons and styles are dropped, which is
+# most of the memory of a full result. Attribute names match the SDK types,
+# so code reading `result.content`, `doc.fields["InvoiceTotal"].value.amount`
+# or `table.cells` works on either.
+
+
+class SlimField:
+    __slots__ = ("value_type", "value", "content", "confidence")
+
+    def __init__(self, value_type, value, content, confidence):
+        self.value_type = value_type
+        self.value = value
+        self.content = content
+        self.confidence = confidence
+
+
+class SlimDocument:
+    __slots__ = ("doc_type", "fields", "confidence")
+
+    def __init__(self, doc_type, fields, confidence):
+        self.doc_type = doc_type
+        self.fields = fields
+        self.confidence = confidence
+
+
+class SlimCell:
+    __slots__ = ("row_index", "column_index", "content")
+
+    def __init__(self, row_index, column_index, content):
+        self.row_index = row_index
+        self.column_index = column_index
+        self.content = content
+
+
+class SlimTable:
+    __slots__ = ("row_count", "column_count", "cells")
+
+    def __init__(self, row_count, column_count, cells):
+        self.row_count = row_count
+        self.column_count = column_count
+        self.cells = cells
+
+
+class SlimResult:
+    __slots__ = ("model_id", "content", "documents", "tables", "page_count")
+
+    def __init__(self, model_id, content, documents, tables, page_count):
+        self.model_id = model_id
+        self.content = content
+        self.documents = documents
+        self.tables = tables
+        self.page_count = page_count
+
+
+def slim_field(field):
+    if field is None:
+        return None
+    value = field.value
+    # Nested fields (the Items list and each item's dictionary) are projected too
+    if field.value_type == "list":
+        value = [slim_field(item) for item in value or []]
+    elif field.value_type == "dictionary":
+        value = {name: slim_field(item) for name, item in (value or {}).items()}
+    return SlimField(field.value_type, value, field.content, field.confidence)
+
+
+# Built once per analysis, before the result is cached or kept in session state
+def slim_result(result) -> SlimResult:
+    if result is None or isinstance(result, SlimResult):
+        return result
+    documents = [
+        SlimDocument(doc.doc_type, {name: slim_field(field) for name, field in (doc.fields or {}).items()}, doc.confidence)
+        for doc in result.documents or []
+    ]
+    tables = [
+        SlimTable(table.row_count, table.column_count,
+                  [SlimCell(cell.row_index, cell.column_index, cell.content) for cell in table.cells])
+        for table in result.tables or []
+    ]
+    return SlimResult(result.model_id, result.content, documents, tables, len(result.pages or []))
+
+
+# The [result, list_of_table_df] pair returned by CustomDocExtractor.analyze_document
+def slim_custom_result(custom):
+    result, list_of_table_df = custom
+    return [slim_result(result), list_of_table_df]
+
+
+# Approximate memory held by a value: containers, slotted objects and
+# DataFrames are followed, shared objects are counted once
+def approx_size(value, seen=None) -> int:
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    if hasattr(value, "memory_usage") and hasattr(value, "columns"):
+        return int(value.memory_usage(deep=True).sum())
+    size = sys.getsizeof(value)
+    if isinstance(value, (str, bytes, int, float, bool)) or value is None:
+        return size
+    if isinstance(value, dict):
+        return size + sum(approx_size(k, seen) + approx_size(v, seen) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return size + sum(approx_size(item, seen) for item in value)
+    slots = getattr(type(value), "__slots__", None)
+    if slots:
+        return size + sum(approx_size(getattr(value, name, None), seen) for name in slots)
+    if hasattr(value, "__dict__"):
+        return size + approx_size(vars(value), seen)
+    return size
@@ -0,0 +1,44 @@
+import re
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Currency marks written around amounts: "Rs.500", "Rs. 1,200.00", "INR 90",
+# "₹45", "$12", "500/-". They go before anything else is stripped, or the
+# dot of "Rs." would become a decimal point.
+CURRENCY = r"(?i)\b(?:rs|inr|usd|eur|gbp|aed)\b\.?|[₹$€£]|/-\s*$"
+
+# Left once the currency is gone: digits, the decimal point and the sign
+NON_NUMERIC = r"[^\d.\-]"
+
+# "(12.50)" is a credit
+CREDIT = r"^\(.*\)$"
+
+
+# Amounts of a column of cells as floats, NaN where a cell holds no amount
+def parse_amounts(column: "pd.Series") -> "pd.Series":
+    import pandas as pd
+
+    text = column.astype(str).str.strip()
+    negative = text.str.match(CREDIT)
+    cleaned = text.str.replace(CURRENCY, "", regex=True).str.replace(NON_NUMERIC, "", regex=True)
+    numbers = pd.to_numeric(cleaned, errors="coerce")
+    return numbers.where(~negative, -numbers)
+
+
+# One amount: a number, a numeric string or an Azure CurrencyValue; None
+# when it holds no amount
+def parse_amount(value):
+    if value is None or isinstance(value, bool):
+        return None
+    value = getattr(value, "amount", value)
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    cleaned = re.sub(NON_NUMERIC, "", re.sub(CURRENCY, "", text))
+    try:
+        number = float(cleaned)
+    except ValueError:
+        return None
+    return -number if re.match(CREDIT, text) else number
@@ -0,0 +1,130 @@
+import functools
+import json
+import os
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# JSON file of extra synonyms, {"field": ["header", ...]}, for new fields or
+# more headers of the canonical ones
+HEADER_SYNONYMS_FILE = os.getenv('HEADER_SYNONYMS_FILE', '')
+
+# Headers scoring below this match no field
+HEADER_MIN_SCORE = float(os.getenv('HEADER_MIN_SCORE', '0.5'))
+
+# Canonical line item fields and the table headers known to mean them
+CANONICAL_HEADERS = {
+    "description": [
+        "description", "item description", "item desc", "desc", "particulars", "particular", "item", "items",
+        "item name", "item details", "details", "service", "services", "service description", "product",
+        "product name", "name of item", "test name", "investigation", "procedure", "medicine", "drug name",
+        "narration",
+    ],
+    "amount": [
+        "amount", "amt", "total", "total amount", "total amt", "net amount", "net amt", "net", "line total",
+        "value", "charges", "gross amount", "bill amount", "net payable", "payable",
+    ],
+    "quantity": ["quantity", "qty", "units", "no of units", "nos", "count", "days"],
+    "unit_price": ["rate", "unit price", "price", "mrp", "unit rate", "rate per unit", "price per unit", "unit cost"],
+    "tax": [
+        "tax", "tax amount", "tax amt", "total tax", "total tax amount", "tax total", "gst", "gst amount", "gst amt", "cgst", "sgst", "igst",
+        "vat", "tax rate",
+    ],
+    "discount": ["discount", "disc", "discount amount", "discount amt", "concession"],
+    "date": ["date", "service date", "bill date", "date of service"],
+    "code": ["code", "item code", "product code", "hsn", "hsn code", "sac", "sac code", "batch", "batch no"],
+    "unit": ["unit", "uom", "pack"],
+    "serial": ["s no", "sr no", "sl no", "serial no", "sno"],
+}
+
+# Currency and filler words carry no meaning in a header: "Total (Rs.)" is "total"
+NOISE_WORDS = {"rs", "inr", "usd", "eur", "gbp", "aed", "in", "of", "the"}
+
+
+def normalize_header(header) -> str:
+    words = re.sub(r"[^a-z0-9]+", " ", str(header).lower()).split()
+    return " ".join(word for word in words if word not in NOISE_WORDS)
+
+
+def trigrams(text: str) -> set:
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class HeaderIndex:
+    # Character trigram index over the synonyms of every canonical field.
+    # A header is scored against the synonyms sharing at least one trigram
+    # (Dice coefficient of the trigram sets) and gets the field of the best
+    # one; exact synonyms are answered from a dict.
+    def __init__(self, synonyms: Dict[str, Iterable[str]], min_score: float = HEADER_MIN_SCORE):
+        self.min_score = min_score
+        self._exact = {}
+        self._fields = []
+        self._sizes = []
+        self._postings = defaultdict(list)
+        for field, headers in synonyms.items():
+            for header in headers:
+                text = normalize_header(header)
+                if not text or text in self._exact:
+                    continue
+                self._exact[text] = field
+                grams = trigrams(text)
+                entry = len(self._fields)
+                self._fields.append(field)
+                self._sizes.append(len(grams))
+                for gram in grams:
+                    self._postings[gram].append(entry)
+        self.match = functools.lru_cache(maxsize=4096)(self._match)
+
+    def __len__(self):
+        return len(self._fields)
+
+    # (field, score) of one header; the field is None below min_score
+    def _match(self, header) -> Tuple[Optional[str], float]:
+        text = normalize_header(header)
+        if not text:
+            return None, 0.0
+        field = self._exact.get(text)
+        if field is not None:
+            return field, 1.0
+
+        grams = trigrams(text)
+        overlap = defaultdict(int)
+        for gram in grams:
+            for entry in self._postings.get(gram, ()):
+                overlap[entry] += 1
+        best, score = None, 0.0
+        for entry, shared in overlap.items():
+            candidate = 2.0 * shared / (len(grams) + self._sizes[entry])
+            if candidate > score:
+                best, score = entry, candidate
+        if best is None or score < self.min_score:
+            return None, score
+        return self._fields[best], score
+
+    def map_columns(self, headers) -> List[Tuple[Optional[str], float]]:
+        return [self.match(str(header)) for header in headers]
+
+
+# Canonical synonyms extended with those of `path` (HEADER_SYNONYMS_FILE by
+# default). A configured header overrides the built-in one: it is taken out
+# of every field before the configured ones are added, last.
+def load_synonyms(path: Optional[str] = None) -> Dict[str, List[str]]:
+    path = HEADER_SYNONYMS_FILE if path is None else path
+    configured = {}
+    if path:
+        with open(path, encoding="utf-8") as f:
+            configured = {field: list(headers) for field, headers in json.load(f).items()}
+    overridden = {normalize_header(header) for headers in configured.values() for header in headers}
+    synonyms = {
+        field: [header for header in headers if normalize_header(header) not in overridden]
+        for field, headers in CANONICAL_HEADERS.items()
+    }
+    for field, headers in configured.items():
+        synonyms.setdefault(field, []).extend(headers)
+    return synonyms
+
+
+@functools.lru_cache(maxsize=None)
+def get_header_index() -> HeaderIndex:
+    return HeaderIndex(load_synonyms())
@@ -0,0 +1,131 @@
+import re
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from transform.amounts import parse_amounts
+from transform.headers import get_header_index
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Rows closing a group of items: "Total", "Sub Total", "Sub-total", "Grand Total"
+TOTAL_ROW = re.compile(r"\b(sub[\s-]*)?total\b", re.IGNORECASE)
+
+# A subtotal matches the running sum of its items within this amount
+SUBTOTAL_TOLERANCE = 0.01
+
+
+# The amount column is the last numeric one whose header maps to "amount",
+# else the last mostly numeric column; the description is the first other
+# column whose header maps to "description", else the first other column.
+# Returns (description column, amount column, parsed columns), columns by position.
+def table_columns(df: "pd.DataFrame") -> Tuple[Optional[int], Optional[int], List["pd.Series"]]:
+    parsed = [parse_amounts(df.iloc[:, i]) for i in range(df.shape[1])]
+    fields = [field for field, _ in get_header_index().map_columns(df.columns)]
+    numeric = [i for i, values in enumerate(parsed) if values.notna().mean() >= 0.5]
+    by_header = [i for i in numeric if fields[i] == "amount"]
+    if not (by_header or numeric):
+        return None, None, parsed
+    others = [i for i in range(df.shape[1]) if i not in numeric]
+    described = [i for i in others if fields[i] == "description"]
+    return (described or others or [None])[0], (by_header or numeric)[-1], parsed
+
+
+# Items of one table in the LLM item format (item_description, item_amount,
+# item_subcategory, item_subcategory_total), in table order, using the rules
+# the extraction prompt gives the LLM:
+# - a row with a description and no amount is a category header
+# - a total row closes the items since the last header or total; its amount
+#   is their subcategory total, unless it covers the whole uncategorized
+#   table or adds up the earlier groups, which makes it the table total
+# Every total is checked against the running sum of the items it closes;
+# the second value lists the totals that do not match.
+# `columns` gives known (description, amount) column positions instead of
+# detecting them.
+def parse_table(title: Optional[str], df: "pd.DataFrame",
+                columns: Optional[Tuple[Optional[int], int]] = None) -> Tuple[List[Dict], Dict]:
+    check = {"subtotals": 0, "totals": 0, "mismatches": []}
+    if df is None or df.empty:
+        return [], check
+    description_column, amount_column, parsed = table_columns(df)
+    if columns is not None:
+        description_column, amount_column = columns
+    if amount_column is None or amount_column >= df.shape[1]:
+        return [], check
+
+    if description_column is None:
+        descriptions = [""] * len(df)
+    else:
+        descriptions = [str(value).strip() for value in df.iloc[:, description_column].tolist()]
+    amounts = parsed[amount_column].tolist()
+    has_number = [any(values) for values in zip(*(column.notna().tolist() for column in parsed))]
+    is_total = [bool(TOTAL_ROW.search(text)) for text in descriptions]
+    is_item = [amount == amount and not total for amount, total in zip(amounts, is_total)]
+    # Items from each row to the end of the table
+    items_after = [0] * (len(df) + 1)
+    for i in range(len(df) - 1, -1, -1):
+        items_after[i] = items_after[i + 1] + is_item[i]
+
+    items = []
+    category = None
+    group = []          # indexes in `items` of the open group
+    group_sum = 0.0
+    table_sum = 0.0
+    closed_groups = 0
+
+    def verify(kind, label, expected, running_sum):
+        check[kind] += 1
+        if abs(expected - running_sum) > SUBTOTAL_TOLERANCE:
+            check["mismatches"].append({"table": title, "row": label, "expected": expected,
+                                        "running_sum": round(running_sum, 2)})
+
+    for i, (text, amount) in enumerate(zip(descriptions, amounts)):
+        if is_total[i] and amount == amount:
+            grand_total = closed_groups and abs(amount - table_sum) <= SUBTOTAL_TOLERANCE < abs(amount - group_sum)
+            if group and not grand_total and (category is not None or closed_groups or items_after[i + 1]):
+                # A total in the middle of the table, or under a category header
+                for index in group:
+                    items[index]["item_subcategory_total"] = amount
+                verify("subtotals", text, amount, group_sum)
+                closed_groups += 1
+            else:
+                verify("totals", text, amount, table_sum)
+            group, group_sum = [], 0.0
+            continue
+        if text and not has_number[i] and not is_total[i]:
+            category = text
+            group, group_sum = [], 0.0
+            continue
+        if is_item[i]:
+            group.append(len(items))
+            group_sum += amount
+            table_sum += amount
+            items.append({
+                "item_description": text,
+                "item_amount": amount,
+                "item_subcategory": category or title or "None",
+                "item_subcategory_total": "None",
+            })
+    return items, check
+
+
+# Items of every (title, DataFrame) pair from tables_to_dataframe and the
+# combined self-check; `consistent` is False when any total does not match.
+# `columns` holds known column positions per table, None for a table to skip.
+def parse_tables(list_of_table_df, columns: Optional[List] = None) -> Tuple[List[Dict], Dict]:
+    items = []
+    check = {"tables": 0, "subtotals": 0, "totals": 0, "mismatches": []}
+    tables = list(list_of_table_df or [])
+    for i, (title, df) in enumerate(tables):
+        if columns is None:
+            table_items, table_check = parse_table(title, df)
+        elif i < len(columns) and columns[i] is not None:
+            table_items, table_check = parse_table(title, df, columns=tuple(columns[i]))
+        else:
+            continue
+        items.extend(table_items)
+        check["tables"] += 1
+        check["subtotals"] += table_check["subtotals"]
+        check["totals"] += table_check["totals"]
+        check["mismatches"].extend(table_check["mismatches"])
+    check["consistent"] = not check["mismatches"]
+    return items, check
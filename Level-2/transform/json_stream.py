@@ -0,0 +1,116 @@
+import json
+from typing import Dict, List, Optional, Tuple, Union
+
+
+class ItemStreamParser:
+    # Incrementally scans a JSON document as it arrives and returns every
+    # object in the top-level `key` array as soon as its closing brace is seen.
+    # With key=None the first array at the top level (or directly under the
+    # top-level object) is used, whatever its key is.
+    def __init__(self, key: Optional[str] = "items"):
+        self.key = key
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._array_depth: Optional[int] = None
+        self._array_closed = False
+        self._item_start: Optional[int] = None
+
+    @property
+    def array_closed(self) -> bool:
+        return self._array_closed
+
+    def _is_items_array(self) -> bool:
+        if self.key is None:
+            return self._depth <= 2
+        return self._depth == 2 and self._last_string == self.key
+
+    def feed(self, chunk: str) -> List[Dict]:
+        self.text += chunk
+        text = self.text
+        completed = []
+
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start + 1:i]
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch == "[" or ch == "{":
+                self._depth += 1
+                if (
+                    ch == "["
+                    and self._array_depth is None
+                    and not self._array_closed
+                    and self._is_items_array()
+                ):
+                    self._array_depth = self._depth
+                elif (
+                    ch == "{"
+                    and self._array_depth is not None
+                    and self._depth == self._array_depth + 1
+                ):
+                    self._item_start = i
+            elif ch == "]" or ch == "}":
+                if (
+                    ch == "}"
+                    and self._item_start is not None
+                    and self._depth == self._array_depth + 1
+                ):
+                    try:
+                        completed.append(json.loads(text[self._item_start:i + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    self._item_start = None
+                elif ch == "]" and self._depth == self._array_depth:
+                    self._array_depth = None
+                    self._array_closed = True
+                self._depth -= 1
+
+        self._pos = len(text)
+        return completed
+
+
+def strip_code_fence(text: str) -> str:
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    return text
+
+
+# Pick the items list out of a parsed response without assuming its key
+def find_items(payload: Union[Dict, List], key: str = "items") -> List[Dict]:
+    if isinstance(payload, list):
+        return payload
+    if not isinstance(payload, dict):
+        return []
+    if isinstance(payload.get(key), list):
+        return payload[key]
+    for value in payload.values():
+        if isinstance(value, list):
+            return value
+    return []
+
+
+# Recover every complete item object from truncated or malformed output.
+# The flag is True only when the items array was closed, i.e. nothing is missing.
+def salvage_items(text: str, key: Optional[str] = None) -> Tuple[List[Dict], bool]:
+    parser = ItemStreamParser(key)
+    items = parser.feed(strip_code_fence(text))
+    return items, parser.array_closed
@@ -1,11 +1,15 @@
-import pandas as pd
-from azure.ai.formrecognizer import DocumentTable, DocumentTableCell
-from typing import List
-Row = List[DocumentTableCell]
+from typing import TYPE_CHECKING, List
+
+# pandas and the Azure SDK are only needed once tables are converted
+if TYPE_CHECKING:
+    import pandas as pd
+    from azure.ai.formrecognizer import DocumentTable, DocumentTableCell
+
+Row = List["DocumentTableCell"]
 RawTable = List[Row]
 
 
-def group_table_by_rows(table: DocumentTable) -> RawTable:
+def group_table_by_rows(table: "DocumentTable") -> RawTable:
     cells = sorted(table.cells, key=lambda cell: (cell.row_index, cell.column_index))
     curr_row_idx = cells[0].row_index
 
@@ -37,7 +41,9 @@ def has_table_title(raw_table) -> bool:
     else:
         return False
 
-def tables_to_dataframe(tables: List) -> List[pd.DataFrame]:
+def tables_to_dataframe(tables: List) -> List["pd.DataFrame"]:
+    import pandas as pd
+
     if not tables:
         return pd.DataFrame()
 
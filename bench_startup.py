@@ -0,0 +1,142 @@
+"""Startup benchmark: import time per app module, each measured in a fresh interpreter.
+
+    python bench_startup.py                        # print a table
+    python bench_startup.py --json out.json        # save results
+    python bench_startup.py --baseline out.json    # fail on cold-start regressions
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# (working directory, module) pairs, imported the way each app is started
+MODULES = [
+    ("Level-1", "invoice"),
+    ("Level-1", "line-item-final"),
+    ("Level-1/PS1_API", "app"),
+    ("Level-2", "backend"),
+    ("Level-2", "llm"),
+    ("Level-2", "Enhance_invoice"),
+    ("Level-2", "dash"),
+    ("Level-2", "lvl2"),
+    ("Level-2", "main"),
+]
+
+
+# Parse `-X importtime` output into (indent, self_us, cumulative_us, name) tuples
+def parse_importtime(stderr: str):
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        indent = len(name) - len(name.lstrip(" "))
+        entries.append((indent, int(self_us), int(cumulative_us), name.strip()))
+    return entries
+
+
+def measure(directory: str, module: str):
+    # __import__ goes through the C import path that -X importtime instruments
+    code = f"__import__({module!r})"
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=os.path.join(ROOT, directory), capture_output=True, text=True
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit code {proc.returncode}"
+        return {"error": error}
+
+    entries = parse_importtime(proc.stderr)
+    target = next((i for i, entry in enumerate(entries) if entry[3] == module and entry[0] == 1), None)
+    if target is None:
+        return {"error": "module not found in importtime output"}
+
+    # Direct imports of the module are listed just before it, one level deeper
+    children = []
+    for indent, _, cumulative_us, name in reversed(entries[:target]):
+        if indent == 1:
+            break
+        if indent == 3:
+            children.append((cumulative_us, name))
+    children.sort(reverse=True)
+
+    return {
+        "import_ms": entries[target][2] / 1000,
+        "wall_ms": wall * 1000,
+        "heaviest": [{"module": name, "ms": us / 1000} for us, name in children[:3]],
+    }
+
+
+def run(repeat: int):
+    results = {}
+    for directory, module in MODULES:
+        key = f"{directory}/{module}"
+        runs = [measure(directory, module) for _ in range(repeat)]
+        ok = [r for r in runs if "error" not in r]
+        if not ok:
+            results[key] = runs[0]
+            continue
+        best = min(ok, key=lambda r: r["import_ms"])
+        results[key] = {
+            "import_ms": statistics.median(r["import_ms"] for r in ok),
+            "wall_ms": statistics.median(r["wall_ms"] for r in ok),
+            "heaviest": best["heaviest"],
+        }
+    return results
+
+
+def report(results: dict):
+    print(f"{'module':40} {'import ms':>10} {'wall ms':>10}  heaviest imports")
+    for key, result in results.items():
+        if "error" in result:
+            print(f"{key:40} {'-':>10} {'-':>10}  {result['error']}")
+            continue
+        heaviest = ", ".join(f"{h['module']} {h['ms']:.0f}ms" for h in result["heaviest"])
+        print(f"{key:40} {result['import_ms']:10.1f} {result['wall_ms']:10.1f}  {heaviest}")
+
+
+# Modules whose import time grew beyond the threshold ratio
+def regressions(results: dict, baseline: dict, threshold: float):
+    slower = []
+    for key, result in results.items():
+        before = baseline.get(key, {})
+        if "import_ms" not in result or "import_ms" not in before:
+            continue
+        if result["import_ms"] > before["import_ms"] * threshold:
+            slower.append((key, before["import_ms"], result["import_ms"]))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per module (median is reported)")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="allowed slowdown ratio against the baseline")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    report(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.threshold)
+        for key, before, after in slower:
+            print(f"REGRESSION {key}: {before:.1f}ms -> {after:.1f}ms")
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()